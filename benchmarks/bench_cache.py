@@ -0,0 +1,40 @@
+"""Parsed-tree cache benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_cache [size in bytes]
+
+Times loading a generated document (50 MB by default) with a cold cache,
+which parses the file and stores the tree, and with a warm cache, which
+loads the stored tree, then runs a `find` on the result.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import generate
+from dtl.cache import TreeCache, load_tree
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.dtl')
+        with open(path, 'w') as file:
+            file.write(generate(size))
+
+        cache = TreeCache(os.path.join(tmp, '.cache'))
+
+        for label in ['cold', 'warm']:
+            start = time.perf_counter()
+            tree = load_tree(path, cache)
+            loaded = time.perf_counter()
+            tree.find('gym', ongoing=True)
+            found = time.perf_counter()
+
+            print(f'{label}: load {loaded - start:.4f}s, find {found - loaded:.4f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Concurrent add benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_concurrent_add [size in bytes] [writers] [adds per writer]
+
+Starts several writer processes (8 by default) that each add entries (10 by
+default) to the same generated document (200 kB by default) as fast as they
+can, then checks that every entry made it into the file.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from functools import partial
+from multiprocessing import Process
+
+from benchmarks.corpus import generate
+from dtl.ast import Segment, Time
+from dtl.cache import TreeCache, load_tree
+from dtl.files import add_segment, write_file
+
+def writer(path: str, cache_dir: str, name: str, adds: int) -> None:
+    cache = TreeCache(cache_dir)
+    for i in range(adds):
+        add_segment(path, Segment(Time.now(), f'{name} {i}'), partial(load_tree, path, cache))
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    adds = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.dtl')
+        cache_dir = os.path.join(tmp, '.cache')
+        with open(path, 'w') as file:
+            file.write(generate(size))
+        write_file(path, load_tree(path))
+
+        processes = [Process(target=writer, args=(path, cache_dir, f'writer {w}', adds)) for w in range(writers)]
+
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        tree = load_tree(path)
+        found = sum(len(tree.find(f'writer {w} {i}')) for w in range(writers) for i in range(adds))
+
+        print(f'{writers * adds} adds in {elapsed:.3f}s ({writers * adds / elapsed:.1f} adds/s)')
+        print(f'{found} of {writers * adds} entries saved')
+
+if __name__ == '__main__':
+    main()
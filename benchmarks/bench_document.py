@@ -0,0 +1,52 @@
+"""Incremental reparse benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_document [size in bytes]
+
+Times parsing a generated, formatted document (1 MB by default), then
+typing into the descriptions of random entries through `Document.edit`, one
+character at a time, and checks that the result formats the same as
+parsing the edited source from scratch.
+"""
+
+import random
+import re
+import sys
+import time
+
+from benchmarks.corpus import generate
+from dtl.document import Document
+from dtl.parse import Parser
+
+EDITS = 1000
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    src = Parser().parse(generate(size)).format().encode()
+
+    start = time.perf_counter()
+    Parser().parse_buffer(src)
+    parse_time = time.perf_counter() - start
+    print(f'parse:    {parse_time * 1000:.1f}ms ({len(src)} bytes)')
+
+    start = time.perf_counter()
+    document = Document(src)
+    print(f'document: {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    # The ends of random descriptions, last first so that typing into one
+    # doesn't move the others.
+    ends = [found.end() - 1 for found in re.finditer(rb'\[[^\]]*\]', src)]
+    positions = sorted(random.Random(0).sample(ends, min(EDITS, len(ends))), reverse=True)
+
+    start = time.perf_counter()
+    for position in positions:
+        document.edit(position, 0, 'x')
+    edit_time = (time.perf_counter() - start) / len(positions)
+    print(f'edit:     {edit_time * 1_000_000:.0f}us per character ({parse_time / edit_time:.0f}x faster than parsing)')
+
+    assert document.tree.format() == Parser().parse_buffer(document.src).format()
+
+if __name__ == '__main__':
+    main()
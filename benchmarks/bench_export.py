@@ -0,0 +1,47 @@
+"""Columnar export benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_export [size in bytes]
+
+Times parsing a generated document (1 MB by default), writing it as a
+columnar file and loading the tree back from that file, and checks that the
+loaded tree formats the same as the parsed one.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import generate
+from dtl.export import load_columnar, write_columnar
+from dtl.parse import Parser
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    src = generate(size)
+
+    start = time.perf_counter()
+    tree = Parser().parse(src)
+    parse_time = time.perf_counter() - start
+    print(f'parse: {parse_time * 1000:.1f}ms ({len(src)} bytes)')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.dtlc')
+
+        start = time.perf_counter()
+        with open(path, 'wb') as out:
+            write_columnar(tree, out)
+        print(f'write: {(time.perf_counter() - start) * 1000:.1f}ms ({os.path.getsize(path)} bytes)')
+
+        start = time.perf_counter()
+        loaded = load_columnar(path)
+        load_time = time.perf_counter() - start
+        print(f'load:  {load_time * 1000:.1f}ms ({parse_time / load_time:.1f}x faster than parsing)')
+
+    assert loaded.format() == tree.format()
+
+if __name__ == '__main__':
+    main()
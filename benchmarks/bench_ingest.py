@@ -0,0 +1,74 @@
+"""Bulk ingest benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ingest [events] [format]
+
+Writes a file of generated events (1,000,000 by default, as JSON lines by
+default, or CSV) and times reading them, sorting them and adding them to a
+generated 1 MB document in a single write, like `dtl [file] ingest`.
+"""
+
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+from benchmarks.corpus import DESCRIPTIONS, generate
+from dtl.cache import load_tree
+from dtl.files import insert_segments
+from dtl.ingest import read_segments
+
+def write_events(path: str, count: int, fmt: str, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+
+    with open(path, 'w', newline='') as file:
+        if fmt == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(['timestamp', 'description', 'ongoing'])
+
+        for _ in range(count):
+            timestamp = (start + timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))).isoformat()
+            description = rng.choice(DESCRIPTIONS)
+            ongoing = rng.random() < 0.1
+
+            if fmt == 'csv':
+                writer.writerow([timestamp, description, str(ongoing).lower()])
+            else:
+                file.write(json.dumps({'timestamp': timestamp, 'description': description, 'ongoing': ongoing}) + '\n')
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    fmt = sys.argv[2] if len(sys.argv) > 2 else 'jsonl'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.dtl')
+        with open(path, 'w') as file:
+            file.write(generate(1_000_000))
+
+        events_path = os.path.join(tmp, f'events.{fmt}')
+        write_events(events_path, count, fmt)
+
+        tree = load_tree(path)
+
+        start = time.perf_counter()
+        with open(events_path, 'r', newline='') as events:
+            segments = list(read_segments(events, fmt))
+        segments.sort(key=lambda s: s.time.key)
+        read = time.perf_counter()
+
+        insert_segments(path, tree, segments)
+        written = time.perf_counter()
+
+        print(f'read and sort: {read - start:.3f}s ({(read - start) / count * 1e6:.2f}µs per event)')
+        print(f'insert and write: {written - read:.3f}s ({(written - read) / count * 1e6:.2f}µs per event)')
+        print(f'output: {os.path.getsize(path) / 1e6:.1f} MB')
+
+if __name__ == '__main__':
+    main()
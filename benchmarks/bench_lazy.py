@@ -0,0 +1,46 @@
+"""Lazy parsing benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_lazy [size in bytes]
+
+Times parsing a generated, formatted document (1 MB by default) with
+`Parser.parse` and with `Parser.parse_lazy`, then inserting an entry into
+the lazily parsed tree and writing it out, which only loads the block the
+entry goes into.
+"""
+
+import sys
+import time
+
+from io import StringIO
+from itertools import chain
+
+from benchmarks.corpus import generate
+from dtl.ast import LazySegment, Segment, Time
+from dtl.parse import Parser
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    src = Parser().parse(generate(size)).format().encode()
+
+    start = time.perf_counter()
+    Parser().parse_buffer(src)
+    print(f'parse:        {(time.perf_counter() - start) * 1000:.1f}ms ({len(src)} bytes)')
+
+    start = time.perf_counter()
+    tree = Parser().parse_lazy(src)
+    print(f'parse_lazy:   {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    start = time.perf_counter()
+    tree.insert_segment(Segment(Time.from_units(2000, 5, 10, 12 * 60), 'bench'))
+    tree.validate(tree.header_time)
+    tree.write(StringIO())
+    print(f'insert+write: {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    lazy = [s for s in chain.from_iterable(tree.segments.values()) if isinstance(s, LazySegment)]
+    print(f'loaded {sum(s.loaded for s in lazy)} of {len(lazy)} top-level blocks')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Parallel parsing benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_parallel_parse [size in bytes] [workers]
+
+Compares Parser.parse with Parser.parse_parallel on a generated document
+(20 MB by default) using the given number of worker processes (all cores by
+default). Speedups need a machine with several cores; an 8-core box is the
+reference setup.
+"""
+
+import os
+import sys
+import time
+
+from benchmarks.corpus import generate
+from dtl.parse import Parser
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+
+    src = generate(size)
+
+    start = time.perf_counter()
+    serial = Parser().parse(src)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = Parser().parse_parallel(src, workers=workers)
+    parallel_time = time.perf_counter() - start
+
+    assert serial.format() == parallel.format()
+
+    print(f'serial:   {serial_time:.3f}s')
+    print(f'parallel: {parallel_time:.3f}s ({workers} workers, {serial_time / parallel_time:.2f}x)')
+
+if __name__ == '__main__':
+    main()
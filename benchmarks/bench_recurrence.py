@@ -0,0 +1,93 @@
+"""Recurring entry benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_recurrence [entries per weekday]
+
+Adds a weekly schedule (10 entries per weekday by default) to a generated
+year of dated entries, then times `File.between` over a week, a month and
+the whole year: the first query, which expands the weekday entries into
+their occurrences, and the same query again, which looks them up. For
+comparison, it also times expanding the weekday entries alone over the year,
+and finding the same occurrences by checking every day of the year against
+every weekday entry.
+"""
+
+import sys
+import time
+
+from datetime import date
+from typing import Callable
+
+from benchmarks.corpus import DESCRIPTIONS, generate, time_str
+from dtl.ast import File
+from dtl.parse import Parser
+from dtl.recurrence import Recurrences
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+RUNS = 5
+
+def schedule(per_weekday: int) -> str:
+    lines = []
+    for weekday in WEEKDAYS:
+        lines.append(f'@{weekday}\n')
+        for i in range(per_weekday):
+            start = 6 * 60 + i * 60
+            lines.append(f'\t@{time_str(start)}-{time_str(start + 45)} [{DESCRIPTIONS[i % len(DESCRIPTIONS)]}]\n')
+
+    return ''.join(lines)
+
+def timed(fn: Callable[[], object]) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+def main() -> None:
+    per_weekday = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    src = schedule(per_weekday) + generate(years=1)
+    tree: File = Parser().parse(src)
+    parse_time = Parser(debug = False).parse_time_str
+
+    ranges = {
+        'week': (parse_time('2000 January 3rd'), parse_time('2000 January 9th')),
+        'month': (parse_time('2000 March'), parse_time('2000 March')),
+        'year': (parse_time('2000'), parse_time('2000')),
+    }
+
+    print(f'{"range":<8} {"entries":>8} {"first":>10} {"again":>10}')
+    for label, (start, end) in ranges.items():
+        first = again = float('inf')
+        for _ in range(RUNS):
+            # A fresh index, and with it no occurrences yet.
+            tree._time_index = None
+            tree.between(start, end)
+            tree.time_index.recurrences.occurrences.clear()
+            tree.time_index.recurrences.calendar.clear()
+
+            seconds, found = timed(lambda: tree.between(start, end))
+            first = min(first, seconds)
+            again = min(again, timed(lambda: tree.between(start, end))[0])
+
+        print(f'{label:<8} {len(found):>8} {first * 1000:>8.2f}ms {again * 1000:>8.2f}ms')
+
+    # The occurrences of the year alone, found a week at a time and a day at a time.
+    segments = [rule.segment for rule in tree.time_index.recurrences.rules]
+    def daily() -> None:
+        recurrences = Recurrences(segments)
+        day, last = date(2000, 1, 1).toordinal(), date(2000, 12, 31).toordinal()
+        while day <= last:
+            weekday = date.fromordinal(day).weekday()
+            for rule in recurrences.rules:
+                if rule.weekday == weekday:
+                    recurrences.occurrence(rule, day)
+            day += 1
+
+    start, end = ranges['year']
+    expanded = min(timed(lambda: Recurrences(segments).between(start, end))[0] for _ in range(RUNS))
+    seconds = min(timed(daily)[0] for _ in range(RUNS))
+    print(f'\nexpanding the weekday entries over the year: {expanded * 1000:.2f}ms by week, {seconds * 1000:.2f}ms a day at a time')
+
+if __name__ == '__main__':
+    main()
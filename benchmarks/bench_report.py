@@ -0,0 +1,62 @@
+"""Report benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_report [size in bytes]
+
+Times building the span arrays of a generated document (1 MB by default),
+then aggregating them per day, week and month over the whole document, with
+NumPy if it is installed and with the pure-Python fallback.
+
+It first checks that an overnight period, e.g. `@22:00-6:00`, is counted
+until the next morning however its date is written: in the entry itself,
+by an enclosing segment or by the file's header.
+"""
+
+import sys
+import time
+
+import dtl.report
+from benchmarks.corpus import generate
+from dtl.parse import Parser
+from dtl.report import PERIODS, Spans, period_bounds
+
+OVERNIGHT = [
+    '@2022 August 9th 22:00-6:00 [sleep]\n',
+    '@2022 August 9th\n\t@22:00-6:00 [sleep]\n',
+    'for 2022:\n\n@August\n\t@9th\n\t\t@22:00-6:00 [sleep]\n',
+]
+
+def check_overnight() -> None:
+    for src in OVERNIGHT:
+        spans = Spans(Parser(debug = False).parse(src))
+        lo, hi = spans.bounds()
+        assert hi - lo == 8 * 60, src
+        assert spans.aggregate(period_bounds(lo, hi, 'day')) == [[2 * 60], [6 * 60]], src
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    check_overnight()
+
+    tree = Parser().parse(generate(size))
+
+    backends = ['numpy', 'python'] if dtl.report.numpy is not None else ['python']
+    for backend in backends:
+        if backend == 'python':
+            dtl.report.numpy = None
+
+        start = time.perf_counter()
+        spans = Spans(tree)
+        print(f'{backend}: build {(time.perf_counter() - start) * 1000:.1f}ms ({len(spans)} spans)')
+
+        lo, hi = spans.bounds()
+        for period in PERIODS:
+            bounds = period_bounds(lo, hi, period)
+
+            start = time.perf_counter()
+            spans.aggregate(bounds)
+            print(f'{backend}: {period} {(time.perf_counter() - start) * 1000:.1f}ms ({len(bounds) - 1} periods)')
+
+if __name__ == '__main__':
+    main()
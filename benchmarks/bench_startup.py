@@ -0,0 +1,82 @@
+"""CLI startup benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup
+
+Runs `dtl --version`, `dtl --help`, `dtl [file] create` and `dtl [file] find`
+on a small file in fresh processes with a temporary home directory. For each
+it prints the best wall time, the time spent importing modules as reported
+by `python -X importtime`, and which of the modules DTL only imports when a
+command needs them were loaded.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import generate
+
+RUNS = 10
+
+# Modules that are slow to import, or only needed by some commands.
+DEFERRED = ['typing', 'configparser', 'json', 'socket', 'tempfile', 'concurrent.futures', 'dtl.ast', 'dtl.parse', 'dtl.cache']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_times(stderr: str) -> dict[str, tuple[int, bool]]:
+    """The cumulative import time in microseconds of every module in the
+    output of `python -X importtime`, and whether it was imported at the top
+    level rather than by another module."""
+    times: dict[str, tuple[int, bool]] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        times[name.strip()] = (int(cumulative), not name.startswith('  '))
+
+    return times
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as home:
+        os.mkdir(os.path.join(home, '.DTL'))
+        with open(os.path.join(home, '.DTL', 'bench.dtl'), 'w') as file:
+            file.write(generate(10_000))
+
+        env = dict(os.environ, HOME=home, PYTHONPATH=ROOT)
+        new_file = os.path.join(home, '.DTL', 'new.dtl')
+        dtl = [sys.executable, '-c', 'from dtl.cli import main; main()']
+        commands = {
+            '--version': ['--version'],
+            '--help': ['--help'],
+            'create': ['@new', 'create'],
+            'find': ['@bench', 'find', 'gym'],
+        }
+
+        print(f'{"command":<12} {"wall":>8} {"imports":>8}  deferred modules loaded')
+        for label, args in commands.items():
+            best = float('inf')
+            for _ in range(RUNS):
+                if os.path.exists(new_file):
+                    os.remove(new_file)
+
+                start = time.perf_counter()
+                subprocess.run([*dtl, *args], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+                best = min(best, time.perf_counter() - start)
+
+            if os.path.exists(new_file):
+                os.remove(new_file)
+
+            # Modules imported by site before DTL starts aren't counted.
+            result = subprocess.run([sys.executable, '-X', 'importtime', *dtl[1:], *args], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+            times = import_times(result.stderr)
+            total = sum(us for name, (us, top_level) in times.items() if top_level and name not in ['site', 'encodings'])
+            loaded = [name for name in DEFERRED if name in times]
+
+            print(f'{label:<12} {best * 1000:>6.1f}ms {total / 1000:>6.1f}ms  {", ".join(loaded) or "-"}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Time microbenchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_time
+
+Times hashing, comparing and containment checks between Time objects, the
+operations behind every segment dict lookup, sort and insertion.
+"""
+
+import random
+import timeit
+
+from dtl.ast import Time
+from benchmarks.corpus import MONTHS, date_str
+
+def random_time(rng: random.Random) -> Time:
+    values = {'YEAR': str(rng.randint(2000, 2030))}
+    if rng.random() < 0.9:
+        values['MONTH'] = rng.choice(MONTHS)
+    if rng.random() < 0.8:
+        values['DATE'] = date_str(rng.randint(1, 28))
+    if rng.random() < 0.7:
+        values['TIME'] = f'{rng.randint(0, 23)}:{rng.randint(0, 59):02}'
+    return Time(values)
+
+def main() -> None:
+    rng = random.Random(0)
+    times = [random_time(rng) for _ in range(10_000)]
+    pairs = list(zip(times, reversed(times)))
+
+    benchmarks = {
+        'hash':     lambda: [hash(t) for t in times],
+        'eq':       lambda: [a == b for a, b in pairs],
+        'lt':       lambda: [a < b for a, b in pairs],
+        'contains': lambda: [a.contains(b) for a, b in pairs],
+        'sort':     lambda: sorted(times),
+        'dict':     lambda: {t: None for t in times},
+    }
+
+    for name, fn in benchmarks.items():
+        seconds = min(timeit.repeat(fn, number=10, repeat=5)) / 10
+        print(f'{name:>10}: {seconds * 1e3:8.3f} ms per 10k')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Tokenizer scaling benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_tokenize [max size in bytes]
+
+Prints the time taken to tokenize generated documents from 1 KB up to the
+given size (100 MB by default), along with the throughput. Linear scaling
+shows up as a roughly constant MB/s column.
+"""
+
+import sys
+import time
+
+from benchmarks.corpus import generate
+from dtl.tokenize import Lexer
+
+def bench(size: int) -> tuple[int, float]:
+    src = generate(size)
+    lexer = Lexer()
+
+    start = time.perf_counter()
+    lexer.tokenize(src)
+    elapsed = time.perf_counter() - start
+
+    return len(src), elapsed
+
+def main() -> None:
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000_000
+
+    print(f'{"size":>12} {"seconds":>10} {"MB/s":>8}')
+    size = 1_000
+    while size <= max_size:
+        length, elapsed = bench(size)
+        print(f'{length:>12} {elapsed:>10.4f} {length / elapsed / 1e6:>8.2f}')
+        size *= 10
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Validation and formatting benchmark on wide, flat files.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_validate [max entries]
+
+Builds a file holding N top-level entries at distinct times (half of them
+nested in untagged day segments, which get merged) and times File.validate and
+File.format. Linear behaviour shows up as a roughly constant time per entry.
+"""
+
+import sys
+import time
+
+from benchmarks.corpus import MONTHS, date_str
+from dtl.ast import File, Segment, Time
+
+def wide_file(entries: int) -> File:
+    segments: list[Segment] = []
+    for i in range(entries):
+        minutes = i % (24 * 60)
+        day = Time({'YEAR': str(2000 + i // (24 * 60 * 28 * 12)), 'MONTH': MONTHS[i // (24 * 60 * 28) % 12], 'DATE': date_str(i // (24 * 60) % 28 + 1)})
+        entry = Segment(Time({'TIME': f'{minutes // 60}:{minutes % 60:02}'}, parent=day), f'entry {i}')
+        if i % 2 == 0:
+            segments.append(Segment(Time({}, parent=day), None, [entry]))
+        else:
+            segments.append(entry)
+
+    return File(Time({}), segments)
+
+def main() -> None:
+    max_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    print(f'{"entries":>10} {"validate":>10} {"format":>10} {"us/entry":>10}')
+    entries = 1_000
+    while entries <= max_entries:
+        tree = wide_file(entries)
+
+        start = time.perf_counter()
+        tree.validate(tree.header_time)
+        validated = time.perf_counter()
+        tree.format()
+        formatted = time.perf_counter()
+
+        per_entry = (formatted - start) / entries * 1e6
+        print(f'{entries:>10} {validated - start:>10.4f} {formatted - validated:>10.4f} {per_entry:>10.2f}')
+        entries *= 10
+
+if __name__ == '__main__':
+    main()
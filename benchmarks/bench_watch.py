@@ -0,0 +1,78 @@
+"""Watch latency benchmark.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_watch [size in bytes]
+
+Starts `dtl [file] watch` on a generated, formatted document (1 MB by
+default), then appends entries to it one at a time and times how long each
+takes to come out as an event, compared to parsing the whole file, which
+polling with `dtl find` would take per check.
+"""
+
+import os
+import select
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import generate
+from dtl.parse import Parser
+
+APPENDS = 50
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    src = Parser().parse(generate(size)).format()
+
+    start = time.perf_counter()
+    Parser().parse(src)
+    parse_time = time.perf_counter() - start
+    print(f'parse:   {parse_time * 1000:.1f}ms ({len(src)} bytes)')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.dtl')
+        with open(path, 'w') as file:
+            file.write(src)
+
+        watcher = subprocess.Popen(
+            [sys.executable, '-m', 'dtl.cli', path, 'watch'],
+            cwd=ROOT, env=dict(os.environ, HOME=tmp, PYTHONPATH=ROOT),
+            stdout=subprocess.PIPE, text=True,
+        )
+        try:
+            def append(description: str) -> None:
+                # Last in the last day of the generated document.
+                with open(path, 'a') as file:
+                    file.write(f'\t\t\t@23:00 [{description}]\n')
+
+            # Entries appended before the watcher has read the file don't
+            # come out as events.
+            while True:
+                append('ready')
+                if select.select([watcher.stdout], [], [], 0.5)[0]:
+                    watcher.stdout.readline()
+                    break
+
+            latencies = []
+            for i in range(APPENDS):
+                start = time.perf_counter()
+                append(f'bench {i}')
+                # Skipping the events of the last entries appended while waiting.
+                while f'"bench {i}"' not in watcher.stdout.readline():
+                    pass
+                latencies.append(time.perf_counter() - start)
+        finally:
+            watcher.terminate()
+            watcher.wait()
+
+    median = statistics.median(latencies)
+    print(f'event:   {median * 1000:.1f}ms median, {max(latencies) * 1000:.1f}ms max per appended entry ({parse_time / median:.0f}x faster than parsing)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Synthetic DTL corpus generator.
+
+Run from the repository root to write a corpus to stdout:
+
+    python -m benchmarks.corpus [size in bytes] [--years N] [--depth D] ...
+
+See `python -m benchmarks.corpus --help` for the shape options, which are
+the keyword arguments of `generate`.
+"""
+
+import argparse
+import random
+import sys
+
+MONTHS = [
+    'January', 'February', 'March', 'April',
+    'May', 'June', 'July', 'August',
+    'September', 'October', 'November', 'December'
+]
+
+DESCRIPTIONS = ['work', 'lunch', 'meeting', 'gym', 'reading', 'commute', 'call', 'review']
+
+# Options written under a command, in order, up to `options` of them.
+OPTIONS = ['#remind 5 minutes', '#with [someone]', '#at [somewhere]', '#repeat 2 hours']
+
+# Minutes between the starts of a day's entries, at most; entries start at 8:00.
+ENTRY_SPACING = 120
+
+def date_str(date: int) -> str:
+    if date in [1, 21, 31]:
+        return f'{date}st'
+    elif date in [2, 22]:
+        return f'{date}nd'
+    elif date in [3, 23]:
+        return f'{date}rd'
+    else:
+        return f'{date}th'
+
+def time_str(minutes: int) -> str:
+    return f'{minutes // 60}:{minutes % 60:02}'
+
+def generate(
+    size: int | None = None,
+    seed: int = 0,
+    *,
+    years: int | None = None,
+    depth: int = 4,
+    entries_per_day: int = 5,
+    period_ratio: float = 1.0,
+    ongoing_ratio: float = 0.0,
+    command_ratio: float = 0.2,
+    options: int = 1,
+) -> str:
+    """Generate a DTL document of at least `size` characters, or of `years`
+    whole years, ending on a whole day.
+
+    Each day of the first 28 of every month has `entries_per_day` entries,
+    a `period_ratio` of them with a time period and an `ongoing_ratio` of
+    them ongoing instead, and a `command_ratio` of them with a note command
+    that has `options` options. `depth` is how many levels entries are
+    nested in: 4 nests them in year, month and date segments, 1 writes the
+    whole time on every entry.
+    """
+    if size is None and years is None:
+        raise ValueError('either a size or a number of years is needed')
+    if not 1 <= depth <= 4:
+        raise ValueError('depth must be between 1 and 4')
+
+    rng = random.Random(seed)
+
+    lines: list[str] = []
+    length = 0
+
+    def emit(line: str) -> None:
+        nonlocal length
+        lines.append(line)
+        length += len(line)
+
+    spacing = max(1, min(ENTRY_SPACING, (24 - 8) * 60 // max(1, entries_per_day)))
+
+    previous: list[list[str]] = []
+
+    year = 2000
+    while years is None or year < 2000 + years:
+        for month in MONTHS:
+            for date in range(1, 29):
+                # The units of the day, grouped into the headers of the
+                # segments entries are nested in, the rest going on entries.
+                units = [str(year), month, date_str(date)]
+                headers = [[unit] for unit in units[:depth-1]]
+                if len(headers) > 0:
+                    headers[-1] += units[depth-1:]
+
+                # Only the headers that changed since the previous day.
+                for level, header in enumerate(headers):
+                    if headers[:level+1] != previous[:level+1]:
+                        emit('\t' * level + '@' + ' '.join(header) + '\n')
+                previous = headers
+
+                indent = '\t' * len(headers)
+                prefix = ' '.join(units[depth-1:]) + ' ' if depth == 1 else ''
+                for i in range(entries_per_day):
+                    start = 8 * 60 + i * spacing
+                    description = rng.choice(DESCRIPTIONS)
+
+                    if ongoing_ratio > 0 and rng.random() < ongoing_ratio:
+                        entry_time = time_str(start) + '...'
+                    elif period_ratio >= 1 or rng.random() < period_ratio:
+                        entry_time = f'{time_str(start)}-{time_str(start + spacing * 3 // 4)}'
+                    else:
+                        entry_time = time_str(start)
+
+                    emit(f'{indent}@{prefix}{entry_time} [{description}]\n')
+                    if rng.random() < command_ratio:
+                        emit(f'{indent}\t!note [generated entry]\n')
+                        for option in OPTIONS[:options]:
+                            emit(f'{indent}\t\t{option}\n')
+
+                if size is not None and length >= size:
+                    return ''.join(lines)
+        year += 1
+
+    return ''.join(lines)
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of `generate` to `parser`, for `options` to read back."""
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=4, help='levels entries are nested in, 1 to 4 (default 4)')
+    parser.add_argument('--entries-per-day', type=int, default=5)
+    parser.add_argument('--period-ratio', type=float, default=1.0, help='share of entries with a time period')
+    parser.add_argument('--ongoing-ratio', type=float, default=0.0, help='share of entries that are ongoing')
+    parser.add_argument('--command-ratio', type=float, default=0.2, help='share of entries with a command')
+    parser.add_argument('--options', type=int, default=1, help=f'options per command, up to {len(OPTIONS)}')
+
+def options(args: argparse.Namespace) -> dict:
+    """The keyword arguments of `generate` given on the command line."""
+    return {
+        'seed': args.seed,
+        'depth': args.depth,
+        'entries_per_day': args.entries_per_day,
+        'period_ratio': args.period_ratio,
+        'ongoing_ratio': args.ongoing_ratio,
+        'command_ratio': args.command_ratio,
+        'options': args.options,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.corpus', description='Write a generated DTL document to stdout.')
+    parser.add_argument('size', type=int, nargs='?', help='size in bytes')
+    parser.add_argument('--years', type=int, help='number of whole years, instead of a size')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.size is None and args.years is None:
+        parser.error('either a size or --years is needed')
+
+    sys.stdout.write(generate(args.size, years=args.years, **options(args)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Benchmark suite.
+
+Run from the repository root:
+
+    python -m benchmarks.suite [--sizes N ...] [--output results.json]
+                               [--compare baseline.json] [--threshold 0.2]
+
+Generates a corpus of every size (100 kB and 1 MB by default; see
+`python -m benchmarks.corpus --help` for its shape options, which the suite
+takes too) and times tokenizing, parsing, validating, formatting, finding
+and inserting into it, then running the CLI commands on it end to end, each
+in a fresh process with a temporary home directory. Every timing is the best
+of `--repeat` runs.
+
+Results are written to `--output` as JSON. With `--compare`, each result is
+also compared to the same result in an earlier run, and the suite fails if
+any is more than `--threshold` slower.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timezone
+from typing import Callable
+
+from benchmarks import corpus
+from dtl.ast import File, Segment, Time
+from dtl.parse import Parser
+from dtl.tokenize import Lexer
+
+# Entries inserted per run of the insert_segment benchmark.
+INSERTS = 1000
+
+# Where the CLI runs from, so that `python -m dtl.cli` is this tree's DTL.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+type Result = dict[str, str | int | float]
+
+def best_of(repeat: int, fn: Callable[[], None], setup: Callable[[], None] = lambda: None) -> float:
+    """The least time `fn` takes over `repeat` runs, calling `setup` untimed before each."""
+    best = float('inf')
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+def unvalidated(src: str) -> File:
+    parser = Parser()
+    parser.lexer.tokenize(src)
+    header_time = parser.parse_header()
+    return File(header_time, parser.parse_segments(header_time))
+
+def library_benchmarks(src: str, repeat: int) -> dict[str, float]:
+    """Seconds taken by each stage on the document `src`."""
+    results: dict[str, float] = {}
+
+    results['tokenize'] = best_of(repeat, lambda: Lexer().tokenize(src))
+    results['parse'] = best_of(repeat, lambda: Parser().parse(src))
+
+    trees: list[File] = []
+    results['validate'] = best_of(
+        repeat,
+        lambda: trees[-1].validate(trees[-1].header_time),
+        lambda: trees.append(unvalidated(src)),
+    )
+
+    tree = trees[-1]
+    trees.clear()
+    results['format'] = best_of(repeat, tree.format)
+
+    def drop_index() -> None:
+        tree._description_index = None
+    results['find'] = best_of(repeat, lambda: tree.find('gym', ongoing=False), drop_index)
+
+    # Late in the first month, which every corpus has, after the entries of the day.
+    segments = [Segment(Time.from_units(2000, 1, 1 + i % 28, 23 * 60 + i % 60), 'bench') for i in range(INSERTS)]
+    tree.time_index
+    def insert() -> None:
+        for segment in segments:
+            tree.insert_segment(segment)
+    results['insert_segment'] = best_of(repeat, insert) / INSERTS
+
+    return results
+
+def cli_benchmarks(src: str, repeat: int) -> dict[str, float]:
+    """Seconds taken by each CLI command on the document `src`, in a new process."""
+    results: dict[str, float] = {}
+
+    with tempfile.TemporaryDirectory() as home:
+        dtl_dir = os.path.join(home, '.DTL')
+        os.mkdir(dtl_dir)
+        path = os.path.join(dtl_dir, 'bench.dtl')
+        env = dict(os.environ, HOME=home, PYTHONPATH=ROOT)
+
+        def dtl(*args: str) -> Callable[[], None]:
+            def run() -> None:
+                subprocess.run([sys.executable, '-m', 'dtl.cli', *args], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+            return run
+
+        def restore() -> None:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(src)
+            shutil.rmtree(os.path.join(dtl_dir, '.cache'), ignore_errors=True)
+
+        def cold() -> None:
+            shutil.rmtree(os.path.join(dtl_dir, '.cache'), ignore_errors=True)
+
+        # Startup alone, see also benchmarks.bench_startup.
+        results['cli --version'] = best_of(repeat, dtl('--version'))
+
+        restore()
+        results['cli format'] = best_of(repeat, dtl('@bench', 'format'), restore)
+        results['cli find'] = best_of(repeat, dtl('@bench', 'find', 'gym'), cold)
+        dtl('@bench', 'find', 'gym')()
+        results['cli find (cached)'] = best_of(repeat, dtl('@bench', 'find', 'gym'))
+        results['cli range'] = best_of(repeat, dtl('@bench', 'range', '2000 January 1st', '2000 January 7th'), cold)
+        results['cli add'] = best_of(repeat, dtl('@bench', 'add', 'bench'), restore)
+        restore()
+        results['cli export'] = best_of(repeat, dtl('@bench', 'export', os.path.join(home, 'bench.jsonl')), cold)
+
+    return results
+
+def compare(results: list[Result], baseline: list[Result], threshold: float) -> bool:
+    """Print how `results` compare to `baseline`; return False if any is
+    more than `threshold` slower."""
+    previous = {(r['name'], r['corpus']): r['seconds'] for r in baseline}
+    width = max(len(f'{r["name"]} ({r["corpus"]})') for r in results)
+
+    ok = True
+    for result in results:
+        label = f'{result["name"]} ({result["corpus"]})'
+        before = previous.get((result['name'], result['corpus']))
+        if before is None:
+            print(f'{label:<{width}}  (new)')
+            continue
+
+        ratio = result['seconds'] / before if before > 0 else 1.0
+        regressed = ratio > 1 + threshold
+        ok = ok and not regressed
+        print(f'{label:<{width}}  {ratio:>6.2f}x' + ('  REGRESSION' if regressed else ''))
+
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description='Time DTL on generated corpora.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000], help='corpus sizes in bytes')
+    parser.add_argument('--years', type=int, nargs='+', help='corpus lengths in whole years, instead of sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the best of which is kept')
+    parser.add_argument('--no-cli', action='store_true', help='skip the end-to-end CLI benchmarks')
+    parser.add_argument('--output', help='file to write the results to as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='results of an earlier run to compare to')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown over the baseline that fails the suite (default 0.2)')
+    corpus.add_arguments(parser)
+    args = parser.parse_args()
+
+    shape = corpus.options(args)
+    if args.years is not None:
+        corpora = [(f'{years}y', corpus.generate(years=years, **shape)) for years in args.years]
+    else:
+        corpora = [(str(size), corpus.generate(size, **shape)) for size in args.sizes]
+
+    results: list[Result] = []
+    for label, src in corpora:
+        timings = library_benchmarks(src, args.repeat)
+        if not args.no_cli:
+            timings.update(cli_benchmarks(src, args.repeat))
+
+        for name, seconds in timings.items():
+            results.append({'name': name, 'corpus': label, 'bytes': len(src.encode()), 'seconds': seconds})
+            print(f'{name:<20} {label:>10} {seconds * 1000:>12.3f}ms')
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'metadata': {
+                    'date': datetime.now(timezone.utc).isoformat(),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'repeat': args.repeat,
+                    'corpus': shape,
+                },
+                'results': results,
+            }, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        print()
+        if baseline['metadata']['corpus'] != shape:
+            print(f'Warning: {args.compare} was run on corpora of another shape\n')
+        if not compare(results, baseline['results'], args.threshold):
+            exit(1)
+
+if __name__ == '__main__':
+    main()
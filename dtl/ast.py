@@ -1,8 +1,11 @@
 from __future__ import annotations
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from collections import defaultdict
-from functools import reduce
-from operator import concat
+from io import StringIO
+from itertools import chain
+from typing import TextIO
+
+from dtl.index import DescriptionIndex, TimeIndex
 
 class File:
     def __init__(self, header_time: Time, segments: list[Segment]) -> None:
@@ -12,53 +15,121 @@ class File:
         for segment in segments:
             self.segments[segment.time].append(segment)
 
+        self._time_index: TimeIndex | None = None
+        self._description_index: DescriptionIndex | None = None
+
+    @property
+    def time_index(self) -> TimeIndex:
+        if self._time_index is None:
+            self._time_index = TimeIndex(self)
+        return self._time_index
+
+    @property
+    def description_index(self) -> DescriptionIndex:
+        if self._description_index is None:
+            self._description_index = DescriptionIndex(self)
+        return self._description_index
+
     def find(
         self,
         description: str,
         ongoing: bool | None = None,
         with_parent: bool = False,
+        mode: str = 'exact',
     ) -> list[Segment] | list[tuple[Segment, Segment | File]]:
-        finds: list = []
-        for sub_time in self.segments.keys():
-            for segment in self.segments[sub_time]:
-                segment.find(description, finds, ongoing=ongoing, with_parent=with_parent, parent_ref=self)
+        finds = self.description_index.find(description, ongoing=ongoing, mode=mode)
 
-        return finds
+        if with_parent:
+            return finds
+        else:
+            return [segment for segment, _ in finds]
 
     def insert_segment(self, segment: Segment) -> bool:
-        if not self.header_time.contains(segment.time):
+        path = self.time_index.path(segment.time)
+        if path is None:
             return False
 
-        for sub_time in self.segments.keys():
-            for seg in self.segments[sub_time]:
-                if seg.insert_segment(segment):
-                    return True
-
-        self.segments[segment.time].append(segment)
+        parent = path[-1]
+        last = next(reversed(parent.segments), None)
+        if last is not None and last.weekday is not None and segment.time.weekday is None and segment.time not in parent.segments:
+            # Weekdays sort after dates, so the new time goes before them.
+            weekdays = {time: parent.segments.pop(time) for time in list(parent.segments) if time.weekday is not None}
+            parent.segments[segment.time].append(segment)
+            parent.segments.update(weekdays)
+            self.time_index.remove(parent)
+        else:
+            parent.segments[segment.time].append(segment)
+            self.time_index.add(parent, segment)
+        if self._description_index is not None and not self._description_index.insert(segment, path):
+            self._description_index = None
         return True
 
+    def remove_segment(self, segment: Segment, parent: File | Segment) -> None:
+        segments = [seg for seg in parent.segments[segment.time] if seg is not segment]
+        if len(segments) > 0:
+            parent.segments[segment.time] = segments
+        else:
+            del parent.segments[segment.time]
+
+        self.time_index.remove(parent)
+        if self._description_index is not None:
+            self._description_index.remove(segment)
+
+    def append_position(self, segment: Segment) -> tuple[Time, int] | None:
+        """Find where `insert_segment` would put `segment` in the formatted file.
+
+        Returns the scope time and indentation `segment` would be formatted
+        with if it would end up last in the file, or None otherwise.
+        """
+        path = self.time_index.path(segment.time)
+        if path is None:
+            return None
+
+        for node, container in zip(path, path[1:]):
+            last = next(segs[-1] for segs in reversed(node.segments.values()) if len(segs) > 0)
+            if container is not last:
+                return None
+
+        # Validation sorts the parent's segments by time, puts untagged
+        # segments after the tagged ones at the same time, and drops empty ones.
+        if segment.description is None and segment.is_empty():
+            return None
+
+        parent = path[-1]
+        last_time = next((sub_time for sub_time, segs in reversed(parent.segments.items()) if len(segs) > 0), None)
+        if last_time is not None and segment.time < last_time:
+            return None
+        if any(seg.description is None and seg.commands == [] for seg in parent.segments.get(segment.time, [])):
+            return None
+
+        if len(path) == 1:
+            return self.header_time, 0
+
+        return parent.time, len(path) - 1
+
+    def between(self, start: Time, end: Time) -> list[Segment]:
+        return self.time_index.between(start, end)
+
     def __repr__(self) -> str:
         return 'File(' + str(self.header_time) + ', ' + str(self.segments) + ')'
 
     def format(self) -> str:
-        fstr = ''
+        out = StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, out: TextIO) -> None:
+        """Write the formatted file to `out` one line at a time."""
         if self.header_time.year is not None:
-            fstr += f'for {self.header_time.format(Time({}))}:\n\n'
-        fstr += ''.join([segment.format(self.header_time) for segment in reduce(concat, self.segments.values(), [])])
-        return fstr
+            out.write(f'for {self.header_time.format(Time({}))}:\n\n')
+        for segment in chain.from_iterable(self.segments.values()):
+            segment.write(out, self.header_time)
 
     def validate(self, header_time: Time) -> None:
-        self.segments = defaultdict(list, {k: reduce(lambda acc, s: s.merge_into(acc), v, {'tagged': [], 'merged': Segment(k, None, [], [], False)}) for k, v in self.segments.items()})
-
-        def filter_empty(v):
-            if len(v.segments) == 0:
-                return []
-            else:
-                return [v]
+        self._time_index = None
+        self._description_index = None
 
-        self.segments = defaultdict(list, {k: v['tagged'] + filter_empty(v['merged']) for k, v in self.segments.items()})
-
-        self.segments = defaultdict(list, dict(sorted(self.segments.items())))
+        self.segments = normalize_segments(self.segments)
 
         for sub_time in self.segments.keys():
             for segment in self.segments[sub_time]:
@@ -96,6 +167,8 @@ class Segment:
                 segment.find(description, finds, ongoing=ongoing, with_parent=with_parent, parent_ref=self)
 
     def create_entry(self, time: Time, description: str, ongoing: bool = False) -> bool:
+        """Add an entry at `time` under the first segment containing it,
+        looking through the children one by one (see `insert_segment`)."""
         if not self.time.contains(time):
             return False
 
@@ -110,6 +183,12 @@ class Segment:
         return True
 
     def insert_segment(self, segment: Segment) -> bool:
+        """Add `segment` under the first segment containing its time,
+        looking through the children one by one.
+
+        A segment keeps no index of its own; `File.insert_segment` finds the
+        place of a segment at any depth through the file's `TimeIndex`.
+        """
         if not self.time.contains(segment.time):
             return False
 
@@ -124,16 +203,19 @@ class Segment:
     def __repr__(self):
         return 'Segment(' + str(self.time) + ', ' + (self.description or '') + ', ' + str(self.segments) + ', ' + str(self.commands) + ', ' + str(self.ongoing) + ')'
 
-    def merge_into(self, segments):
-        if self.description is None and self.commands == []:
-            for time, seg in self.segments.items():
-                segments['merged'].segments[time] += seg
-        else:
-            segments['tagged'].append(self)
-
-        return segments
-
     def format(self, scope_time: Time, tab: int = 0) -> str:
+        out = StringIO()
+        self.write(out, scope_time, tab)
+        return out.getvalue()
+
+    def write(self, out: TextIO, scope_time: Time, tab: int = 0) -> None:
+        out.write(self.format_header(scope_time, tab))
+        for cmd in self.commands:
+            cmd.write(out, tab+1)
+        for segment in chain.from_iterable(self.segments.values()):
+            segment.write(out, self.time, tab+1)
+
+    def format_header(self, scope_time: Time, tab: int = 0) -> str:
         fstr = '\t' * tab
         fstr += f'@{self.time.format(scope_time)}'
         if self.ongoing:
@@ -141,28 +223,150 @@ class Segment:
         if self.description != None:
             fstr += f' [{self.description}]'
         fstr += '\n'
-        fstr += ''.join([cmd.format(tab+1)  for cmd  in self.commands])
-        fstr += ''.join([segment.format(self.time, tab+1) for segment in reduce(concat, self.segments.values(), [])])
         return fstr
 
     def validate(self, scope_time: Time) -> None:
-        self.segments = defaultdict(list, {k: reduce(lambda acc, s: s.merge_into(acc), v, {'tagged': [], 'merged': Segment(k, None, [], [], False)}) for k, v in self.segments.items()})
+        self.segments = normalize_segments(self.segments)
+
+        for sub_time in self.segments:
+            for segment in self.segments[sub_time]:
+                segment.validate(self.time)
+
+    def is_empty(self) -> bool:
+        """Whether the segment has no commands and no segments."""
+        return len(self.commands) == 0 and len(self.segments) == 0
+
+class LazySegment(Segment):
+    """A top-level segment whose block is parsed the first time its
+    `segments` or `commands` are used, as made by `Parser.parse_lazy`.
+
+    Until then it only holds the source of its file and the span of its
+    block there, which `write` copies as is. Its children are validated when
+    they are parsed, so `validate` leaves an unloaded segment alone.
+    """
+    def __init__(self, time: Time, description: str | None, ongoing: bool, source: bytes, block: tuple[int, int]) -> None:
+        self.time = time
+        self.description = description
+        self.ongoing = ongoing
+
+        # The source is dropped once the block is loaded.
+        self.source: bytes | None = source
+        self.block = block
+
+    @property
+    def loaded(self) -> bool:
+        return self.source is None
+
+    def load(self) -> None:
+        from dtl.parse import parse_lazy_block
 
-        def filter_empty(v):
-            if len(v.segments) == 0:
-                return []
+        segments, commands = parse_lazy_block(self.source, *self.block, self.time)
+        self.source = None
+
+        self._segments: defaultdict[Time, list[Segment]] = defaultdict(list)
+        for segment in segments:
+            self._segments[segment.time].append(segment)
+        self._commands = commands
+
+        super().validate(self.time)
+
+    @property
+    def segments(self) -> defaultdict[Time, list[Segment]]:
+        if not self.loaded:
+            self.load()
+        return self._segments
+
+    @segments.setter
+    def segments(self, segments: defaultdict[Time, list[Segment]]) -> None:
+        if not self.loaded:
+            self.load()
+        self._segments = segments
+
+    @property
+    def commands(self) -> list[Cmd]:
+        if not self.loaded:
+            self.load()
+        return self._commands
+
+    @commands.setter
+    def commands(self, commands: list[Cmd]) -> None:
+        if not self.loaded:
+            self.load()
+        self._commands = commands
+
+    def write(self, out: TextIO, scope_time: Time, tab: int = 0) -> None:
+        if self.loaded or tab != 0:
+            return super().write(out, scope_time, tab)
+
+        block = self.source[self.block[0]:self.block[1]].decode()
+        out.write(self.format_header(scope_time, tab))
+        out.write(block if block.endswith('\n') else block + '\n')
+
+    def validate(self, scope_time: Time) -> None:
+        if self.loaded:
+            super().validate(scope_time)
+
+    def is_empty(self) -> bool:
+        # An unloaded block isn't blank, so it holds commands or segments.
+        return self.loaded and super().is_empty()
+
+def normalize_segments(segments: defaultdict[Time, list[Segment]]) -> defaultdict[Time, list[Segment]]:
+    """Sort `segments` by time, merging the untagged segments (no description
+    and no commands) at each time into a single segment, dropped if empty."""
+    normalized: defaultdict[Time, list[Segment]] = defaultdict(list)
+
+    for time in sorted(segments):
+        # A segment alone at its time is kept as it is, rather than copied
+        # into a merged segment, so that validating its parent doesn't load
+        # a LazySegment.
+        if len(segments[time]) == 1 and not segments[time][0].ongoing:
+            segment = segments[time][0]
+            if segment.description is None and segment.is_empty():
+                normalized[time] = []
+            else:
+                normalized[time] = [segment]
+            continue
+
+        tagged: list[Segment] = []
+        merged: Segment | None = None
+        for segment in segments[time]:
+            if segment.description is None and segment.commands == []:
+                if merged is None:
+                    merged = Segment(time, None, [], [], False)
+                for sub_time, segs in segment.segments.items():
+                    merged.segments[sub_time] += segs
             else:
-                return [v]
+                tagged.append(segment)
 
-        self.segments = defaultdict(list, {k: v['tagged'] + filter_empty(v['merged']) for k, v in self.segments.items()})
+        if merged is not None and len(merged.segments) > 0:
+            tagged.append(merged)
 
-        self.segments = defaultdict(list, dict(sorted(self.segments.items())))
+        normalized[time] = tagged
 
-        for sub_time in self.segments:
-            for segment in self.segments[sub_time]:
-                segment.validate(self.time)
+    return normalized
+
+# date(1970, 1, 1).toordinal(); times are converted to minutes since then.
+EPOCH_ORDINAL = 719163
+
+MINUTES_PER_DAY = 24 * 60
 
 class Time:
+    # The time units are packed into a single integer, `key`, most significant
+    # unit first, with 0 standing for an unspecified unit and n+1 for a value
+    # n. Comparing keys orders times by year, then month, date and time, with
+    # unspecified units sorting first. `key` is computed once on construction,
+    # so the units must not be changed afterwards without calling `pack`.
+    UNIT_BITS = (16, 8, 8, 16)
+
+    # A weekday (0 for Monday) takes the place of the date, which it can't be
+    # given with, as WEEKDAY_KEY + weekday, sorting after every date.
+    WEEKDAY_KEY = 0x80
+
+    # KEY_SHIFTS[n]: how far to shift a key to keep only its first n units.
+    KEY_SHIFTS = (48, 32, 24, 16, 0)
+
+    __slots__ = ('year', 'month', 'date', 'weekday', 'time', 'period', 'end', 'key', 'depth')
+
     @classmethod
     def validate_time(cls, time) -> None:
         if not all([time[i].index() < time[i+1].index() for i in range(len(time)-1)]):
@@ -186,20 +390,42 @@ class Time:
 
     @classmethod
     def now(cls) -> Time:
-        now = datetime.now()
+        return Time.from_datetime(datetime.now())
 
-        year = now.strftime('%Y')
-        month = now.strftime('%B')
+    @classmethod
+    def from_datetime(cls, dt: datetime) -> Time:
+        """The minute of `dt`."""
+        return Time.from_units(dt.year, dt.month, dt.day, dt.hour * 60 + dt.minute)
 
-        date = int(now.strftime('%d'))
-        if 4 <= date <= 20 or 24 <= date <= 30:
-            date = str(date) + "th"
-        else:
-            date = str(date) + ["st", "nd", "rd"][date % 10 - 1]
+    @classmethod
+    def from_units(cls, year: int | None = None, month: int | None = None, date: int | None = None, time: int | None = None, weekday: int | None = None) -> Time:
+        value = Time.__new__(Time)
+        value.year, value.month, value.date, value.time = year, month, date, time
+        value.weekday = weekday
+        value.period = False
+        value.end = None
+        value.pack()
 
-        time = now.strftime('%H:%M')
+        return value
 
-        return Time({'YEAR': year, 'MONTH': month, 'DATE': date, 'TIME': time})
+    @classmethod
+    def from_key(cls, key: int) -> Time:
+        """The time that packs into `key`."""
+        # Unrolled for speed (columnar files decode one per segment); follows UNIT_BITS.
+        year, month, date, time = key >> 32, (key >> 24) & 0xff, (key >> 16) & 0xff, key & 0xffff
+
+        value = Time.__new__(Time)
+        value.year = year - 1 if year else None
+        value.month = month - 1 if month else None
+        value.date = date - 1 if date and date < Time.WEEKDAY_KEY else None
+        value.weekday = date - Time.WEEKDAY_KEY if date >= Time.WEEKDAY_KEY else None
+        value.time = time - 1 if time else None
+        value.period = False
+        value.end = None
+        value.key = key
+        value.depth = 0 if not year else 1 if not month else 2 if not date else 3 if not time else 4
+
+        return value
 
     @classmethod
     def year_value(cls, value) -> int:
@@ -222,6 +448,12 @@ class Time:
     def date_value(cls, value) -> int:
         return int(value[:-2])
 
+    @classmethod
+    def weekday_value(cls, value: str) -> int:
+        weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+        return weekdays.index(value)
+
     @classmethod
     def time_value(cls, value: str) -> int:
         hour, minutes = value.split(':')
@@ -252,6 +484,12 @@ class Time:
         else:
             return str(value) + 'th'
 
+    @classmethod
+    def weekday_str(cls, value: int) -> str:
+        weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+        return weekdays[value]
+
     @classmethod
     def time_str(cls, value) -> str:
         time = int(value)
@@ -261,11 +499,12 @@ class Time:
         return str(hour) + ':' + str(minutes).zfill(2)
 
     def __init__(self, values, parent=None):
-        self.year = self.month = self.date = self.time = None
+        self.year = self.month = self.date = self.weekday = self.time = None
         if parent:
             self.year = parent.year
             self.month = parent.month
             self.date = parent.date
+            self.weekday = parent.weekday
             self.time = parent.time
 
         self.period = False
@@ -279,61 +518,120 @@ class Time:
                     self.month = Time.month_value(value)
                 case 'DATE':
                     self.date = Time.date_value(value)
+                case 'DAY':
+                    self.weekday = Time.weekday_value(value)
                 case 'TIME':
                     self.time = Time.time_value(value)
 
+        self.pack()
+
+    def pack(self) -> None:
+        """Compute `key` and `depth` from the time units."""
+        units = (self.year, self.month, self.date, self.time)
+
+        self.key = 0
+        for unit, bits in zip(units, Time.UNIT_BITS):
+            self.key = (self.key << bits) | (0 if unit is None else unit + 1)
+
+        if self.weekday is not None:
+            self.key |= (Time.WEEKDAY_KEY + self.weekday) << Time.KEY_SHIFTS[3]
+            units = (self.year, self.month, self.weekday, self.time)
+
+        # Number of leading specified units.
+        self.depth = 0
+        while self.depth < len(units) and units[self.depth] is not None:
+            self.depth += 1
+
     def __hash__(self):
-        return hash(str((self.year, self.month, self.date, self.time)))
+        return hash(self.key)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Time):
             return NotImplemented
 
-        return (self.year, self.month, self.date, self.time) == (other.year, other.month, other.date, other.time)
+        return self.key == other.key
 
     def __lt__(self, other: Time) -> bool:
-        if self.year is None: return True
-        if other.year is None: return False
-        if self.year < other.year: return True
-        if self.year > other.year: return False
-
-        if self.month is None: return True
-        if other.month is None: return False
-        if self.month < other.month: return True
-        if self.month > other.month: return False
-
-        if self.date is None: return True
-        if other.date is None: return False
-        if self.date < other.date: return True
-        if self.date > other.date: return False
-
-        if self.time is None: return True
-        if other.time is None: return False
-        if self.time < other.time: return True
-        if self.time > other.time: return False
-
-        return False
+        return self.key < other.key
 
     def __repr__(self) -> str:
+        if self.weekday is not None:
+            return 'Time' + str((self.year, self.month, Time.weekday_str(self.weekday), self.time))
+
         return 'Time' + str((self.year, self.month, self.date, self.time))
 
-    def interval(self) -> int:
-        start: datetime = datetime(self.year, self.month, self.date, self.time//60, self.time%60, 0)
-        end: datetime = datetime(self.end.year, self.end.month, self.end.date, self.end.time//60, self.end.time%60, 0)
+    def start_minute(self) -> int | None:
+        """Minutes from 1970-01-01 00:00 to the start of this time, or None if
+        it has no year or is a weekday. Raises ValueError if it is not a valid
+        date."""
+        if self.year is None or self.weekday is not None:
+            return None
+
+        day = date(self.year, self.month or 1, self.date or 1).toordinal() - EPOCH_ORDINAL
+        return day * MINUTES_PER_DAY + (self.time or 0)
+
+    def end_minute(self) -> int | None:
+        """Minutes from 1970-01-01 00:00 to the end of this time, e.g. to the
+        start of the next day for a date, or None if it has no year or is a
+        weekday."""
+        if self.year is None or self.weekday is not None:
+            return None
+
+        if self.month is None:
+            end = date(self.year + 1, 1, 1)
+        elif self.date is None:
+            end = date(self.year + self.month // 12, self.month % 12 + 1, 1)
+        elif self.time is None:
+            end = date(self.year, self.month, self.date) + timedelta(days=1)
+        else:
+            return self.start_minute()
 
-        return int(end.timestamp() - start.timestamp()) // 60
+        return (end.toordinal() - EPOCH_ORDINAL) * MINUTES_PER_DAY
 
-    def contains(self, other: Time) -> bool:
-        time_list = [self.year, self.month, self.date, self.time]
-        other_time_list = [other.year, other.month, other.date, other.time]
+    def period_end(self) -> Time:
+        """The end of this period, with the units it leaves out before its
+        first given unit (e.g. the date in "9:00-17:00") taken from the start.
 
-        for t, o in zip(time_list, other_time_list):
-            if o is None: return False
-            if t is None: return True
+        An end whose first unit that differs from the start's is earlier
+        than it is in the next day, month or year, e.g. the next morning in
+        "22:00-6:00", whether the end's other units are written out, taken
+        from the start or taken from the enclosing segment. Raises
+        ValueError if it is not a valid date."""
+        start = [self.year, self.month, self.date, self.weekday, self.time]
+        units = [self.end.year, self.end.month, self.end.date, self.end.weekday, self.end.time]
 
-            if t != o: return False
+        for i in range(len(units)):
+            if units[i] is None and any(unit is not None for unit in units[i+1:]):
+                units[i] = start[i]
 
-        return False
+        year, month, day, weekday, time = units
+        end = Time.from_units(year, month, day, time, weekday)
+
+        first = next((i for i in range(len(units)) if units[i] != start[i]), None)
+        if first is None or units[first] is None or start[first] is None or units[first] > start[first]:
+            return end
+
+        if first == 4 and weekday is not None:
+            return Time.from_units(year, month, day, time, (weekday + 1) % 7)
+        elif first == 4 and None not in (year, month, day):
+            next_day = date(year, month, day) + timedelta(days=1)
+            return Time.from_units(next_day.year, next_day.month, next_day.day, time)
+        elif first == 2 and None not in (year, month):
+            return Time.from_units(year + month // 12, month % 12 + 1, day, time)
+        elif first == 1 and year is not None:
+            return Time.from_units(year + 1, month, day, time)
+
+        return end
+
+    def interval(self) -> int:
+        """Length of this period in minutes, up to the end of its last unit."""
+        return self.period_end().end_minute() - self.start_minute()
+
+    def contains(self, other: Time) -> bool:
+        # True if this time's leading specified units are a strict prefix of
+        # the other's.
+        shift = Time.KEY_SHIFTS[self.depth]
+        return other.depth > self.depth and other.key >> shift == self.key >> shift
 
     def format(self, scope_time: Time) -> str:
         parts = []
@@ -343,6 +641,8 @@ class Time:
             parts.append(Time.month_str(self.month))
         if scope_time.date is None and self.date is not None:
             parts.append(Time.date_str(self.date))
+        if scope_time.weekday is None and self.weekday is not None:
+            parts.append(Time.weekday_str(self.weekday))
         if scope_time.time is None and self.time is not None:
             parts.append(Time.time_str(self.time))
 
@@ -370,10 +670,14 @@ class Cmd:
         return 'Cmd(' + self.command + ', ' + self.description + ', ' + str(self.options) + ')'
 
     def format(self, tab: int = 0) -> str:
-        fstr = '\t' * tab
-        fstr += f'{self.command} [{self.description}]\n'
-        fstr += ''.join([option.format(tab+1) for option in self.options])
-        return fstr
+        out = StringIO()
+        self.write(out, tab)
+        return out.getvalue()
+
+    def write(self, out: TextIO, tab: int = 0) -> None:
+        out.write('\t' * tab + f'{self.command} [{self.description}]\n')
+        for option in self.options:
+            option.write(out, tab+1)
 
     def validate(self, time: Time) -> None:
         return None
@@ -390,3 +694,6 @@ class Option:
         fstr = '\t' * tab
         fstr += f'{self.name} {self.value}\n'
         return fstr
+
+    def write(self, out: TextIO, tab: int = 0) -> None:
+        out.write(self.format(tab))
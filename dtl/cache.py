@@ -0,0 +1,172 @@
+import gc
+import hashlib
+import mmap
+import os
+import pickle
+
+from dtl import metrics
+from dtl.ast import File
+from dtl.parse import Parser
+
+from collections.abc import Buffer
+from contextlib import contextmanager
+from functools import partial
+from typing import BinaryIO, Iterator
+
+# Bump whenever the pickled AST classes change shape, so that trees cached by
+# an older version of DTL are thrown away instead of loaded.
+CACHE_VERSION = 5
+
+# Smallest file worth starting worker processes for in `load_tree`.
+PARALLEL_PARSE_SIZE = 4 * 1024 * 1024
+
+new_hash = partial(hashlib.blake2b, digest_size=16)
+
+def file_digest(file_path: str) -> str:
+    with open(file_path, 'rb') as file:
+        return hashlib.file_digest(file, new_hash).hexdigest()
+
+@contextmanager
+def mapped(file: BinaryIO) -> Iterator[Buffer]:
+    """The contents of `file`, memory-mapped read-only.
+
+    Pages are read in as they are used and stay in the page cache, so this
+    takes the same time and memory whatever the size of the file. DTL never
+    truncates a file in place (see `dtl.files.write_file`), which would make reading
+    the mapping past the new end fail.
+    """
+    if os.fstat(file.fileno()).st_size == 0:
+        # Empty files can't be mapped.
+        yield b''
+        return
+
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        yield buffer
+
+def load_pickle(file: BinaryIO, freeze: bool = False) -> File:
+    # Unpickling a tree allocates millions of objects without creating any
+    # garbage; letting the cyclic garbage collector repeatedly scan them
+    # roughly doubles the load time. With `freeze`, they are then moved out
+    # of the collector's generations, since the first full collection
+    # afterwards would otherwise scan them all again, e.g. in the middle of
+    # a `find`. Frozen objects are never collected, so this is only for a
+    # process that keeps the tree until it exits.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        tree = pickle.load(file)
+        if freeze:
+            gc.freeze()
+        return tree
+    finally:
+        if enabled:
+            gc.enable()
+
+class TreeCache:
+    """On-disk cache of validated trees, one entry per source file.
+
+    An entry is keyed by the absolute path of its source file and records the
+    file's mtime, size and content hash. It is used as long as the mtime and
+    size are unchanged, or the size and content hash are (e.g. after a
+    `touch`), and deleted as soon as the file is found to have changed.
+
+    With `freeze`, loaded trees are left out of garbage collection for the
+    rest of the process (see `load_pickle`), e.g. by a single CLI command,
+    but not by `dtl serve`, which replaces its trees as their files change.
+    """
+    def __init__(self, cache_dir: str, freeze: bool = False) -> None:
+        self.cache_dir = cache_dir
+        self.freeze = freeze
+
+    def entry_path(self, file_path: str) -> str:
+        key = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def load(self, file_path: str) -> File | None:
+        entry_path = self.entry_path(file_path)
+
+        try:
+            stat = os.stat(file_path)
+            with open(entry_path, 'rb') as entry:
+                meta = pickle.load(entry)
+
+                if meta['version'] != CACHE_VERSION or meta['path'] != os.path.abspath(file_path):
+                    return None
+
+                if meta['mtime'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+                    return load_pickle(entry, self.freeze)
+
+                if meta['size'] == stat.st_size and meta['hash'] == file_digest(file_path):
+                    tree = load_pickle(entry, self.freeze)
+                    self.store(file_path, tree, stat, meta['hash'])
+                    return tree
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, AttributeError, ImportError, TypeError, ValueError):
+            # Unreadable, or pickled from classes that have changed since.
+            return None
+
+        self.discard(file_path)
+        return None
+
+    def store(self, file_path: str, tree: File, stat: os.stat_result, digest: str) -> None:
+        entry_path = self.entry_path(file_path)
+        meta = {
+            'version': CACHE_VERSION,
+            'path': os.path.abspath(file_path),
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'hash': digest,
+        }
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(entry_path + '.tmp', 'wb') as entry:
+                pickle.dump(meta, entry, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(tree, entry, pickle.HIGHEST_PROTOCOL)
+            os.replace(entry_path + '.tmp', entry_path)
+        except OSError:
+            pass
+
+    def discard(self, file_path: str) -> None:
+        try:
+            os.remove(self.entry_path(file_path))
+        except OSError:
+            pass
+
+def load_tree(file_path: str, cache: TreeCache | None = None, jobs: int = 1, lazy: bool = False) -> File:
+    """Parse `file_path`, using and refreshing `cache` if given.
+
+    Files of at least PARALLEL_PARSE_SIZE bytes are parsed by `jobs` worker
+    processes when `jobs` is more than 1. With `lazy`, the file is parsed
+    with `Parser.parse_lazy` instead, which is faster than loading a cached
+    tree, so the cache isn't used.
+
+    Raises FileNotFoundError if the file doesn't exist.
+    """
+    if lazy:
+        with open(file_path, 'rb') as file, mapped(file) as buffer:
+            return Parser(debug = False).parse_lazy(bytes(buffer))
+
+    if cache is not None:
+        with metrics.stage('cache'):
+            tree = cache.load(file_path)
+        if tree is not None:
+            return tree
+
+    parser = Parser(debug = False)
+
+    with open(file_path, 'rb') as file, mapped(file) as buffer:
+        stat = os.fstat(file.fileno())
+        if jobs > 1 and stat.st_size >= PARALLEL_PARSE_SIZE:
+            tree = parser.parse_parallel(str(buffer, 'utf-8'), workers=jobs)
+        else:
+            tree = parser.parse_buffer(buffer)
+
+        if cache is not None:
+            # Built before the tree is stored, so that it is cached with it
+            # instead of being rebuilt by every `find` on a cached tree.
+            with metrics.stage('index'):
+                tree.description_index
+            with metrics.stage('cache'):
+                cache.store(file_path, tree, stat, new_hash(buffer).hexdigest())
+
+    return tree
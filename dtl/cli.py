@@ -1,19 +1,31 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import sys
 import os
 
-from dtl.ast import File, Segment, Time
-from dtl.config import load_config
-from dtl.parse import Parser
-
-from collections import defaultdict
+from collections.abc import Callable
+from functools import partial
+from itertools import chain
+
+from dtl import metrics
+from dtl.client import daemon_path, daemon_request
+from dtl.config import dtl_dir, jobs
+from dtl.files import (ALL_FILES, absolute_path, add_segment, dtl_files, end_segment,
+                       format_finds, insert_segments, locked, record_formatted,
+                       write_file)
+
+# Everything else is imported by the functions that use it, so that a command
+# only loads what it needs: e.g. `dtl --version` loads neither the parser nor
+# the config, and a command answered by `dtl serve` doesn't load the parser.
+# Stands in for typing.TYPE_CHECKING, since importing typing slows down startup.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from dtl.ast import File, Segment
 
 VERSION = 'v0.1.9-alpha'
 
-config = load_config(os.path.expanduser('~/.config/DTL/config.ini'))
-DTL_dir = config['DTL_dir']
-
 def assert_argc(args: list[str], count: int) -> None:
     if len(args) < count:
         if count == 1:
@@ -29,40 +41,50 @@ def required(name: str, value: str | None) -> str:
 
     return value
 
-def absolute_path(file_path: str) -> str:
-    if len(file_path) > 0 and file_path[0] == '@':
-        return f'{DTL_dir}/{file_path[1:]}.dtl'
+def parse_file(file_path: str, lazy: bool = False) -> File:
+    """Parse `file_path`, or exit if it doesn't exist.
 
-    return file_path
-
-def parse_file(file_path: str) -> File:
-    parser = Parser(debug = False)
+    Pass `lazy` when only a few segments will be used, e.g. to insert one;
+    see `Parser.parse_lazy`.
+    """
+    from dtl.cache import TreeCache, load_tree
 
     try:
-        with open(absolute_path(file_path), 'r') as file:
-            tree = parser.parse(file.read())
+        tree = load_tree(absolute_path(file_path), TreeCache(f'{dtl_dir()}/.cache', freeze=True), jobs(), lazy)
     except FileNotFoundError:
         print(f'Error: can\'t find file "{file_path}"')
         exit(1)
 
+    metrics.count_tree(tree)
     return tree
 
-def write_file(file_path: str, tree: File) -> None:
-    with open(absolute_path(file_path), 'w') as file:
-        file.write(tree.format())
-
 def parse_cmd(file_path: str) -> None:
-    print(parse_file(file_path))
-    print(parse_file(file_path).format())
+    tree: File = parse_file(file_path)
+
+    with metrics.stage('format'):
+        print(tree)
+        tree.write(sys.stdout)
+        print()
 
 def format_cmd(file_path: str) -> None:
-    tree: File = parse_file(file_path)
+    with locked(file_path):
+        tree: File = parse_file(file_path)
+
+        record_formatted(file_path, tree, write_file(file_path, tree))
 
-    write_file(file_path, tree)
+def search_mode(flags: list[str]) -> str:
+    if 'prefix' in flags:
+        return 'prefix'
+    elif 'substring' in flags:
+        return 'substring'
+    else:
+        return 'exact'
 
-def find_cmd(file_path: str, args: list[str]) -> None:
+def find_cmd(file_path: str, args: list[str], flags: list[str]) -> None:
     assert_argc(args, 1)
 
+    mode = search_mode(flags)
+
     if args[0] == 'ongoing':
         ongoing = True
         description = args[1]
@@ -73,24 +95,174 @@ def find_cmd(file_path: str, args: list[str]) -> None:
         ongoing = None
         description = args[0]
 
+    response = daemon_request({'cmd': 'find', 'file': daemon_path(file_path), 'description': description, 'ongoing': ongoing, 'mode': mode})
+    if response is not None:
+        print(response['output'])
+        return
+
+    if file_path == ALL_FILES:
+        find_all(description, ongoing, mode)
+        return
+
+    from dtl.ast import Time
+
     tree: File = parse_file(file_path)
 
-    print(''.join([f.format(Time({})) for f in tree.find(description, ongoing=ongoing)]))
+    with metrics.stage('find'):
+        print(''.join([f.format(Time({})) for f in tree.find(description, ongoing=ongoing, mode=mode)]))
+
+def find_in_file(file_path: str, description: str, ongoing: bool | None, mode: str) -> tuple[list[tuple[int, str, str]], str]:
+    """The matches in `file_path` (see `format_finds`) and the errors met
+    reading it.
+
+    Runs in the worker processes of `find_all`, so errors are returned to be
+    printed by the parent rather than printed, and don't exit.
+    """
+    from contextlib import redirect_stdout
+    from io import StringIO
+
+    from dtl.ast import Time
+    from dtl.cache import TreeCache, load_tree
+    from dtl.parse import ParseError
+
+    errors = StringIO()
+    try:
+        # The parser reports errors on stdout.
+        with redirect_stdout(errors):
+            tree: File = load_tree(absolute_path(file_path), TreeCache(f'{dtl_dir()}/.cache', freeze=True), jobs())
+    except FileNotFoundError:
+        return [], f'Error: can\'t find file "{file_path}"\n'
+    except ParseError:
+        return [], errors.getvalue() + f'Error: can\'t parse file "{file_path}"\n'
+
+    metrics.count_tree(tree)
+    with metrics.stage('find'):
+        return [(f.time.key, file_path, f.format(Time({}))) for f in tree.find(description, ongoing=ongoing, mode=mode)], errors.getvalue()
+
+def find_all(description: str, ongoing: bool | None, mode: str) -> None:
+    from concurrent.futures import ProcessPoolExecutor
+
+    try:
+        files = dtl_files()
+    except FileNotFoundError:
+        print(f'Error: can\'t find directory "{dtl_dir()}"')
+        exit(1)
+
+    search = partial(find_in_file, description=description, ongoing=ongoing, mode=mode)
+
+    if len(files) <= 1:
+        results = list(map(search, files))
+    else:
+        with ProcessPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1)) as executor:
+            results = list(executor.map(search, files))
+
+    for _, errors in results:
+        sys.stderr.write(errors)
+
+    print(format_finds(list(chain.from_iterable(finds for finds, _ in results))))
+
+def range_cmd(file_path: str, start: str, end: str) -> None:
+    from dtl.ast import Time
+    from dtl.parse import ParseError, Parser
+
+    parser = Parser(debug = False)
+    try:
+        start_time: Time = parser.parse_time_str(start)
+        end_time: Time = parser.parse_time_str(end)
+    except ParseError:
+        print(f'Error: invalid time range "{start}" to "{end}"')
+        exit(1)
 
-def add_cmd(file_path: str, description: str) -> None:
     tree: File = parse_file(file_path)
 
-    print(Time.now())
-    tree.insert_segment(Segment(Time.now(), description))
+    with metrics.stage('range'):
+        try:
+            segments = tree.between(start_time, end_time)
+        except ValueError:
+            # Not a valid date, e.g. February 31st, where weekday entries recur.
+            print(f'Error: invalid time range "{start}" to "{end}"')
+            exit(1)
 
-    print(tree.format())
+        print(''.join([s.format_header(Time({})) for s in segments]), end='')
 
-    write_file(file_path, tree)
+def report_cmd(file_path: str, period: str, start: str | None, end: str | None, flags: list[str]) -> None:
+    # Imported here, since it imports NumPy, which takes a while.
+    from dtl.report import PERIODS, Spans, report
+    from dtl.ast import Time
+    from dtl.parse import ParseError, Parser
+
+    if period not in PERIODS:
+        print(f'Error: unknown period "{period}", expected one of {", ".join(PERIODS)}')
+        exit(1)
+
+    lo = hi = None
+    if start is not None and end is not None:
+        parser = Parser(debug = False)
+        try:
+            lo = parser.parse_time_str(start).start_minute()
+            hi = parser.parse_time_str(end).end_minute()
+        except (ParseError, ValueError):
+            print(f'Error: invalid time range "{start}" to "{end}"')
+            exit(1)
+
+        if lo is None or hi is None:
+            print(f'Error: the time range "{start}" to "{end}" must include a year')
+            exit(1)
 
-def begin_cmd(file_path: str, description: str) -> None:
     tree: File = parse_file(file_path)
 
-    already_ongoing = tree.find(description, ongoing = True)
+    with metrics.stage('report'):
+        spans = Spans(tree, now = Time.now().start_minute() if 'ongoing' in flags else None)
+        if len(spans) == 0:
+            return
+
+        if lo is None or hi is None:
+            lo, hi = spans.bounds()
+
+        print(report(spans, lo, hi, period), end='')
+
+def add_cmd(file_path: str, description: str) -> None:
+    response = daemon_request({'cmd': 'add', 'file': daemon_path(file_path), 'description': description, 'ongoing': False})
+    if response is not None:
+        print(response['output'], end='')
+        return
+
+    from dtl.ast import Segment, Time
+
+    segment: Segment = Segment(Time.now(), description)
+
+    try:
+        add_segment(file_path, segment, partial(parse_file, file_path, lazy=True), tail=True)
+    except FileNotFoundError:
+        print(f'Error: can\'t find file "{file_path}"')
+        exit(1)
+    except ValueError as e:
+        print(f'Error: {e}')
+        exit(1)
+
+    print(segment.format(Time({})), end='')
+
+def ongoing_entries(file_path: str, tree: File | None, description: str) -> list[str]:
+    """The formatted ongoing entries with the given description, from `tree`
+    or, if it is None, from `dtl serve`, or from the file if the daemon has
+    stopped since."""
+    if tree is None:
+        response = daemon_request({'cmd': 'ongoing', 'file': daemon_path(file_path), 'description': description})
+        if response is not None:
+            return response['entries']
+
+        tree = parse_file(file_path)
+
+    from dtl.ast import Time
+
+    return [f.format(Time({})) for f in tree.find(description, ongoing = True)]
+
+def begin_cmd(file_path: str, description: str) -> None:
+    tree: File | None = None
+    if daemon_request({'cmd': 'ping'}) is None:
+        tree = parse_file(file_path)
+
+    already_ongoing = ongoing_entries(file_path, tree, description)
     if len(already_ongoing) > 0:
         if len(already_ongoing) == 1:
             print(f'There\'s already an ongoing entry with the name "{description}":')
@@ -98,22 +270,39 @@ def begin_cmd(file_path: str, description: str) -> None:
             print(f'There are already ongoing entries with the name "{description}":')
 
         print()
-        print(''.join(['\t' + f.format(Time({})) for f in already_ongoing]))
+        print(''.join(['\t' + f for f in already_ongoing]))
         print('Are you sure you want to create another entry?')
         ans = input('(y/n): ')
         if ans != 'y':
             exit(0)
 
-    tree.insert_segment(Segment(Time.now(), description, ongoing = True))
+    if tree is None:
+        response = daemon_request({'cmd': 'add', 'file': daemon_path(file_path), 'description': description, 'ongoing': True})
+        if response is not None:
+            print(response['output'], end='')
+            return
 
-    print(tree.format())
+    from dtl.ast import Segment, Time
 
-    write_file(file_path, tree)
+    segment: Segment = Segment(Time.now(), description, ongoing = True)
+
+    try:
+        add_segment(file_path, segment, partial(parse_file, file_path, lazy=True), tail=True)
+    except FileNotFoundError:
+        print(f'Error: can\'t find file "{file_path}"')
+        exit(1)
+    except ValueError as e:
+        print(f'Error: {e}')
+        exit(1)
+
+    print(segment.format(Time({})), end='')
 
 def end_cmd(file_path: str, description: str) -> None:
-    tree: File = parse_file(file_path)
+    tree: File | None = None
+    if daemon_request({'cmd': 'ping'}) is None:
+        tree = parse_file(file_path)
 
-    finds: list[Segment] | list[tuple[Segment, Segment | File]] = tree.find(description, ongoing = True, with_parent = True)
+    finds: list[str] = ongoing_entries(file_path, tree, description)
 
     if len(finds) == 0:
         print(f'No ongoing entry with the name "{description}"')
@@ -121,12 +310,12 @@ def end_cmd(file_path: str, description: str) -> None:
     elif len(finds) > 1:
         print(f'There are multiple ongoing entries with the name "{description}":')
         print()
-        print(''.join(['\t' + f[0].format(Time({})) for f in finds]))
+        print(''.join(['\t' + f for f in finds]))
         while True:
             print(f'Which one would you like to end?')
             index = input(f'[1-{len(finds)}]: ')
             if index.isnumeric() and int(index) > 0 and int(index) <= len(finds):
-                segment, parent = finds[int(index)-1]
+                index = int(index)-1
                 break
             else:
                 if index == 'none':
@@ -136,29 +325,137 @@ def end_cmd(file_path: str, description: str) -> None:
     else:
         print(f'Currently ongoing entry "{description}":')
         print()
-        print(''.join(['\t' + f[0].format(Time({})) for f in finds]))
+        print(''.join(['\t' + f for f in finds]))
         print('Are you sure you want to end this entry?')
         ans = input('(y/n): ')
         if ans != 'y':
             exit(0)
 
-        segment, parent = finds[0]
+        index = 0
+
+    if tree is None:
+        # The daemon checks that the entries haven't changed while prompting.
+        response = daemon_request({'cmd': 'end', 'file': daemon_path(file_path), 'description': description, 'index': index, 'entries': finds})
+        if response is not None:
+            return
+
+    from dtl.ast import Time
+
+    with locked(file_path):
+        # Reparse in case another writer changed the file while prompting.
+        tree = parse_file(file_path)
+
+        ongoing = tree.find(description, ongoing = True, with_parent = True)
+        if [f[0].format(Time({})) for f in ongoing] != finds:
+            print(f'Error: the ongoing entries of "{description}" changed, please try again')
+            exit(1)
+
+        segment, parent = ongoing[index]
+
+        end_segment(file_path, tree, segment, parent)
+
+def watch_cmd(file_path: str, description: str | None, flags: list[str]) -> None:
+    from dtl.parse import ParseError
+    from dtl.watch import watch
+
+    path = absolute_path(file_path)
+    if not os.path.exists(path):
+        print(f'Error: can\'t find file "{file_path}"')
+        exit(1)
+
+    try:
+        watch(path, description, search_mode(flags), sys.stdout)
+    except ParseError:
+        print(f'Error: can\'t parse file "{file_path}"')
+        exit(1)
+    except KeyboardInterrupt:
+        pass
+
+def ingest_cmd(file_path: str, source: str | None, flags: list[str]) -> None:
+    from dtl.ast import Time
+    from dtl.ingest import FORMATS, IngestError, read_segments
+
+    fmt = next((f for f in FORMATS if f in flags), None)
+    if fmt is None and source is not None:
+        fmt = next((f for f in FORMATS if source.endswith(f'.{f}')), None)
+
+    try:
+        if source is None:
+            segments = list(read_segments(sys.stdin, fmt))
+        else:
+            with open(source, 'r', newline='') as events:
+                segments = list(read_segments(events, fmt))
+    except FileNotFoundError:
+        print(f'Error: can\'t find file "{source}"')
+        exit(1)
+    except IngestError as e:
+        print(f'Error: {e}')
+        exit(1)
+
+    segments.sort(key=lambda s: s.time.key)
+
+    with locked(file_path):
+        tree: File = parse_file(file_path, lazy=True)
+
+        outside = [s for s in segments if not tree.header_time.contains(s.time)]
+        if len(outside) > 0:
+            print(f'Error: {len(outside)} events are outside of the file\'s time range, e.g.:')
+            print(outside[0].format(Time({})), end='')
+            exit(1)
+
+        insert_segments(file_path, tree, segments)
+
+    print(f'Added {len(segments)} entries')
+
+def export_cmd(file_path: str, output: str | None, flags: list[str]) -> None:
+    from dtl import export
+
+    fmt = next((f.removeprefix('format=') for f in flags if f.startswith('format=')), None)
+    if fmt is None and output is not None:
+        fmt = next((f for f, ext in export.EXTENSIONS.items() if output.endswith(ext)), None)
+    fmt = fmt or 'jsonl'
 
-    parent_segments = defaultdict(list)
-    for sub_time in parent.segments.keys():
-        for seg in parent.segments[sub_time]:
-            if seg is not segment:
-                parent_segments[sub_time].append(seg)
+    if fmt not in export.FORMATS:
+        print(f'Error: unknown format "{fmt}", expected one of {", ".join(export.FORMATS)}')
+        exit(1)
+    if fmt == 'columnar' and output is None:
+        print('Error: the columnar format needs an output file')
+        exit(1)
 
-    parent.segments = parent_segments
+    tree: File = parse_file(file_path)
 
-    segment.ongoing = False
-    segment.time.period = True
-    segment.time.end = Time.now()
+    with metrics.stage('export'):
+        match fmt:
+            case 'columnar':
+                with open(output, 'wb') as out:
+                    export.write_columnar(tree, out)
+            case 'csv' | 'jsonl':
+                write = export.write_csv if fmt == 'csv' else export.write_jsonl
+                if output is None:
+                    write(tree, sys.stdout)
+                else:
+                    with open(output, 'w', encoding='utf-8', newline='') as out:
+                        write(tree, out)
+
+def import_cmd(file_path: str, source: str) -> None:
+    from dtl.export import ColumnarError, load_columnar
 
-    tree.insert_segment(segment)
+    real_path = absolute_path(file_path)
+    if os.path.exists(real_path):
+        print(f'Error: file "{file_path}" already exists.')
+        exit(1)
 
-    write_file(file_path, tree)
+    try:
+        tree = load_columnar(source)
+    except FileNotFoundError:
+        print(f'Error: can\'t find file "{source}"')
+        exit(1)
+    except ColumnarError as e:
+        print(f'Error: {e}')
+        exit(1)
+
+    with open(real_path, 'w', encoding='utf-8') as out:
+        tree.write(out)
 
 def create_cmd(file_path: str) -> None:
     real_path = absolute_path(file_path)
@@ -170,6 +467,11 @@ def create_cmd(file_path: str) -> None:
         with open(real_path, 'w', encoding='utf-8'):
             pass
 
+def serve_cmd() -> None:
+    from dtl.daemon import serve
+
+    serve()
+
 def help_cmd(cmd: str | None) -> None:
     match cmd:
         case 'parse':
@@ -183,6 +485,30 @@ def help_cmd(cmd: str | None) -> None:
             print('\tPrints a list of entries in the given file with the given description.')
             print('\tOnly returns ongoing or static entries with ongoing or static options;')
             print('\treturns both by default.')
+            print()
+            print('\t--prefix')
+            print('\t\tMatch entries whose description starts with [description].')
+            print('\t--substring')
+            print('\t\tMatch entries whose description contains [description].')
+            print()
+            print('\tUse @* as the file (or the --all flag) to search every file in DTL_dir;')
+            print('\tresults are then prefixed with the file they were found in.')
+        case 'range':
+            print('dtl [file] range [from] [to]\n')
+            print('\tPrints a list of entries in the given file that overlap the given time range,')
+            print('\te.g. dtl [file] range "2022 August 1st" "2022 August 7th".')
+            print('\tThe range includes all of [to], e.g. the whole of August 7th.')
+            print('\tEntries with a weekday, e.g. @Monday 7:00, are listed on every date')
+            print('\tthey fall on in the range.')
+        case 'report':
+            print('dtl [file] report [day|week|month|total] (from) (to)\n')
+            print('\tPrints the time spent on each description in the given file per day, week')
+            print('\t(starting on Monday) or month, or in total, counting entries with a time period.')
+            print('\tOnly counts time between (from) and (to) (both included) if they are given,')
+            print('\te.g. dtl [file] report week "2022 August" "2022 September".')
+            print()
+            print('\t--ongoing')
+            print('\t\tAlso count ongoing entries, up to now.')
         case 'add':
             print('dtl [file] add [description]\n')
             print('\tAdds an entry to the given file with the given description')
@@ -193,9 +519,55 @@ def help_cmd(cmd: str | None) -> None:
         case 'end':
             print('dtl [file] end [description]\n')
             print('\tCloses an ongoing entry in the given file with the given description.')
+        case 'watch':
+            print('dtl [file] watch (description)\n')
+            print('\tPrints an event for every entry added to or ended in the given file from now')
+            print('\ton, as it happens, until stopped with Ctrl-C. Only reports entries with the')
+            print('\tgiven description, or every entry if none is given. Each event is a line of')
+            print('\tJSON with the fields "event" ("add" or "end"), "time", "start", "end",')
+            print('\t"description", "ongoing" and "commands" (see dtl export).')
+            print()
+            print('\t--prefix')
+            print('\t\tMatch entries whose description starts with (description).')
+            print('\t--substring')
+            print('\t\tMatch entries whose description contains (description).')
+        case 'ingest':
+            print('dtl [file] ingest (events)\n')
+            print('\tAdds every event in the file [events], or read from stdin if no file is given,')
+            print('\tto the given file in a single write. Events are read from a CSV file with a header')
+            print('\trow, or from a JSON lines file, and have the fields:')
+            print('\t\ttimestamp    ISO 8601 time, e.g. 2022-08-09T12:00, or seconds since the epoch')
+            print('\t\tdescription')
+            print('\t\tongoing      (optional) true or false')
+            print('\t\tcommands     (optional) commands as written in DTL, e.g. !note [...]')
+            print()
+            print('\t--csv, --jsonl')
+            print('\t\tThe format of the events. By default, it is taken from the extension')
+            print('\t\tof [events], or else guessed from its first line.')
+        case 'export':
+            print('dtl [file] export (output)\n')
+            print('\tWrites every segment of the given file as a record to the file (output),')
+            print('\tor to stdout if no file is given. Each record has the segment\'s id, the id')
+            print('\tof its parent (-1 at the top level), its depth, its time, the start and end')
+            print('\tminute of its time, its description, whether it is ongoing and its commands.')
+            print()
+            print('\t--format=[csv|jsonl|columnar]')
+            print('\t\tThe format to write. By default, it is taken from the extension of (output)')
+            print('\t\t(.csv, .jsonl or .dtlc), or else JSON lines. The columnar format is a compact')
+            print('\t\tbinary file that can be memory-mapped, and read back with dtl import.')
+        case 'import':
+            print('dtl [file] import [columnar]\n')
+            print('\tCreates the file <file> from a file written by dtl export --format=columnar,')
+            print('\twithout parsing.')
         case 'create':
             print('dtl [file] create\n')
             print('\tCreates the file <file>. Useful for creating files in the DTL_dir directory.')
+        case 'serve':
+            print('dtl serve\n')
+            print('\tKeeps the files in DTL_dir parsed in memory and answers find, add, begin')
+            print('\tand end for every file over a Unix socket in DTL_dir, reloading files')
+            print('\tthat are changed by other programs. While it runs, those commands are')
+            print('\tsent to it instead of parsing the file. Stop it with Ctrl-C.')
         case None:
             print(f'DTL {VERSION}')
             print()
@@ -208,6 +580,10 @@ def help_cmd(cmd: str | None) -> None:
             print('\t\tPrints a list of entries in the given file with the given description.')
             print('\t\tOnly returns ongoing or static entries with ongoing or static options;')
             print('\t\treturns both by default.\n')
+            print('\tdtl [file] range [from] [to]')
+            print('\t\tPrints a list of entries in the given file that overlap the given time range.\n')
+            print('\tdtl [file] report [day|week|month|total] (from) (to)')
+            print('\t\tPrints the time spent on each description per day, week or month, or in total.\n')
             print('\tdtl [file] add [description]')
             print('\t\tAdds an entry to the given file with the given description')
             print('\t\tand the current time as its timestamp.\n')
@@ -215,20 +591,65 @@ def help_cmd(cmd: str | None) -> None:
             print('\t\tSame as dtl add, but marks the entry as ongoing.\n')
             print('\tdtl [file] end [description]')
             print('\t\tCloses an ongoing entry in the given file with the given description.\n')
+            print('\tdtl [file] watch (description)')
+            print('\t\tPrints an event for every entry added to or ended in the given file, as it happens.\n')
+            print('\tdtl [file] ingest (events)')
+            print('\t\tAdds every event in a CSV or JSON lines file (or stdin) to the given file.\n')
+            print('\tdtl [file] export (output)')
+            print('\t\tWrites the segments of the given file as CSV, JSON lines or columnar records.\n')
+            print('\tdtl [file] import [columnar]')
+            print('\t\tCreates the file <file> from a columnar export.\n')
             print('\tdtl [file] create')
-            print('\t\tCreates the file <file>. Useful for creating files in the DTL_dir directory.')
+            print('\t\tCreates the file <file>. Useful for creating files in the DTL_dir directory.\n')
+            print('\tdtl serve')
+            print('\t\tKeeps files parsed in memory to answer find, add, begin and end quickly.')
             print()
             print('Flags:')
             print('\t--help')
             print('\t\tShow this message.')
             print('\t\tIf a command is specified: show more information about that command.\n')
+            print('\t--all')
+            print('\t\tRun the command on every file in DTL_dir (same as using @* as the file).')
+            print('\t\tOnly supported by find.\n')
+            print('\t--profile, --profile=<file>')
+            print('\t\tPrint the time spent in each stage of the command (e.g. tokenize, parse,')
+            print('\t\tvalidate, find, write_file), the number of tokens, segments and nodes read')
+            print('\t\tand the peak memory to stderr. With <file>, also write cProfile stats to it.\n')
         case _:
             print(f'Unknown command "{cmd}". Type "dtl --help" for a list of commands.')
 
+def profiled(fn: Callable[[], None], dump_path: str | None) -> None:
+    """Run `fn`, then print the time spent in each stage, the number of
+    tokens and nodes read and the peak memory to stderr, and write cProfile
+    stats to `dump_path` if given."""
+    metrics.enable()
+
+    profiler = None
+    if dump_path is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        fn()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(dump_path)
+
+        metrics.report(sys.stderr)
+
 def main() -> None:
     flags:    list[str] = [flag.lstrip('-') for flag in sys.argv[1:] if flag[0] == '-']
     commands: list[str] = [cmd              for cmd  in sys.argv[1:] if  cmd[0] != '-']
 
+    profile = next((f for f in flags if f == 'profile' or f.startswith('profile=')), None)
+    if profile is None:
+        run(flags, commands)
+    else:
+        profiled(partial(run, flags, commands), profile.removeprefix('profile').removeprefix('=') or None)
+
+def run(flags: list[str], commands: list[str]) -> None:
     cmd:  str | None = None
     file: str | None = None
     match len(commands):
@@ -236,9 +657,14 @@ def main() -> None:
             args = commands
         case 1:
             cmd, *args = commands
+        case _ if 'all' in flags:
+            cmd, *args = commands
         case _:
             file, cmd, *args = commands
 
+    if 'all' in flags:
+        file = ALL_FILES
+
     if 'help' in flags or 'h' in flags:
         help_cmd(cmd)
         exit(0)
@@ -251,23 +677,51 @@ def main() -> None:
         help_cmd(None)
         exit(0)
 
+    if cmd == 'serve' and file is None:
+        serve_cmd()
+        exit(0)
+
     if file is None:
         help_cmd(cmd)
         exit(0)
 
+    if file == ALL_FILES and cmd not in ['find']:
+        print(f'Error: "{cmd}" can\'t be used with every file at once')
+        exit(1)
+
     match (cmd, args):
         case 'parse', args:
             parse_cmd(file)
         case 'format', args:
             format_cmd(file)
         case 'find', args:
-            find_cmd(file, args)
+            find_cmd(file, args, flags)
+        case 'range', [start, end]:
+            range_cmd(file, start, end)
+        case 'report', [period]:
+            report_cmd(file, period, None, None, flags)
+        case 'report', [period, start, end]:
+            report_cmd(file, period, start, end, flags)
         case 'add', [description]:
             add_cmd(file, description)
         case 'begin', [description]:
             begin_cmd(file, description)
         case 'end', [description]:
             end_cmd(file, description)
+        case 'watch', []:
+            watch_cmd(file, None, flags)
+        case 'watch', [description]:
+            watch_cmd(file, description, flags)
+        case 'ingest', []:
+            ingest_cmd(file, None, flags)
+        case 'ingest', [source]:
+            ingest_cmd(file, source, flags)
+        case 'export', []:
+            export_cmd(file, None, flags)
+        case 'export', [output]:
+            export_cmd(file, output, flags)
+        case 'import', [source]:
+            import_cmd(file, source)
         case 'create', args:
             create_cmd(file)
         case _:
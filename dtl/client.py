@@ -0,0 +1,39 @@
+import os
+
+from dtl.config import socket_path
+from dtl.files import ALL_FILES, absolute_path
+
+def daemon_request(request: dict) -> dict | None:
+    """Send `request` to `dtl serve` and return its response.
+
+    Returns None if no daemon is running, in which case the caller does the
+    work itself. Exits if the daemon reports an error.
+    """
+    import json
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path())
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as stream:
+                line = stream.readline()
+    except OSError:
+        return None
+
+    if line == b'':
+        return None
+
+    response = json.loads(line)
+    if 'error' in response:
+        print(f'Error: {response["error"]}')
+        exit(1)
+
+    return response
+
+def daemon_path(file_path: str) -> str:
+    """`file_path` as sent to `dtl serve`, which may run in another directory."""
+    if file_path == ALL_FILES:
+        return file_path
+
+    return os.path.abspath(absolute_path(file_path))
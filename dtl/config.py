@@ -1,7 +1,14 @@
-import configparser
 import os
 
+from functools import cache
+
+from dtl import metrics
+
+CONFIG_PATH = '~/.config/DTL/config.ini'
+
 def load_config(config_path: str) -> dict[str, str]:
+    import configparser
+
     config = configparser.ConfigParser()
     config.read(config_path, encoding='utf-8')
 
@@ -10,4 +17,22 @@ def load_config(config_path: str) -> dict[str, str]:
 
     return {
         'DTL_dir': os.path.expanduser(config.get('DTL', 'DTL_dir', fallback='~/.DTL/')),
+        'jobs': config.get('DTL', 'jobs', fallback='1'),
     }
+
+@cache
+def config() -> dict[str, str]:
+    """The user's config, read the first time a command needs it rather than
+    on every start, e.g. not for `dtl --version`."""
+    with metrics.stage('config'):
+        return load_config(os.path.expanduser(CONFIG_PATH))
+
+def dtl_dir() -> str:
+    return config()['DTL_dir']
+
+def jobs() -> int:
+    return int(config()['jobs']) if config()['jobs'].isnumeric() else 1
+
+def socket_path() -> str:
+    """Unix socket `dtl serve` listens on."""
+    return os.path.join(dtl_dir(), '.dtl.sock')
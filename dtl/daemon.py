@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import signal
+
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from functools import partial
+from itertools import chain
+
+from dtl import metrics
+from dtl.ast import File, Segment, Time
+from dtl.cache import TreeCache, load_tree
+from dtl.client import daemon_request
+from dtl.config import dtl_dir, jobs, socket_path
+from dtl.files import (ALL_FILES, absolute_path, dtl_files, end_segment, flocked, format_finds, queue_segment,
+                       save_queue, sidecar_path)
+from dtl.parse import ParseError
+
+# Seconds between checks of the loaded files for changes made by other programs.
+WATCH_INTERVAL = 1.0
+
+class DaemonError(Exception):
+    pass
+
+class Daemon:
+    """Keeps the trees of DTL files in memory and answers requests about them.
+
+    Requests and responses are JSON objects, one per line. Every request has a
+    "cmd" field; a response holds an "error" message if the request failed.
+    Requests are handled one at a time on the event loop, so a tree is never
+    read while another request is changing it. Only the wait for a file's
+    write lock, which a CLI command may be holding, happens in a thread
+    (see `locked`), so other requests are answered meanwhile.
+
+    A "stats" request returns the daemon's metrics (see `dtl.metrics`),
+    which include token and node counts if it was started with --profile.
+    """
+    def __init__(self) -> None:
+        self.cache = TreeCache(f'{dtl_dir()}/.cache')
+        # Loaded trees by absolute path, with the (mtime, size) of the file they were read from.
+        self.trees: dict[str, tuple[tuple[int, int], File]] = {}
+
+    def stat_key(self, path: str) -> tuple[int, int]:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def tree(self, file_path: str) -> File:
+        """The tree of `file_path`, reloaded if the file changed since it was read."""
+        path = absolute_path(file_path)
+
+        try:
+            key = self.stat_key(path)
+            if path in self.trees and self.trees[path][0] == key:
+                return self.trees[path][1]
+
+            tree = load_tree(path, self.cache, jobs())
+        except FileNotFoundError:
+            self.trees.pop(path, None)
+            raise DaemonError(f'can\'t find file "{file_path}"')
+        except ParseError:
+            self.trees.pop(path, None)
+            raise DaemonError(f'can\'t parse file "{file_path}"')
+
+        self.trees[path] = (key, tree)
+        return tree
+
+    def saved(self, file_path: str, tree: File, stat: os.stat_result) -> None:
+        """Record that `tree` was just written to `file_path`, giving it `stat`."""
+        self.trees[absolute_path(file_path)] = ((stat.st_mtime_ns, stat.st_size), tree)
+
+    def refresh(self) -> None:
+        """Reload every loaded tree whose file changed, and drop deleted files."""
+        for path in list(self.trees):
+            try:
+                self.tree(path)
+            except DaemonError:
+                pass
+
+    def find(self, file_path: str, description: str, ongoing: bool | None, mode: str) -> dict:
+        if file_path != ALL_FILES:
+            tree = self.tree(file_path)
+            return {'output': ''.join([f.format(Time({})) for f in tree.find(description, ongoing=ongoing, mode=mode)])}
+
+        try:
+            files = dtl_files()
+        except FileNotFoundError:
+            raise DaemonError(f'can\'t find directory "{dtl_dir()}"')
+
+        results = []
+        for name in files:
+            try:
+                tree = self.tree(name)
+            except DaemonError:
+                continue
+            results.append([(f.time.key, name, f.format(Time({}))) for f in tree.find(description, ongoing=ongoing, mode=mode)])
+
+        return {'output': format_finds(list(chain.from_iterable(results)))}
+
+    def ongoing(self, file_path: str, description: str) -> dict:
+        tree = self.tree(file_path)
+        return {'entries': [f.format(Time({})) for f in tree.find(description, ongoing = True)]}
+
+    @asynccontextmanager
+    async def locked(self, file_path: str) -> AsyncIterator[None]:
+        """Hold the write lock of `file_path` like `dtl.files.locked`, waiting
+        for it in a thread instead of blocking the event loop."""
+        with open(sidecar_path(file_path, 'lock'), 'a') as lock:
+            held = flocked(lock)
+            await asyncio.get_running_loop().run_in_executor(None, held.__enter__)
+            try:
+                yield
+            finally:
+                held.__exit__(None, None, None)
+
+    async def add(self, file_path: str, description: str, ongoing: bool) -> dict:
+        self.tree(file_path)
+
+        segment = Segment(Time.now(), description, ongoing = ongoing)
+        entry_id = queue_segment(file_path, segment)
+        async with self.locked(file_path):
+            saved = save_queue(file_path, entry_id, partial(self.tree, file_path))
+        if saved is not None:
+            self.saved(file_path, *saved)
+
+        return {'output': segment.format(Time({}))}
+
+    async def end(self, file_path: str, description: str, index: int, entries: list[str]) -> dict:
+        async with self.locked(file_path):
+            tree = self.tree(file_path)
+
+            finds = tree.find(description, ongoing = True, with_parent = True)
+            if [f[0].format(Time({})) for f in finds] != entries or not 0 <= index < len(finds):
+                raise DaemonError(f'the ongoing entries of "{description}" changed, please try again')
+
+            segment, parent = finds[index]
+            self.saved(file_path, tree, end_segment(file_path, tree, segment, parent))
+
+        return {}
+
+    async def handle_request(self, request: dict) -> dict:
+        try:
+            match request:
+                case {'cmd': 'ping'}:
+                    return {}
+                case {'cmd': 'stats'}:
+                    return metrics.snapshot()
+                case {'cmd': 'find', 'file': file_path, 'description': description, 'ongoing': ongoing, 'mode': mode}:
+                    return self.find(file_path, description, ongoing, mode)
+                case {'cmd': 'ongoing', 'file': file_path, 'description': description}:
+                    return self.ongoing(file_path, description)
+                case {'cmd': 'add', 'file': file_path, 'description': description, 'ongoing': ongoing}:
+                    return await self.add(file_path, description, ongoing)
+                case {'cmd': 'end', 'file': file_path, 'description': description, 'index': index, 'entries': entries}:
+                    return await self.end(file_path, description, index, entries)
+                case _:
+                    return {'error': f'invalid request {json.dumps(request)}'}
+        except (DaemonError, ValueError) as e:
+            return {'error': str(e)}
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while (line := await reader.readline()) != b'':
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except json.JSONDecodeError:
+                    response = {'error': 'invalid request'}
+
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            self.refresh()
+
+    async def serve(self) -> None:
+        os.makedirs(dtl_dir(), exist_ok=True)
+
+        for name in dtl_files():
+            try:
+                self.tree(name)
+            except DaemonError as e:
+                print(f'Error: {e}')
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        server = await asyncio.start_unix_server(self.handle_client, path=socket_path())
+        print(f'Listening on {socket_path()}')
+
+        async with server:
+            watcher = asyncio.create_task(self.watch())
+            await stop.wait()
+            watcher.cancel()
+
+def serve() -> None:
+    if daemon_request({'cmd': 'ping'}) is not None:
+        print(f'Error: dtl serve is already running on "{socket_path()}"')
+        exit(1)
+
+    # A socket left behind by a daemon that didn't shut down cleanly.
+    if os.path.exists(socket_path()):
+        os.remove(socket_path())
+
+    try:
+        asyncio.run(Daemon().serve())
+    finally:
+        if os.path.exists(socket_path()):
+            os.remove(socket_path())
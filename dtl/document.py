@@ -0,0 +1,276 @@
+from __future__ import annotations
+from bisect import bisect_right
+from collections import defaultdict
+from contextlib import redirect_stdout
+from io import StringIO
+from itertools import chain
+from operator import attrgetter
+from typing import Iterator
+
+from dtl.ast import File, Segment, Time, normalize_segments
+from dtl.parse import Parser
+from dtl.tokenize import ParseError, Token
+
+class Block:
+    """The lines of a segment in the source: its header and its block,
+    including blank lines after it, up to the next line that isn't nested
+    under it.
+
+    `start` is relative to the start of the parent block (or of the source,
+    for top-level segments), so that an edit only moves the blocks after it
+    in the same parent and in the parent's ancestors.
+    """
+    __slots__ = ('segment', 'start', 'length', 'parent', 'children', 'in_tree')
+
+    def __init__(self, segment: Segment, start: int, length: int, children: list[Block]) -> None:
+        self.segment = segment
+        self.start = start
+        self.length = length
+        self.parent: Block | None = None
+        self.children = children
+        # Whether `segment` is in the validated tree, rather than merged
+        # with other untagged segments at the same time.
+        self.in_tree = False
+
+        for child in children:
+            child.start -= start
+            child.parent = self
+
+class BlockParser(Parser):
+    """A Parser that also records the Block of every segment it parses."""
+    def __init__(self, src: bytes) -> None:
+        super().__init__()
+        self.src = src
+        # The blocks parsed so far in each segment being parsed, innermost last.
+        self.levels: list[list[Block]] = [[]]
+
+    def line_start(self, token: Token) -> int:
+        if token.pos is None:
+            return len(self.src)
+        return self.src.rfind(b'\n', 0, token.pos) + 1
+
+    def parse_time(self, parent_time: Time) -> Segment:
+        start = self.line_start(self.lexer.peak())
+
+        self.levels.append([])
+        segment = super().parse_time(parent_time)
+        children = self.levels.pop()
+
+        self.levels[-1].append(Block(segment, start, self.line_start(self.lexer.peak()) - start, children))
+        return segment
+
+def nested(node: File | Segment) -> Iterator[Segment]:
+    """Every segment nested under `node`."""
+    for segment in chain.from_iterable(node.segments.values()):
+        yield segment
+        yield from nested(segment)
+
+def mark(blocks: list[Block], present: set[int]) -> None:
+    for block in blocks:
+        block.in_tree = id(block.segment) in present
+        mark(block.children, present)
+
+def tagged(segment: Segment) -> bool:
+    return segment.description is not None or len(segment.commands) > 0
+
+def appended_depth(src: bytearray, start: int, end: int, delta: int) -> int:
+    """For lines inserted at the end of the source, e.g. by `dtl add`, the
+    number of blocks at the end they are all nested in, since they can only
+    change those blocks; 0 for any other edit."""
+    if not start == end == len(src) - delta or (start > 0 and src[start-1] != ord('\n')):
+        return 0
+
+    lines = [line for line in src[start:].split(b'\n') if not line.isspace() and line != b'']
+    # Blank lines belong to the innermost block before them.
+    return min((len(line) - len(line.lstrip(b'\t')) for line in lines), default=len(src))
+
+class Document:
+    """A DTL file kept parsed while it is edited, e.g. by an editor plugin.
+
+    `edit` changes the source and reparses the smallest block around the
+    change that still parses on its own, splicing the result into `tree`,
+    so that the work done depends on the size of that block rather than of
+    the file. `tree` is always what `Parser.parse` would make of the source.
+
+    Offsets are in bytes of the UTF-8 encoded source.
+    """
+    def __init__(self, src: str | bytes) -> None:
+        # Edited in place, so that an edit doesn't copy the whole source.
+        self.src = bytearray()
+        self.tree = File(Time({}), [])
+        # Top-level blocks in source order, None if the source doesn't parse.
+        self.blocks: list[Block] | None = None
+        # The nodes the last edit replaced in the tree and the nodes that
+        # replaced them, e.g. to tell which entries it added.
+        self.changed: tuple[list[File | Segment], list[File | Segment]] = ([], [])
+
+        self.load(bytearray(src.encode() if isinstance(src, str) else src))
+
+    def text(self) -> str:
+        return self.src.decode()
+
+    def load(self, src: bytearray) -> None:
+        """Parse all of `src`. Raises ParseError if it doesn't parse, keeping
+        the last tree that did."""
+        self.src = src
+        self.blocks = None
+
+        parser = BlockParser(bytes(src))
+        parser.lexer.tokenize_buffer(parser.src)
+        header_time = parser.parse_header()
+        segments = parser.parse_segments(header_time)
+
+        tree = File(header_time, segments)
+        tree.validate(header_time)
+
+        self.changed = ([self.tree], [tree])
+        self.tree = tree
+        self.blocks = parser.levels[0]
+        mark(self.blocks, {id(segment) for segment in nested(tree)})
+
+    def edit(self, offset: int, removed: int, inserted: str | bytes) -> None:
+        """Replace the `removed` bytes at `offset` with `inserted`.
+
+        Raises ParseError if the new source doesn't parse; the edit is still
+        applied, and the next edit reparses the whole file.
+        """
+        if isinstance(inserted, str):
+            inserted = inserted.encode()
+        if not 0 <= offset <= offset + removed <= len(self.src):
+            raise ValueError(f'edit of {removed} bytes at {offset} is outside of the source')
+
+        self.src[offset:offset+removed] = inserted
+
+        if self.blocks is None or not self.reparse(offset, offset + removed, len(inserted) - removed):
+            self.load(self.src)
+
+    def reparse(self, start: int, end: int, delta: int) -> bool:
+        """Reparse the blocks around what was the source from `start` to
+        `end` before an edit that made it `delta` bytes longer. Returns False
+        if the whole file must be reparsed instead."""
+        assert self.blocks is not None
+        src = self.src
+
+        # The blocks strictly containing the edit, outermost first, with
+        # their absolute start. An edit of the first character of a block's
+        # header or of the newline ending it may join it to another block.
+        path: list[tuple[Block, int]] = []
+        siblings, base = self.blocks, 0
+        appended = appended_depth(src, start, end, delta)
+        while (i := bisect_right(siblings, start - base, key=attrgetter('start')) - 1) >= 0:
+            block = siblings[i]
+            block_end = base + block.start + block.length
+            if not base + block.start < start or not (end < block_end or (end == block_end and len(path) < appended)):
+                break
+
+            path.append((block, base + block.start))
+            siblings, base = block.children, base + block.start
+
+        for depth, (block, block_start) in reversed(list(enumerate(path))):
+            parent = block.parent
+            if parent is not None and not parent.in_tree:
+                continue
+
+            parent_time = parent.segment.time if parent is not None else self.tree.header_time
+            blocks = self.parse_blocks(src[block_start:block_start + block.length + delta], depth, parent_time)
+            if blocks is not None and self.splice(parent, block, 1, blocks, delta):
+                return True
+
+        # Otherwise, reparse the top-level blocks the edit touches, and the one
+        # before in case the edit indents the first of them.
+        if len(self.blocks) == 0 or start <= self.blocks[0].start:
+            return False
+
+        first = bisect_right(self.blocks, start, key=attrgetter('start')) - 1
+        if self.blocks[first].start == start:
+            first -= 1
+        last = bisect_right(self.blocks, end, key=attrgetter('start')) - 1
+
+        region_start = self.blocks[first].start
+        region_end = self.blocks[last].start + self.blocks[last].length
+        # Text after the last block isn't parsed, and text inserted right
+        # before it could join it to the last block.
+        if end > region_end or (end == region_end and region_end < len(src) - delta):
+            return False
+
+        blocks = self.parse_blocks(src[region_start:region_end + delta], 0, self.tree.header_time)
+        return blocks is not None and self.splice(None, self.blocks[first], last - first + 1, blocks, delta)
+
+    def parse_blocks(self, src: bytes, depth: int, parent_time: Time) -> list[Block] | None:
+        """Parse `src` as segments indented `depth` times, or None if it isn't."""
+        parser = BlockParser(bytes(src))
+        parser.lexer.tokenize_buffer(parser.src)
+
+        # The parse is only tried, errors are reported when the file is reparsed.
+        with redirect_stdout(StringIO()):
+            try:
+                for _ in range(depth):
+                    parser.lexer.assert_token('OPEN')
+                while parser.lexer.peak().type == 'AT':
+                    parser.parse_time(parent_time)
+                for _ in range(depth):
+                    parser.lexer.assert_token('END')
+            except ParseError:
+                return None
+
+        blocks = parser.levels[0]
+        if parser.lexer.peak().type != 'EOF' or len(blocks) == 0 or blocks[0].start != 0:
+            return None
+
+        return blocks
+
+    def splice(self, parent: Block | None, first: Block, count: int, blocks: list[Block], delta: int) -> bool:
+        """Replace `count` blocks of `parent`, starting at `first`, with the
+        newly parsed `blocks`, or return False if that changes how segments
+        at that level are merged."""
+        siblings = parent.children if parent is not None else self.blocks
+        assert siblings is not None
+        owner: File | Segment = parent.segment if parent is not None else self.tree
+        index = siblings.index(first)
+
+        old = first.segment
+        new = blocks[0].segment
+        time_segments = owner.segments.get(old.time, [])
+        if count == 1 and len(blocks) == 1 and tagged(old) and tagged(new) and new.time == old.time and any(seg is old for seg in time_segments):
+            # Tagged segments are never merged, so the new one takes the old one's place.
+            time_segments[[seg is old for seg in time_segments].index(True)] = new
+        else:
+            grouped: defaultdict[Time, list[Segment]] = defaultdict(list)
+            for block in chain(siblings[:index], blocks, siblings[index+count:]):
+                grouped[block.segment.time].append(block.segment)
+
+            normalized = normalize_segments(grouped)
+            if any(id(seg) not in map(id, grouped[time]) for time, segs in normalized.items() for seg in segs):
+                return False
+            owner.segments = normalized
+
+        scope_time = parent.segment.time if parent is not None else self.tree.header_time
+        present: set[int] = set()
+        for block in blocks:
+            block.segment.validate(scope_time)
+            block.start += first.start
+            block.parent = parent
+
+            if any(seg is block.segment for seg in owner.segments.get(block.segment.time, [])):
+                present.add(id(block.segment))
+                present.update(id(seg) for seg in nested(block.segment))
+        mark(blocks, present)
+
+        self.changed = ([block.segment for block in siblings[index:index+count]], [block.segment for block in blocks])
+        siblings[index:index+count] = blocks
+        for block in siblings[index+len(blocks):]:
+            block.start += delta
+
+        node = parent
+        while node is not None:
+            node.length += delta
+            ancestors = node.parent.children if node.parent is not None else self.blocks
+            for block in ancestors[ancestors.index(node)+1:]:
+                block.start += delta
+            node = node.parent
+
+        self.tree._description_index = None
+        if self.tree._time_index is not None:
+            self.tree._time_index.remove(owner)
+
+        return True
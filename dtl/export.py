@@ -0,0 +1,311 @@
+import csv
+import gc
+import json
+import mmap
+import struct
+import sys
+
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate, chain
+from typing import BinaryIO, Iterator, TextIO
+
+from dtl.ast import Cmd, File, Option, Segment, Time
+
+FORMATS = ['csv', 'jsonl', 'columnar']
+
+# File extension of each format.
+EXTENSIONS = {'csv': '.csv', 'jsonl': '.jsonl', 'columnar': '.dtlc'}
+
+FIELDS = ['id', 'parent', 'depth', 'time', 'start', 'end', 'description', 'ongoing', 'commands']
+
+# The columnar format is a header, a directory of sections and the sections
+# themselves, each a little-endian array starting on an 8-byte boundary:
+#
+#     header:    magic, version, key of the file's header time, number of sections
+#     directory: per section: name, array typecode, offset, length in bytes
+#
+# Segments are numbered in file order and each has a row in the segment
+# columns; commands and options are rows of their own tables pointing back
+# at their owner. Strings are indices into the string table, -1 for None.
+COLUMNAR_MAGIC = b'DTLC'
+COLUMNAR_VERSION = 1
+COLUMNAR_HEADER = struct.Struct('<4sIqI')
+COLUMNAR_SECTION = struct.Struct('<16scxxxxxxxqq')
+
+# `flags` bits.
+PERIOD = 1
+ONGOING = 2
+
+# Start or end minute of a segment that has none (e.g. no year).
+NO_MINUTE = -(1 << 63)
+
+EPOCH = datetime(1970, 1, 1)
+
+def flatten(tree: File) -> Iterator[tuple[int, int, Segment]]:
+    """The parent id and depth of every segment of `tree`, in file order.
+
+    A segment's id is its position in this order; top-level segments have
+    the parent id -1.
+    """
+    count = 0
+
+    def visit(node: File | Segment, parent: int, depth: int) -> Iterator[tuple[int, int, Segment]]:
+        nonlocal count
+        for segment in chain.from_iterable(node.segments.values()):
+            segment_id = count
+            count += 1
+
+            yield parent, depth, segment
+            yield from visit(segment, segment_id, depth + 1)
+
+    return visit(tree, -1, 0)
+
+def segment_minutes(segment: Segment) -> tuple[int | None, int | None]:
+    """The absolute start and end minute of `segment`.
+
+    A period ends at the end of its period end, an ongoing segment has no end,
+    and any other segment ends at the end of its time, e.g. a date at the end
+    of that day.
+    """
+    time = segment.time
+    try:
+        start = time.start_minute()
+        if segment.ongoing:
+            end = None
+        elif time.period and time.end is not None:
+            end = time.period_end().end_minute()
+        else:
+            end = time.end_minute()
+    except ValueError:
+        # Not a valid date, e.g. February 31st.
+        return None, None
+
+    return start, end
+
+def minute_str(minute: int | None) -> str | None:
+    if minute is None:
+        return None
+
+    return (EPOCH + timedelta(minutes=minute)).isoformat(timespec='minutes')
+
+def record(segment_id: int, parent: int, depth: int, segment: Segment) -> dict:
+    return {'id': segment_id, 'parent': parent, 'depth': depth, **segment_fields(segment)}
+
+def segment_fields(segment: Segment) -> dict:
+    """The fields of a record that describe `segment` itself."""
+    start, end = segment_minutes(segment)
+
+    return {
+        'time': segment.time.format(Time({})),
+        'start': minute_str(start),
+        'end': minute_str(end),
+        'description': segment.description,
+        'ongoing': segment.ongoing,
+        'commands': [
+            {
+                'command': cmd.command,
+                'description': cmd.description,
+                'options': [{'name': option.name, 'value': option.value} for option in cmd.options],
+            }
+            for cmd in segment.commands
+        ],
+    }
+
+def write_jsonl(tree: File, out: TextIO) -> None:
+    for segment_id, (parent, depth, segment) in enumerate(flatten(tree)):
+        out.write(json.dumps(record(segment_id, parent, depth, segment)) + '\n')
+
+def write_csv(tree: File, out: TextIO) -> None:
+    """Write one row per segment, with its commands written as in a DTL file."""
+    writer = csv.writer(out)
+    writer.writerow(FIELDS)
+
+    for segment_id, (parent, depth, segment) in enumerate(flatten(tree)):
+        row = record(segment_id, parent, depth, segment)
+        row['ongoing'] = str(row['ongoing']).lower()
+        row['commands'] = ''.join(cmd.format() for cmd in segment.commands)
+        writer.writerow([row[field] for field in FIELDS])
+
+def little_endian(column: array) -> array:
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+def write_columnar(tree: File, out: BinaryIO) -> None:
+    strings: dict[str, int] = {}
+
+    def string(value: str | None) -> int:
+        if value is None:
+            return -1
+        return strings.setdefault(value, len(strings))
+
+    columns: dict[str, array] = {
+        'parent': array('i'),
+        'depth': array('b'),
+        'time': array('q'),
+        'end_time': array('q'),
+        'flags': array('b'),
+        'start': array('q'),
+        'end': array('q'),
+        'description': array('i'),
+        'cmd_owner': array('i'),
+        'cmd_command': array('i'),
+        'cmd_description': array('i'),
+        'option_owner': array('i'),
+        'option_name': array('i'),
+        'option_value': array('i'),
+    }
+
+    cmd_id = 0
+    for segment_id, (parent, depth, segment) in enumerate(flatten(tree)):
+        time = segment.time
+        start, end = segment_minutes(segment)
+
+        columns['parent'].append(parent)
+        columns['depth'].append(depth)
+        columns['time'].append(time.key)
+        columns['end_time'].append(time.end.key if time.end is not None else 0)
+        columns['flags'].append((PERIOD if time.period else 0) | (ONGOING if segment.ongoing else 0))
+        columns['start'].append(NO_MINUTE if start is None else start)
+        columns['end'].append(NO_MINUTE if end is None else end)
+        columns['description'].append(string(segment.description))
+
+        for cmd in segment.commands:
+            columns['cmd_owner'].append(segment_id)
+            columns['cmd_command'].append(string(cmd.command))
+            columns['cmd_description'].append(string(cmd.description))
+
+            for option in cmd.options:
+                columns['option_owner'].append(cmd_id)
+                columns['option_name'].append(string(option.name))
+                columns['option_value'].append(string(option.value))
+
+            cmd_id += 1
+
+    encoded = [value.encode() for value in strings]
+    columns['string_offsets'] = array('q', accumulate((len(value) for value in encoded), initial=0))
+
+    sections: list[tuple[str, str, bytes]] = [(name, column.typecode, little_endian(column).tobytes()) for name, column in columns.items()]
+    sections.append(('strings', 'B', b''.join(encoded)))
+
+    offset = COLUMNAR_HEADER.size + COLUMNAR_SECTION.size * len(sections)
+    directory: list[bytes] = []
+    for name, typecode, data in sections:
+        offset += -offset % 8
+        directory.append(COLUMNAR_SECTION.pack(name.encode(), typecode.encode(), offset, len(data)))
+        offset += len(data)
+
+    out.write(COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, tree.header_time.key, len(sections)))
+    out.write(b''.join(directory))
+
+    position = COLUMNAR_HEADER.size + COLUMNAR_SECTION.size * len(sections)
+    for _, _, data in sections:
+        out.write(b'\0' * (-position % 8))
+        position += -position % 8
+
+        out.write(data)
+        position += len(data)
+
+class ColumnarError(Exception):
+    pass
+
+class Columnar:
+    """A columnar file, memory-mapped.
+
+    `columns` maps each section name to a memoryview of it, cast to its
+    typecode, so columns are read straight from the mapped file (and can be
+    wrapped with e.g. `numpy.frombuffer` without copying). Call `close` once
+    done with them.
+    """
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, header_key, count = COLUMNAR_HEADER.unpack_from(self.mmap, 0)
+        except struct.error:
+            raise ColumnarError('not a columnar DTL file')
+        if magic != COLUMNAR_MAGIC:
+            raise ColumnarError('not a columnar DTL file')
+        if version != COLUMNAR_VERSION:
+            raise ColumnarError(f'unsupported columnar format version {version}')
+
+        self.header_time = Time.from_key(header_key)
+
+        self.view = memoryview(self.mmap)
+        self.columns: dict[str, memoryview | array] = {}
+        for i in range(count):
+            name, typecode, offset, length = COLUMNAR_SECTION.unpack_from(self.mmap, COLUMNAR_HEADER.size + COLUMNAR_SECTION.size * i)
+            column = self.view[offset:offset+length].cast(typecode.decode())
+
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column = little_endian(array(column.format, column))
+
+            self.columns[name.rstrip(b'\0').decode()] = column
+
+    def strings(self) -> list[str]:
+        offsets = self.columns['string_offsets']
+        data = bytes(self.columns['strings'])
+        return [data[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+
+    def close(self) -> None:
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self.columns = {}
+        self.view.release()
+        self.mmap.close()
+
+def load_columnar(path: str) -> File:
+    """Rebuild the File written to `path` by `write_columnar`.
+
+    Raises ColumnarError if it isn't a columnar file.
+    """
+    columnar = Columnar(path)
+
+    # As in `load_pickle`, the tree is millions of new objects and no garbage.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return build_tree(columnar)
+    finally:
+        if enabled:
+            gc.enable()
+        columnar.close()
+
+def build_tree(columnar: Columnar) -> File:
+    columns = columnar.columns
+    strings = columnar.strings()
+
+    segments: list[Segment] = []
+    top_level: list[Segment] = []
+
+    for parent, key, end_key, flags, description in zip(
+        columns['parent'], columns['time'], columns['end_time'], columns['flags'], columns['description'],
+    ):
+        time = Time.from_key(key)
+        if flags & PERIOD:
+            time.period = True
+            if end_key != 0:
+                time.end = Time.from_key(end_key)
+
+        segment = Segment(time, strings[description] if description >= 0 else None, [], [], bool(flags & ONGOING))
+
+        if parent < 0:
+            top_level.append(segment)
+        else:
+            segments[parent].segments[time].append(segment)
+        segments.append(segment)
+
+    cmds: list[Cmd] = []
+    for owner, command, description in zip(columns['cmd_owner'], columns['cmd_command'], columns['cmd_description']):
+        cmd = Cmd(strings[command], strings[description], [])
+        segments[owner].commands.append(cmd)
+        cmds.append(cmd)
+
+    for owner, name, value in zip(columns['option_owner'], columns['option_name'], columns['option_value']):
+        cmds[owner].options.append(Option(strings[name], strings[value]))
+
+    return File(columnar.header_time, top_level)
@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import os
+
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from itertools import chain
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on this platform (e.g. Windows); writers aren't serialized.
+    fcntl = None
+
+from dtl import metrics
+from dtl.config import dtl_dir
+
+# Stands in for typing.TYPE_CHECKING, since importing typing slows down startup.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import TextIO
+
+    from dtl.ast import File, Segment, Time
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# File argument standing for every file in DTL_dir.
+ALL_FILES = '@*'
+
+def absolute_path(file_path: str) -> str:
+    if len(file_path) > 0 and file_path[0] == '@':
+        return f'{dtl_dir()}/{file_path[1:]}.dtl'
+
+    return file_path
+
+def sidecar_path(file_path: str, kind: str) -> str:
+    """Path of the hidden `kind` file kept next to `file_path`, e.g. `.work.dtl.lock`."""
+    directory, name = os.path.split(absolute_path(file_path))
+    return os.path.join(directory, f'.{name}.{kind}')
+
+@contextmanager
+def flocked(file: TextIO) -> Iterator[None]:
+    if fcntl is not None:
+        fcntl.flock(file, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+@contextmanager
+def locked(file_path: str) -> Iterator[None]:
+    """Hold the write lock of `file_path`.
+
+    Every command that changes a file reads, modifies and writes it while
+    holding its lock. The lock is taken on a separate lock file, since
+    `write_file` replaces the file itself.
+    """
+    with open(sidecar_path(file_path, 'lock'), 'a') as lock, flocked(lock):
+        yield
+
+def write_file(file_path: str, tree: File) -> os.stat_result:
+    """Replace `file_path` with the formatted `tree` and return the new file's stat.
+
+    The tree is written to a temporary file that is then renamed over
+    `file_path`, so readers see either the old or the new file, never a
+    partly written one.
+    """
+    import tempfile
+
+    path = absolute_path(file_path)
+    directory, name = os.path.split(path)
+
+    with metrics.stage('write_file'):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+        try:
+            with open(fd, 'w', buffering=WRITE_BUFFER_SIZE) as file:
+                tree.write(file)
+                file.flush()
+
+                if os.path.exists(path):
+                    os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+                stat = os.fstat(fd)
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    return stat
+
+class Comparison:
+    """A text stream that checks everything written to it against `file`."""
+    def __init__(self, file: TextIO) -> None:
+        self.file = file
+        self.equal = True
+
+    def write(self, text: str) -> None:
+        if self.equal and self.file.read(len(text)) != text:
+            self.equal = False
+
+def is_formatted(file_path: str, tree: File) -> bool:
+    if read_marker(file_path, os.stat(absolute_path(file_path))) is not None:
+        return True
+
+    with metrics.stage('compare'), open(absolute_path(file_path), 'r') as file:
+        comparison = Comparison(file)
+        tree.write(comparison)
+        return comparison.equal and file.read(1) == ''
+
+def read_marker(file_path: str, stat: os.stat_result) -> dict | None:
+    """The formatted marker of `file_path` (see `record_formatted`), or None
+    if there is none or the file has changed since it was recorded."""
+    import json
+
+    try:
+        with open(sidecar_path(file_path, 'formatted'), 'r') as file:
+            marker = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(marker, dict) or marker.get('stat') != [stat.st_ino, stat.st_size, stat.st_mtime_ns]:
+        return None
+
+    return marker
+
+def record_formatted(file_path: str, tree: File, stat: os.stat_result, before: list[Time] = []) -> None:
+    """Record that `file_path`, as of `stat`, ends with the formatted `tree`.
+
+    The marker is kept next to the file and holds where the last top-level
+    block starts, along with the top-level segments that `TimeIndex.path`
+    could nest a later time under instead of appending it, so that a new
+    entry can be added after reading only that block (see `append_to_tail`).
+    `before` are the times of such segments in the file before `tree`, if
+    `tree` only holds the end of the file.
+    """
+    import json
+
+    from dtl.index import prefix_depth, time_fields
+
+    top = [segment for segments in tree.segments.values() for segment in segments]
+    last = stat.st_size
+    containers: list[int] = []
+    if len(top) > 0:
+        last -= len(top[-1].format(tree.header_time).encode())
+
+        # Segments are sorted by time, so a segment that can contain a time
+        # after the last block's also shares its leading units.
+        fields = time_fields(top[-1].time)
+        for time in chain(before, [segment.time for segment in top[:-1]]):
+            depth = prefix_depth(time_fields(time))
+            if time.weekday is None and depth < len(fields) and time_fields(time)[:depth] == fields[:depth]:
+                containers.append(time.key)
+
+    marker = {
+        'stat': [stat.st_ino, stat.st_size, stat.st_mtime_ns],
+        'header': tree.header_time.key,
+        'last': last,
+        'containers': containers,
+    }
+
+    try:
+        with open(sidecar_path(file_path, 'formatted'), 'w') as file:
+            json.dump(marker, file)
+    except OSError:
+        pass
+
+def append_to_tail(file_path: str, entries: list[str]) -> os.stat_result | None:
+    """Append the formatted `entries` to `file_path` after reading only its
+    last top-level block, and return the new file's stat.
+
+    Returns None, leaving the file as it is, if the file has no formatted
+    marker or an entry wouldn't end up last in it, in which case the whole
+    file has to be loaded (see `insert_segments`).
+
+    The caller must hold the write lock of the file.
+    """
+    from dtl.ast import File, Time
+    from dtl.index import prefix_depth, time_fields
+    from dtl.parse import Parser
+    from dtl.tokenize import ParseError
+
+    path = absolute_path(file_path)
+
+    with metrics.stage('tail'), open(path, 'rb') as file:
+        marker = read_marker(file_path, os.fstat(file.fileno()))
+        if marker is None:
+            return None
+
+        file.seek(marker['last'])
+        try:
+            tail = file.read().decode()
+        except ValueError:
+            return None
+
+        header_time = Time.from_key(marker['header'])
+        parser = Parser(debug = False)
+        try:
+            parser.lexer.tokenize(tail)
+            tree = File(header_time, parser.parse_segments(header_time))
+            if parser.lexer.peak().type != 'EOF':
+                return None
+            tree.validate(header_time)
+        except ParseError:
+            return None
+
+        # The new lines are formatted against the block, so it must be as read.
+        if ''.join([segment.format(header_time) for segs in tree.segments.values() for segment in segs]) != tail:
+            return None
+
+    before = [Time.from_key(key) for key in marker['containers']]
+    lines: list[str] = []
+    for segment in map(parse_entry, entries):
+        fields = time_fields(segment.time)
+        for time in before:
+            depth = prefix_depth(time_fields(time))
+            if depth < prefix_depth(fields) and time_fields(time)[:depth] == fields[:depth]:
+                return None
+
+        position = tree.append_position(segment)
+        if position is None:
+            return None
+
+        lines.append(segment.format(*position))
+        tree.insert_segment(segment)
+
+    with metrics.stage('append'), open(path, 'a') as file:
+        file.write(''.join(lines))
+        file.flush()
+        stat = os.fstat(file.fileno())
+
+    record_formatted(file_path, tree, stat, before)
+    return stat
+
+def insert_segments(file_path: str, tree: File, segments: list[Segment]) -> os.stat_result:
+    """Insert `segments` into `tree`, save the result to `file_path` and
+    return the new file's stat.
+
+    If the file is already formatted and each segment ends up last in it, only
+    the segments' own lines are appended to the file; otherwise the whole
+    file is sorted and rewritten once.
+    """
+    append = is_formatted(file_path, tree)
+    lines: list[str] = []
+
+    for segment in segments:
+        position = tree.append_position(segment) if append else None
+        if position is None:
+            append = False
+        else:
+            lines.append(segment.format(*position))
+
+        tree.insert_segment(segment)
+
+    if not append:
+        tree.validate(tree.header_time)
+        stat = write_file(file_path, tree)
+    else:
+        with metrics.stage('append'), open(absolute_path(file_path), 'a') as file:
+            file.write(''.join(lines))
+            file.flush()
+            stat = os.fstat(file.fileno())
+
+    record_formatted(file_path, tree, stat)
+    return stat
+
+def queue_segment(file_path: str, segment: Segment) -> str:
+    """Queue `segment` to be added to `file_path` and return its queue id.
+
+    Adds go through a queue file so that whoever next holds the write lock
+    saves every queued segment in a single write, instead of each writer
+    waiting its turn to rewrite the file.
+
+    Raises FileNotFoundError if the file doesn't exist, and ValueError if
+    the segment's description can't be written (see `valid_description`).
+    """
+    import json
+    import uuid
+
+    from dtl.ast import Time
+
+    if not os.path.exists(absolute_path(file_path)):
+        raise FileNotFoundError(absolute_path(file_path))
+    if segment.description is not None and not valid_description(segment.description):
+        raise ValueError(f'invalid description "{segment.description}", it can\'t contain "]" or a line break')
+
+    entry_id = uuid.uuid4().hex
+
+    with open(sidecar_path(file_path, 'queue'), 'a') as queue, flocked(queue):
+        queue.write(json.dumps({'id': entry_id, 'entry': segment.format(Time({}))}) + '\n')
+
+    return entry_id
+
+def queued(line: str) -> dict | None:
+    """The queue entry on `line`, or None if it is damaged or its entry
+    doesn't parse, e.g. if it was queued by an older version."""
+    import json
+
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+
+    if not isinstance(entry, dict) or not isinstance(entry.get('id'), str) or not isinstance(entry.get('entry'), str):
+        return None
+    if parse_entry(entry['entry']) is None:
+        return None
+
+    return entry
+
+def read_queue(file_path: str) -> list[dict]:
+    """The entries queued for `file_path`, leaving out the ones that can't
+    be added (see `queued`); the next `dequeue` drops those."""
+    try:
+        with open(sidecar_path(file_path, 'queue'), 'r') as queue, flocked(queue):
+            return [entry for line in queue if (entry := queued(line)) is not None]
+    except FileNotFoundError:
+        return []
+
+def dequeue(file_path: str, entry_ids: set[str]) -> None:
+    """Remove the entries with the given ids, and any that can't be added,
+    from the queue of `file_path`."""
+    with open(sidecar_path(file_path, 'queue'), 'r+') as queue, flocked(queue):
+        rest = [line for line in queue if (entry := queued(line)) is not None and entry['id'] not in entry_ids]
+        queue.seek(0)
+        queue.truncate()
+        queue.write(''.join(rest))
+
+def add_segment(file_path: str, segment: Segment, load: Callable[[], File], tail: bool = False) -> tuple[File | None, os.stat_result] | None:
+    """Add `segment` to `file_path`, along with any other queued segments.
+
+    `load` is called with the write lock held to get the current tree of the
+    file. Returns the updated tree and the stat of the written file, or None
+    if another writer saved the segment first. With `tail`, the segments are
+    first appended after reading only the end of the file (see
+    `append_to_tail`), in which case no tree is loaded or returned.
+
+    Raises FileNotFoundError and ValueError like `queue_segment`.
+    """
+    entry_id = queue_segment(file_path, segment)
+
+    with locked(file_path):
+        return save_queue(file_path, entry_id, load, tail)
+
+def save_queue(file_path: str, entry_id: str, load: Callable[[], File], tail: bool = False) -> tuple[File | None, os.stat_result] | None:
+    """Save the segments queued for `file_path` if the entry `entry_id` is
+    still among them, like `add_segment` does once it holds the lock.
+
+    The caller must hold the write lock of the file.
+    """
+    entries = read_queue(file_path)
+    if entry_id not in [e['id'] for e in entries]:
+        return None
+
+    tree = None
+    stat = append_to_tail(file_path, [e['entry'] for e in entries]) if tail else None
+    if stat is None:
+        try:
+            tree = load()
+        except BaseException:
+            dequeue(file_path, {entry_id})
+            raise
+
+        stat = insert_segments(file_path, tree, [parse_entry(e['entry']) for e in entries])
+    dequeue(file_path, {e['id'] for e in entries})
+
+    return tree, stat
+
+def valid_description(description: str) -> bool:
+    """Whether `description` can be written between the brackets of an entry."""
+    return ']' not in description and '\n' not in description and '\r' not in description
+
+def parse_entry(entry: str) -> Segment | None:
+    """The segment of a single formatted entry, or None if it doesn't parse."""
+    from contextlib import redirect_stdout
+    from io import StringIO
+
+    from dtl.parse import ParseError, Parser
+
+    try:
+        # The parser reports errors on stdout.
+        with redirect_stdout(StringIO()):
+            tree = Parser(debug = False).parse(entry)
+    except ParseError:
+        return None
+
+    return next(chain.from_iterable(tree.segments.values()), None)
+
+def format_finds(finds: list[tuple[int, str, str]]) -> str:
+    """Matches from several files, as (time key, file, entry), in time order."""
+    return ''.join([f'{file_path}: {segment}' for _, file_path, segment in sorted(finds, key=lambda f: f[:2])])
+
+def end_segment(file_path: str, tree: File, segment: Segment, parent: File | Segment) -> os.stat_result:
+    """End the ongoing `segment` now and save the result to `file_path`.
+
+    The caller must hold the write lock of the file.
+    """
+    from dtl.ast import Time
+
+    tree.remove_segment(segment, parent)
+
+    segment.ongoing = False
+    segment.time.period = True
+    segment.time.end = Time.now()
+
+    tree.insert_segment(segment)
+
+    return write_file(file_path, tree)
+
+def dtl_files() -> list[str]:
+    """Every file in DTL_dir, as @name.
+
+    Raises FileNotFoundError if DTL_dir doesn't exist.
+    """
+    return sorted(f'@{name[:-4]}' for name in os.listdir(dtl_dir()) if name.endswith('.dtl'))
@@ -0,0 +1,383 @@
+from __future__ import annotations
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+# Stands in for typing.TYPE_CHECKING, as in the modules loaded at startup.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from dtl.ast import File, Segment, Time
+    from dtl.recurrence import Recurrences
+
+# Stands in for unspecified time units at the end of an interval, so that
+# e.g. `@2022 August` spans every date and time in August.
+MAX_UNIT = 1 << 30
+
+type Key = tuple[int, int, int, int]
+
+def time_fields(time: Time) -> tuple[int | None, int | None, int | None, int | None]:
+    return (time.year, time.month, time.date, time.time)
+
+def prefix_depth(fields: tuple) -> int:
+    depth = 0
+    while depth < len(fields) and fields[depth] is not None:
+        depth += 1
+    return depth
+
+def start_key(time: Time) -> Key:
+    return tuple(0 if unit is None else unit for unit in time_fields(time))
+
+def end_key(time: Time) -> Key:
+    return tuple(MAX_UNIT if unit is None else unit for unit in time_fields(time))
+
+class Level:
+    """The child segments of one File or Segment, bucketed by time prefix.
+
+    A segment whose time has `n` leading specified units contains exactly the
+    times that share those units and specify at least one more, so the
+    segments that could contain a time are found with one dict lookup per
+    time unit instead of a scan over every child.
+    """
+    def __init__(self, node: File | Segment) -> None:
+        self.segments = node.segments
+        self.ranks: dict[Time, int] = {}
+        self.containers: dict[tuple, tuple[tuple[int, int], Segment]] = {}
+
+        for segs in node.segments.values():
+            for position, seg in enumerate(segs):
+                self.add(seg, position)
+
+    def add(self, segment: Segment, position: int) -> None:
+        """Record `segment`, found at `position` in its time's list of segments."""
+        rank = self.ranks.setdefault(segment.time, len(self.ranks))
+        order = (rank, position)
+
+        # A weekday recurs rather than containing the dates it falls on.
+        if segment.time.weekday is not None:
+            return
+
+        fields = time_fields(segment.time)
+        depth = prefix_depth(fields)
+        if depth == len(fields):
+            return
+
+        prefix = fields[:depth]
+        if prefix not in self.containers or order < self.containers[prefix][0]:
+            self.containers[prefix] = (order, segment)
+
+    def container(self, time: Time) -> Segment | None:
+        """The first child, in iteration order, whose time contains `time`."""
+        fields = time_fields(time)
+
+        found = [self.containers[fields[:k]] for k in range(prefix_depth(fields)) if fields[:k] in self.containers]
+        if len(found) == 0:
+            return None
+
+        return min(found, key=lambda c: c[0])[1]
+
+class IntervalTree:
+    """A static centered interval tree over closed (start, end, segment) intervals.
+
+    An interval ending before it starts is kept as the point at its start.
+    """
+    def __init__(self, intervals: list[tuple[Key, Key, Segment]]) -> None:
+        # Otherwise it would fall on both sides of every center, or neither.
+        intervals = [i if i[0] <= i[1] else (i[0], i[0], i[2]) for i in intervals]
+
+        points = sorted(point for start, end, _ in intervals for point in (start, end))
+        self.center: Key = points[len(points) // 2]
+
+        left  = [i for i in intervals if i[1] < self.center]
+        right = [i for i in intervals if i[0] > self.center]
+        here  = [i for i in intervals if i[0] <= self.center <= i[1]]
+
+        self.by_start = sorted(here, key=lambda i: i[0])
+        self.by_end   = sorted(here, key=lambda i: i[1], reverse=True)
+
+        self.left  = IntervalTree(left)  if len(left)  > 0 else None
+        self.right = IntervalTree(right) if len(right) > 0 else None
+
+    def overlapping(self, start: Key, end: Key) -> Iterator[tuple[Key, Key, Segment]]:
+        if end < self.center:
+            for interval in self.by_start:
+                if interval[0] > end:
+                    break
+                yield interval
+        elif start > self.center:
+            for interval in self.by_end:
+                if interval[1] < start:
+                    break
+                yield interval
+        else:
+            yield from self.by_start
+
+        if self.left is not None and start < self.center:
+            yield from self.left.overlapping(start, end)
+        if self.right is not None and end > self.center:
+            yield from self.right.overlapping(start, end)
+
+class TimeIndex:
+    """Time lookups over a validated File.
+
+    `path` finds where `File.insert_segment` puts a segment by per-level
+    prefix lookups, and `between` answers range queries over the entries
+    (segments with a description or commands) of the file: point entries
+    through a sorted array, periods, ongoing entries and entries spanning a
+    whole month or day through an interval tree, and weekday entries through
+    their occurrences on the dates in the range (see `Recurrences`).
+
+    The index follows changes made through `File.insert_segment`; a level
+    whose `segments` dict has been replaced is re-read on its next lookup.
+    """
+    def __init__(self, tree: File) -> None:
+        self.tree = tree
+        self.levels: dict[int, Level] = {}
+
+        self.points: list[tuple[Key, int, Segment]] | None = None
+        self.intervals: IntervalTree | None = None
+        self.recurrences: Recurrences | None = None
+
+    def level(self, node: File | Segment) -> Level:
+        level = self.levels.get(id(node))
+        if level is None or level.segments is not node.segments:
+            level = self.levels[id(node)] = Level(node)
+        return level
+
+    def path(self, time: Time) -> list[File | Segment] | None:
+        """The chain of segments, starting at the file, that a new segment at
+        `time` is nested under, or None if the file can't hold it."""
+        if not self.tree.header_time.contains(time):
+            return None
+
+        path: list[File | Segment] = [self.tree]
+        while (container := self.level(path[-1]).container(time)) is not None:
+            path.append(container)
+
+        return path
+
+    def add(self, parent: File | Segment, segment: Segment) -> None:
+        """Record `segment`, which was just appended to `parent.segments`."""
+        self.level(parent).add(segment, len(parent.segments[segment.time]) - 1)
+
+        self.points = None
+        self.intervals = None
+
+    def remove(self, parent: File | Segment) -> None:
+        """Forget what is known about `parent`, after a segment was removed from it."""
+        self.levels.pop(id(parent), None)
+
+        self.points = None
+        self.intervals = None
+
+    def build_ranges(self) -> None:
+        from dtl.recurrence import Recurrences
+
+        points: list[tuple[Key, int, Segment]] = []
+        intervals: list[tuple[Key, Key, Segment]] = []
+        weekdays: list[Segment] = []
+
+        def visit(node: File | Segment) -> None:
+            for segs in node.segments.values():
+                for seg in segs:
+                    if seg.description is not None or len(seg.commands) > 0:
+                        start = start_key(seg.time)
+                        if seg.time.weekday is not None:
+                            weekdays.append(seg)
+                        elif seg.ongoing:
+                            intervals.append((start, (MAX_UNIT,) * 4, seg))
+                        elif seg.time.period and seg.time.end is not None:
+                            try:
+                                end = seg.time.period_end()
+                            except ValueError:
+                                # Not a valid date, e.g. February 31st.
+                                end = seg.time.end
+                            # A period ending before it starts, e.g. a year
+                            # typed wrong, only covers its start.
+                            intervals.append((start, max(start, end_key(end)), seg))
+                        elif prefix_depth(time_fields(seg.time)) < 4:
+                            intervals.append((start, end_key(seg.time), seg))
+                        else:
+                            points.append((start, len(points), seg))
+                    visit(seg)
+
+        visit(self.tree)
+
+        self.points = sorted(points, key=lambda p: p[:2])
+        self.intervals = IntervalTree(intervals) if len(intervals) > 0 else None
+        self.recurrences = Recurrences(weekdays)
+
+    def between(self, start: Time, end: Time) -> list[Segment]:
+        """Entries overlapping the range from the start of `start` to the end of
+        `end`. Raises ValueError if the range has a date that isn't valid."""
+        if self.points is None:
+            self.build_ranges()
+
+        lo, hi = start_key(start), end_key(end)
+        if lo > hi:
+            return []
+
+        first = bisect_left(self.points, lo, key=lambda p: p[0])
+        last = bisect_right(self.points, hi, key=lambda p: p[0])
+        found = [(key, seg) for key, _, seg in self.points[first:last]]
+
+        if self.intervals is not None:
+            found += [(key, seg) for key, _, seg in self.intervals.overlapping(lo, hi)]
+
+        found += self.recurrences.between(start, end)
+
+        return [seg for _, seg in sorted(found, key=lambda f: f[0])]
+
+type Entry = tuple[float, Segment, File | Segment]
+
+def subtree(segment: Segment, reverse: bool = False) -> Iterator[Segment]:
+    """`segment` and the segments nested under it, in document order or reversed."""
+    if not reverse:
+        yield segment
+
+    children = [seg for segs in segment.segments.values() for seg in segs]
+    for child in (reversed(children) if reverse else children):
+        yield from subtree(child, reverse)
+
+    if reverse:
+        yield segment
+
+class DescriptionIndex:
+    """Segments of a validated File by description, split into ongoing and static.
+
+    Each entry records the segment's parent and a sequence number, so that
+    results come out in document order. `File.insert_segment` and
+    `File.remove_segment` keep it up to date: an inserted entry is numbered
+    between the entries before and after it in the file.
+    """
+    def __init__(self, tree: File) -> None:
+        self.entries: dict[str, dict[bool, list[Entry]]] = {}
+        self.sequence = 0
+        self.descriptions: list[str] | None = None
+
+        for segs in tree.segments.values():
+            for seg in segs:
+                self.add(seg, tree)
+
+    def add(self, segment: Segment, parent: File | Segment) -> None:
+        """Record `segment` and every segment nested under it."""
+        if segment.description is not None:
+            if segment.description not in self.entries:
+                self.entries[segment.description] = {True: [], False: []}
+                self.descriptions = None
+
+            self.entries[segment.description][segment.ongoing].append((self.sequence, segment, parent))
+            self.sequence += 1
+
+        for segs in segment.segments.values():
+            for seg in segs:
+                self.add(seg, segment)
+
+    def insert(self, segment: Segment, path: list[File | Segment]) -> bool:
+        """Record `segment`, just inserted under the last of `path` (see
+        `TimeIndex.path`), and every segment nested under it.
+
+        Returns False, recording nothing, if there are no sequence numbers
+        left between its neighbours, in which case the index must be rebuilt.
+        """
+        added = [seg for seg in subtree(segment) if seg.description is not None]
+        if len(added) == 0:
+            return True
+
+        before = self.neighbour(segment, path, reverse=True)
+        after = self.neighbour(segment, path)
+
+        if after is None:
+            sequences = [self.sequence + i for i in range(len(added))]
+            self.sequence += len(added)
+        else:
+            lo = -1 if before is None else self.sequence_of(before)
+            hi = self.sequence_of(after)
+
+            step = (hi - lo) / (len(added) + 1)
+            sequences = [lo + step * (i + 1) for i in range(len(added))]
+            if not all(a < b for a, b in zip([lo] + sequences, sequences + [hi])):
+                return False
+
+        parents: dict[int, File | Segment] = {id(segment): path[-1]}
+        for node in subtree(segment):
+            for seg in chain.from_iterable(node.segments.values()):
+                parents[id(seg)] = node
+        for sequence, seg in zip(sequences, added):
+            if seg.description not in self.entries:
+                self.entries[seg.description] = {True: [], False: []}
+                self.descriptions = None
+
+            self.entries[seg.description][seg.ongoing].append((sequence, seg, parents[id(seg)]))
+
+        return True
+
+    def neighbour(self, segment: Segment, path: list[File | Segment], reverse: bool = False) -> Segment | None:
+        """The segment with a description right after (or before) `segment`
+        and the segments nested under it in the file, if any."""
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            target = segment if depth == len(path) - 1 else path[depth + 1]
+
+            children = [seg for segs in node.segments.values() for seg in segs]
+            index = next(i for i in range(len(children) - 1, -1, -1) if children[i] is target)
+            siblings = reversed(children[:index]) if reverse else children[index+1:]
+
+            for sibling in siblings:
+                found = next((seg for seg in subtree(sibling, reverse) if seg.description is not None), None)
+                if found is not None:
+                    return found
+
+            if reverse and depth > 0 and node.description is not None:
+                return node
+
+        return None
+
+    def sequence_of(self, segment: Segment) -> float:
+        # Recently inserted entries, being the most likely neighbours, come last.
+        entries = self.entries[segment.description][segment.ongoing]
+        return next(sequence for sequence, seg, _ in reversed(entries) if seg is segment)
+
+    def remove(self, segment: Segment) -> None:
+        """Forget `segment` and every segment nested under it."""
+        if segment.description in self.entries:
+            entries = self.entries[segment.description]
+            entries[segment.ongoing] = [e for e in entries[segment.ongoing] if e[1] is not segment]
+
+        for segs in segment.segments.values():
+            for seg in segs:
+                self.remove(seg)
+
+    def matching(self, description: str, mode: str) -> list[str]:
+        match mode:
+            case 'exact':
+                return [description] if description in self.entries else []
+            case 'prefix':
+                if self.descriptions is None:
+                    self.descriptions = sorted(self.entries)
+
+                first = bisect_left(self.descriptions, description)
+                last = first
+                while last < len(self.descriptions) and self.descriptions[last].startswith(description):
+                    last += 1
+
+                return self.descriptions[first:last]
+            case 'substring':
+                return [d for d in self.entries if description in d]
+            case _:
+                raise ValueError(f'unknown search mode "{mode}"')
+
+    def find(self, description: str, ongoing: bool | None = None, mode: str = 'exact') -> list[tuple[Segment, File | Segment]]:
+        """Segments (with their parents) whose description matches `description`.
+
+        `mode` is 'exact', 'prefix' or 'substring'.
+        """
+        finds: list[Entry] = []
+        for match in self.matching(description, mode):
+            entries = self.entries[match]
+            if ongoing is None:
+                finds += entries[True] + entries[False]
+            else:
+                finds += entries[ongoing]
+
+        return [(segment, parent) for _, segment, parent in sorted(finds, key=lambda e: e[0])]
@@ -0,0 +1,139 @@
+import csv
+import json
+
+from datetime import datetime
+from itertools import chain
+from typing import Iterable, Iterator, TextIO
+
+from dtl.ast import Cmd, Segment, Time
+from dtl.files import valid_description
+from dtl.parse import ParseError, Parser
+
+FORMATS = ['csv', 'jsonl']
+
+class IngestError(Exception):
+    pass
+
+def parse_timestamp(value: str | int | float) -> datetime:
+    """An ISO 8601 timestamp, e.g. "2022-08-09 12:00", or seconds since the epoch, in local time."""
+    if isinstance(value, str):
+        try:
+            timestamp = datetime.fromisoformat(value.strip())
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                raise IngestError(f'invalid timestamp "{value}"')
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            timestamp = datetime.fromtimestamp(value)
+        except (OverflowError, OSError, ValueError):
+            raise IngestError(f'invalid timestamp "{value}"')
+    elif not isinstance(value, str):
+        raise IngestError(f'invalid timestamp "{value}"')
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+
+    # Years are written with four digits.
+    if timestamp.year < 1000:
+        raise IngestError(f'invalid timestamp "{value}", its year must have four digits')
+
+    return timestamp
+
+def parse_description(value: str) -> str:
+    """A description, which can't end its brackets early or span lines."""
+    if not isinstance(value, str):
+        raise IngestError(f'invalid description "{value}"')
+    if not valid_description(value):
+        raise IngestError(f'invalid description "{value}", it can\'t contain "]" or a line break')
+
+    return value
+
+def parse_ongoing(value: str | bool | None) -> bool:
+    if isinstance(value, bool):
+        return value
+
+    match (value or '').strip().lower():
+        case 'true' | 'yes' | 'y' | '1':
+            return True
+        case 'false' | 'no' | 'n' | '0' | '':
+            return False
+        case _:
+            raise IngestError(f'invalid ongoing value "{value}"')
+
+def parse_commands(value: str | list[str] | None, parser: Parser) -> list[Cmd]:
+    """Commands written as in a DTL file, e.g. "!note [...]", either as one
+    string or as a list of strings."""
+    if not value:
+        return []
+
+    if isinstance(value, list):
+        value = '\n'.join(value)
+
+    try:
+        return parser.parse_cmds_str(value)
+    except ParseError:
+        raise IngestError(f'invalid commands "{value}"')
+
+def segment_from_event(event: dict, parser: Parser) -> Segment:
+    if event.get('timestamp') in (None, ''):
+        raise IngestError('missing timestamp')
+    if event.get('description') in (None, ''):
+        raise IngestError('missing description')
+
+    return Segment(
+        Time.from_datetime(parse_timestamp(event['timestamp'])),
+        parse_description(event['description']),
+        [],
+        parse_commands(event.get('commands'), parser),
+        parse_ongoing(event.get('ongoing')),
+    )
+
+def read_events(lines: Iterable[str], fmt: str) -> Iterator[tuple[int, dict]]:
+    """The events of a CSV file with a header row, or of a JSON lines file,
+    with the line they start on."""
+    match fmt:
+        case 'csv':
+            reader = csv.DictReader(lines)
+            line = 2
+            for row in reader:
+                yield line, row
+                line = reader.line_num + 1
+        case 'jsonl':
+            for line, text in enumerate(lines, 1):
+                if text.strip() == '':
+                    continue
+
+                try:
+                    event = json.loads(text)
+                except json.JSONDecodeError:
+                    raise IngestError(f'line {line}: invalid JSON')
+                if not isinstance(event, dict):
+                    raise IngestError(f'line {line}: expected a JSON object')
+
+                yield line, event
+        case _:
+            raise IngestError(f'unknown format "{fmt}"')
+
+def read_segments(file: TextIO, fmt: str | None = None) -> Iterator[Segment]:
+    """The events in `file` as segments, in the order they appear.
+
+    Every event has a `timestamp` and a `description`, and optionally
+    `ongoing` and `commands`. If `fmt` isn't given, a file whose first line
+    starts with "{" is read as JSON lines and anything else as CSV.
+    """
+    lines: Iterable[str] = file
+    if fmt is None:
+        first = file.readline()
+        fmt = 'jsonl' if first.lstrip().startswith('{') else 'csv'
+        lines = chain([first], file)
+
+    parser = Parser(debug = False)
+
+    for line, event in read_events(lines, fmt):
+        try:
+            yield segment_from_event(event, parser)
+        except IngestError as e:
+            raise IngestError(f'line {line}: {e}')
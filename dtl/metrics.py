@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import sys
+
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    # No getrusage on this platform (e.g. Windows); peak memory isn't known.
+    resource = None
+
+# Stands in for typing.TYPE_CHECKING, since importing typing slows down startup.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import TextIO
+
+    from dtl.ast import File
+
+# A hook is called with the kind of every measurement ('stage' or 'count'),
+# its name and its value: seconds spent in a stage or an amount to count.
+type Hook = Callable[[str, str, float], None]
+
+# Stage times are always recorded, since timing a stage costs next to
+# nothing. Timing the lexer, which runs interleaved with the parser, one
+# token at a time, and counting tokens and tree nodes only happens while
+# enabled, e.g. by `dtl --profile`.
+enabled = False
+
+# Seconds spent in each stage, not counting the stages nested in it.
+stages: dict[str, float] = {}
+counters: dict[str, int] = {}
+hooks: list[Hook] = []
+
+# Seconds spent so far in stages nested in each running stage, innermost last.
+nested: list[float] = []
+
+# When DTL's modules started loading.
+started = perf_counter()
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+def disable() -> None:
+    global enabled
+    enabled = False
+
+def add_hook(hook: Hook) -> None:
+    """Call `hook` with every measurement from now on, e.g. to export them."""
+    hooks.append(hook)
+
+def remove_hook(hook: Hook) -> None:
+    hooks.remove(hook)
+
+def record(name: str, seconds: float) -> None:
+    stages[name] = stages.get(name, 0.0) + seconds
+
+    for hook in hooks:
+        hook('stage', name, seconds)
+
+def count(name: str, amount: int = 1) -> None:
+    counters[name] = counters.get(name, 0) + amount
+
+    for hook in hooks:
+        hook('count', name, amount)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Record the time spent in the block as stage `name`."""
+    start = perf_counter()
+    nested.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        record(name, elapsed - nested.pop())
+        if len(nested) > 0:
+            nested[-1] += elapsed
+
+def timed[T](name: str, items: Iterator[T], counter: str) -> Iterator[T]:
+    """`items`, recording the time spent producing them as stage `name` and
+    their number as `counter` once exhausted, while enabled."""
+    if not enabled:
+        return items
+
+    return timed_items(name, items, counter)
+
+def timed_items[T](name: str, items: Iterator[T], counter: str) -> Iterator[T]:
+    seconds = 0.0
+    amount = 0
+    try:
+        while True:
+            start = perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                elapsed = perf_counter() - start
+                seconds += elapsed
+                if len(nested) > 0:
+                    nested[-1] += elapsed
+
+            amount += 1
+            yield item
+    finally:
+        record(name, seconds)
+        count(counter, amount)
+
+def count_tree(tree: File) -> None:
+    """Count the segments of `tree` and its nodes (segments, commands and
+    options), leaving the blocks of LazySegments that aren't loaded alone."""
+    if not enabled:
+        return
+
+    from dtl.ast import LazySegment
+
+    segments = nodes = 0
+    stack: list[Iterable] = [tree.segments.values()]
+    while len(stack) > 0:
+        for segs in stack.pop():
+            for segment in segs:
+                segments += 1
+                nodes += 1
+                if isinstance(segment, LazySegment) and not segment.loaded:
+                    continue
+
+                nodes += len(segment.commands) + sum(len(cmd.options) for cmd in segment.commands)
+                stack.append(segment.segments.values())
+
+    count('segments', segments)
+    count('nodes', nodes)
+
+def peak_memory() -> int | None:
+    """Peak resident memory of the process in bytes, if known."""
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def snapshot() -> dict:
+    return {'stages': dict(stages), 'counters': dict(counters), 'peak_memory': peak_memory()}
+
+def reset() -> None:
+    stages.clear()
+    counters.clear()
+
+def report(out: TextIO) -> None:
+    """Write the stage times, the total time since DTL started and the counters to `out`."""
+    total = perf_counter() - started
+    width = max(map(len, ['peak memory', *stages, *counters])) + 2
+
+    out.write('Stage' + ' ' * (width - 5) + '      Time\n')
+    for name, seconds in stages.items():
+        out.write(f'{name:<{width}}{seconds * 1000:>8.1f}ms\n')
+    other = total - sum(stages.values())
+    out.write(f'{"other":<{width}}{other * 1000:>8.1f}ms\n')
+    out.write(f'{"total":<{width}}{total * 1000:>8.1f}ms\n')
+
+    out.write('\n')
+    for name, amount in counters.items():
+        out.write(f'{name:<{width}}{amount:>10}\n')
+
+    peak = peak_memory()
+    if peak is not None:
+        out.write(f'{"peak memory":<{width}}{peak / (1024 * 1024):>8.1f}MB\n')
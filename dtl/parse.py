@@ -1,12 +1,66 @@
-from dtl.ast import Cmd, File, Option, Segment, Time
-from dtl.tokenize import Lexer, Token
-
-from functools import partial
-from typing import Callable
+from dtl import metrics
+from dtl.ast import Cmd, File, LazySegment, Option, Segment, Time
+from dtl.tokenize import Lexer, ParseError, Token
 
+import os
+import re
 
-class ParseError(Exception):
-    pass
+from collections.abc import Buffer
+from functools import partial
+from itertools import repeat
+from typing import Callable, Iterator, TextIO
+
+# Matches top-level segment headers, and brackets to tell which of them are
+# actually inside a description.
+TOP_LEVEL_SEGMENT = re.compile(r'^@|\[|\]', re.MULTILINE)
+
+# Matches the start of every unindented line (empty matches), and brackets to
+# tell which of them are actually inside a description.
+TOP_LEVEL_LINE = re.compile(rb'^(?=[^\t\n])|\[|\]', re.MULTILINE)
+
+# Anything but whitespace, or tabs followed by anything, which start a block
+# even on an otherwise empty line.
+NON_BLANK = re.compile(rb'\S|\t[^\t]')
+
+
+def make_time(units: dict[str, str], parent: Time | None = None) -> Time:
+    """The time of the given units, e.g. {'DATE': '9th', 'TIME': '12:00'}.
+    Raises ParseError if it has both a weekday and a date, including a date
+    taken from `parent`."""
+    time = Time(units, parent=parent)
+    if time.weekday is not None and time.date is not None:
+        raise ParseError(f'Error: segment time contains both weekday and date: "{" ".join(units.values())}"')
+
+    return time
+
+
+class Event:
+    """A parse event, as produced by `Parser.events`.
+
+    `type` is one of:
+     - 'start_segment': `time`, `description` and `ongoing` are set.
+     - 'end_segment':   `time` is set.
+     - 'command':       `name` (e.g. "!note") and `description` are set.
+     - 'option':        `name` (e.g. "#at") and `value` are set.
+    """
+    def __init__(
+        self,
+        ev_type: str,
+        time: Time | None = None,
+        description: str | None = None,
+        ongoing: bool = False,
+        name: str | None = None,
+        value: str | None = None,
+    ) -> None:
+        self.type = ev_type
+        self.time = time
+        self.description = description
+        self.ongoing = ongoing
+        self.name = name
+        self.value = value
+
+    def __repr__(self) -> str:
+        return 'Event(' + self.type + ', ' + ', '.join(f'{k}={v}' for k, v in vars(self).items() if k != 'type' and v not in (None, False)) + ')'
 
 
 class Parser:
@@ -16,28 +70,208 @@ class Parser:
     def parse(self, src: str) -> File:
         self.lexer.tokenize(src)
 
-        header_time_tokens = {}
-        if self.lexer.peak().type == 'FOR':
-            self.lexer.pop()
+        return self.parse_tokens()
 
-            while self.lexer.peak().type != 'COLON':
-                time: Token = self.lexer.assert_token(['YEAR', 'MONTH', 'DATE', 'DAY', 'TIME'])
-                header_time_tokens[time.type] = time.value
+    def parse_stream(self, file: TextIO) -> File:
+        """Parse `file` while reading it, pulling tokens from the lexer on demand."""
+        self.lexer.tokenize_stream(file)
 
-            self.lexer.assert_token('COLON')
-            self.lexer.assert_token('NL')
+        return self.parse_tokens()
+
+    def parse_buffer(self, buffer: Buffer) -> File:
+        """Parse the UTF-8 encoded `buffer`, e.g. a memory-mapped file, in place."""
+        self.lexer.tokenize_buffer(buffer)
+
+        return self.parse_tokens()
+
+    def parse_tokens(self) -> File:
+        with metrics.stage('parse'):
+            header_time = self.parse_header()
+
+            segments: list[Segment] = self.parse_segments(header_time)
 
-        header_time = Time(header_time_tokens)
+            tree: File = File(header_time, segments)
 
+        with metrics.stage('validate'):
+            tree.validate(header_time)
+
+        return tree
+
+    def parse_segments(self, header_time: Time) -> list[Segment]:
         segments: list[Segment] = []
         while self.lexer.peak().type == 'AT':
             segments.append(self.parse_time(header_time))
 
+        return segments
+
+    def parse_lazy(self, src: bytes) -> File:
+        """Parse the UTF-8 encoded `src` like `parse`, except for the blocks of
+        top-level segments, which are parsed when they are first used.
+
+        Top-level segments with a block are LazySegments holding `src`. Parse
+        errors inside a block are raised when it is loaded.
+        """
+        with metrics.stage('parse'):
+            lines = list(top_level_lines(src)) + [len(src)]
+            first = next((i for i, start in enumerate(lines[:-1]) if src[start:start+1] == b'@'), len(lines) - 1)
+
+            self.lexer.tokenize_buffer(memoryview(src)[:lines[first]])
+            header_time = self.parse_header()
+
+            segments: list[Segment] = []
+            if self.lexer.peak().type == 'EOF':
+                for start, end in zip(lines[first:], lines[first+1:]):
+                    # Parsing stops at the first top-level line that isn't a segment.
+                    if src[start:start+1] != b'@':
+                        break
+
+                    segments.append(self.parse_lazy_segment(src, start, end, header_time))
+
+            tree: File = File(header_time, segments)
+
+        with metrics.stage('validate'):
+            tree.validate(header_time)
+
+        return tree
+
+    def parse_lazy_segment(self, src: bytes, start: int, end: int, parent_time: Time) -> Segment:
+        """Parse the header of the top-level segment between `start` and `end`,
+        leaving its block for later."""
+        header_end = line_end(src, start, end)
+
+        self.lexer.tokenize_buffer(memoryview(src)[start:header_end])
+        time, desc, ongoing = self.parse_time_header(parent_time)
+
+        if NON_BLANK.search(src, header_end, end) is None:
+            return Segment(time, desc, [], [], ongoing)
+
+        return LazySegment(time, desc, ongoing, src, (header_end, end))
+
+    def parse_parallel(self, src: str, workers: int | None = None) -> File:
+        """Parse `src` like `parse`, lexing and parsing it in worker processes.
+
+        The source is split into chunks at top-level segments (lines starting
+        with "@"), which don't depend on each other, and the segments parsed
+        from each chunk are joined into a single File before validation.
+        """
+        # Imported here, since it imports multiprocessing, which takes a while
+        # and is only needed for large files.
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or os.cpu_count() or 1
+
+        # Line starts inside a description, e.g. "[...\n@...]", aren't segments.
+        starts: list[int] = []
+        in_description = False
+        for found in TOP_LEVEL_SEGMENT.finditer(src):
+            match found.group():
+                case '[':
+                    in_description = True
+                case ']':
+                    in_description = False
+                case '@' if not in_description:
+                    starts.append(found.start())
+        if workers <= 1 or len(starts) <= 1:
+            return self.parse(src)
+
+        self.lexer.tokenize(src[:starts[0]])
+        header_time = self.parse_header()
+        if self.lexer.peak().type != 'EOF':
+            return self.parse(src)
+
+        chunk_size = max(1, (len(src) - starts[0]) // (workers * 4))
+        bounds = [starts[0]]
+        for start in starts:
+            if start - bounds[-1] >= chunk_size:
+                bounds.append(start)
+        bounds.append(len(src))
+
+        chunks = [src[start:end] for start, end in zip(bounds, bounds[1:])]
+        # Tokens are counted in the workers, so they aren't counted here.
+        with metrics.stage('parse'), ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parse_chunk, chunks, repeat(header_time)))
+
+        segments: list[Segment] = []
+        for chunk_segments, complete, error in results:
+            if error is not None:
+                raise ParseError(error)
+
+            segments += chunk_segments
+
+            # Parsing stops at the first top-level line that isn't a segment,
+            # ignoring the rest of the file.
+            if not complete:
+                break
+
         tree: File = File(header_time, segments)
-        tree.validate(header_time)
+        with metrics.stage('validate'):
+            tree.validate(header_time)
 
         return tree
 
+    def parse_time_str(self, src: str) -> Time:
+        """Parse a bare list of time units, e.g. "2022 August 1st", as given on the command line."""
+        self.lexer.tokenize(src)
+
+        time_tokens: list[Token] = [self.lexer.assert_token(['YEAR', 'MONTH', 'DATE', 'DAY', 'TIME'])]
+        while self.lexer.peak().type in ['YEAR', 'MONTH', 'DATE', 'DAY', 'TIME']:
+            time_tokens.append(self.lexer.pop())
+
+        self.lexer.assert_token('EOF')
+
+        return make_time({t.type: t.value for t in time_tokens})
+
+    def parse_cmds_str(self, src: str) -> list[Cmd]:
+        """Parse a list of commands without options, e.g. "!note [...] !todo [...]"."""
+        self.lexer.tokenize(src)
+
+        cmds: list[Cmd] = []
+        while self.lexer.peak().type != 'EOF':
+            if self.lexer.peak().type == 'NL':
+                self.lexer.pop()
+                continue
+
+            cmd = self.lexer.assert_token('CMD')
+            desc = self.lexer.assert_token('DESC')
+            cmds.append(Cmd(cmd.value, desc.value, []))
+
+        return cmds
+
+    def events(self, src: str) -> Iterator[Event]:
+        self.lexer.tokenize(src)
+
+        return self.iter_events()
+
+    def events_stream(self, file: TextIO) -> Iterator[Event]:
+        self.lexer.tokenize_stream(file)
+
+        return self.iter_events()
+
+    def iter_events(self) -> Iterator[Event]:
+        """Yield the events of the tokenized file in document order.
+
+        No AST is built and nothing is validated, so segments are reported as
+        written: unsorted, and without merging segments with the same time.
+        """
+        header_time = self.parse_header()
+
+        while self.lexer.peak().type == 'AT':
+            yield from self.time_events(header_time)
+
+    def parse_header(self) -> Time:
+        header_time_tokens = {}
+        if self.lexer.peak().type == 'FOR':
+            self.lexer.pop()
+
+            while self.lexer.peak().type != 'COLON':
+                time: Token = self.lexer.assert_token(['YEAR', 'MONTH', 'DATE', 'DAY', 'TIME'])
+                header_time_tokens[time.type] = time.value
+
+            self.lexer.assert_token('COLON')
+            self.lexer.assert_token('NL')
+
+        return make_time(header_time_tokens)
+
     def parse_block[T](self, fn: Callable[[], T]) -> list[T]:
         self.lexer.assert_token('OPEN')
 
@@ -63,12 +297,24 @@ class Parser:
                 raise ParseError(f'Error: expected CMD, AT, found {err}')
 
     def parse_time(self, parent_time: Time) -> Segment:
+        time, desc, ongoing = self.parse_time_header(parent_time)
+
+        attributes: list[Segment | Cmd] = []
+        if self.lexer.peak().type == 'OPEN':
+            attributes = self.parse_attributes(time)
+
+        segments: list[Segment] = [seg for seg in attributes if isinstance(seg, Segment)]
+        commands: list[Cmd]     = [cmd for cmd in attributes if isinstance(cmd, Cmd)]
+
+        return Segment(time, desc, segments, commands, ongoing)
+
+    def parse_time_header(self, parent_time: Time) -> tuple[Time, str | None, bool]:
         self.lexer.assert_token('AT')
         time_tokens: list[Token] = [self.lexer.assert_token(['YEAR', 'MONTH', 'DATE', 'DAY', 'TIME'])]
         while self.lexer.peak().type in ['YEAR', 'MONTH', 'DATE', 'DAY', 'TIME']:
             time_tokens.append(self.lexer.pop())
 
-        time: Time = Time({t.type: t.value for t in time_tokens}, parent=parent_time)
+        time: Time = make_time({t.type: t.value for t in time_tokens}, parent=parent_time)
 
         if self.lexer.peak().type == 'PERIOD':
             self.lexer.assert_token('PERIOD')
@@ -76,7 +322,7 @@ class Parser:
             while self.lexer.peak().type in ['YEAR', 'MONTH', 'DATE', 'DAY', 'TIME']:
                 period_end_tokens.append(self.lexer.pop())
 
-            period_end: Time = Time({t.type: t.value for t in period_end_tokens}, parent=parent_time)
+            period_end: Time = make_time({t.type: t.value for t in period_end_tokens}, parent=parent_time)
 
             time.period = True
             time.end = period_end
@@ -92,27 +338,66 @@ class Parser:
 
         self.lexer.assert_token('NL')
 
-        attributes: list[Segment | Cmd] = []
+        return time, desc, ongoing
+
+    def time_events(self, parent_time: Time) -> Iterator[Event]:
+        time, desc, ongoing = self.parse_time_header(parent_time)
+
+        yield Event('start_segment', time=time, description=desc, ongoing=ongoing)
+
         if self.lexer.peak().type == 'OPEN':
-            attributes = self.parse_attributes(time)
+            yield from self.block_events(partial(self.attribute_events, time))
 
-        segments: list[Segment] = [seg for seg in attributes if isinstance(seg, Segment)]
-        commands: list[Cmd]     = [cmd for cmd in attributes if isinstance(cmd, Cmd)]
+        yield Event('end_segment', time=time)
 
-        return Segment(time, desc, segments, commands, ongoing)
+    def block_events(self, fn: Callable[[], Iterator[Event]]) -> Iterator[Event]:
+        self.lexer.assert_token('OPEN')
 
-    def parse_cmd(self) -> Cmd:
-        cmd = self.lexer.assert_token('CMD')
+        while self.lexer.peak().type != 'END':
+            yield from fn()
 
-        desc = self.lexer.assert_token('DESC')
+        self.lexer.assert_token('END')
 
-        self.lexer.assert_token('NL')
+    def attribute_events(self, parent_time: Time) -> Iterator[Event]:
+        match self.lexer.peak().type:
+            case 'AT':
+                return self.time_events(parent_time)
+            case 'CMD':
+                return self.cmd_events()
+            case err:
+                print(f'Error: expected CMD, AT, found {err}')
+                raise ParseError(f'Error: expected CMD, AT, found {err}')
+
+    def cmd_events(self) -> Iterator[Event]:
+        cmd, desc = self.parse_cmd_header()
+
+        yield Event('command', name=cmd, description=desc)
+
+        if self.lexer.peak().type == 'OPEN':
+            yield from self.block_events(self.option_events)
+
+    def option_events(self) -> Iterator[Event]:
+        option: Option = self.parse_option()
+
+        yield Event('option', name=option.name, value=option.value)
+
+    def parse_cmd(self) -> Cmd:
+        cmd, desc = self.parse_cmd_header()
 
         options: list[Option] = []
         if self.lexer.peak().type == 'OPEN':
             options = self.parse_options()
 
-        return Cmd(cmd.value, desc.value, options)
+        return Cmd(cmd, desc, options)
+
+    def parse_cmd_header(self) -> tuple[str, str]:
+        cmd = self.lexer.assert_token('CMD')
+
+        desc = self.lexer.assert_token('DESC')
+
+        self.lexer.assert_token('NL')
+
+        return cmd.value, desc.value
 
     def parse_options(self) -> list[Option]:
         return self.parse_block(self.parse_option)
@@ -133,3 +418,67 @@ class Parser:
         self.lexer.assert_token('NL')
 
         return Option(option.value, value)
+
+def top_level_lines(src: bytes) -> Iterator[int]:
+    """The start of every unindented line in `src` that isn't inside a description."""
+    in_description = False
+    for found in TOP_LEVEL_LINE.finditer(src):
+        match found.group():
+            case b'[':
+                in_description = True
+            case b']':
+                in_description = False
+            case b'' if not in_description:
+                yield found.start()
+
+def line_end(src: bytes, start: int, end: int) -> int:
+    """The end (after the newline) of the line at `start`, which continues
+    over following lines while inside a description, but not past `end`."""
+    pos = start
+    while (newline := src.find(b'\n', pos, end)) >= 0:
+        opened = src.rfind(b'[', pos, newline)
+        if opened < 0 or src.find(b']', opened, newline) >= 0:
+            return newline + 1
+
+        closed = src.find(b']', newline, end)
+        if closed < 0:
+            return end
+        pos = closed + 1
+
+    return end
+
+def parse_lazy_block(src: bytes, start: int, end: int, parent_time: Time) -> tuple[list[Segment], list[Cmd]]:
+    """Parse the block of a LazySegment: its segments and commands."""
+    parser = Parser()
+    parser.lexer.tokenize_buffer(memoryview(src)[start:end])
+
+    with metrics.stage('parse'):
+        # Blank lines after the segment's header.
+        while parser.lexer.peak().type == 'NL':
+            parser.lexer.pop()
+
+        attributes = parser.parse_attributes(parent_time)
+        if parser.lexer.peak().type != 'EOF':
+            token = parser.lexer.peak().type
+            print(f'Error: expected EOF, found {token}')
+            raise ParseError(f'Error: expected EOF, found {token}')
+
+    segments: list[Segment] = [seg for seg in attributes if isinstance(seg, Segment)]
+    commands: list[Cmd]     = [cmd for cmd in attributes if isinstance(cmd, Cmd)]
+
+    return segments, commands
+
+def parse_chunk(src: str, header_time: Time) -> tuple[list[Segment], bool, str | None]:
+    """Parse the top-level segments in `src` (run in a worker process by `Parser.parse_parallel`).
+
+    Returns the segments, whether all of `src` was parsed, and the parse error if any.
+    """
+    parser = Parser()
+    parser.lexer.tokenize(src)
+
+    try:
+        segments = parser.parse_segments(header_time)
+    except ParseError as e:
+        return [], False, str(e)
+
+    return segments, parser.lexer.peak().type == 'EOF', None
@@ -0,0 +1,145 @@
+from __future__ import annotations
+from datetime import date
+
+from dtl.ast import Segment, Time
+from dtl.index import MAX_UNIT, end_key, start_key
+
+# Stands in for typing.TYPE_CHECKING, as in the modules loaded at startup.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from dtl.index import Key
+
+def weekday_of(ordinal: int) -> int:
+    """The weekday of a day ordinal, 0 for Monday (`date.fromordinal(1)` is a Monday)."""
+    return (ordinal - 1) % 7
+
+def first_day(time: Time) -> int | None:
+    """The day ordinal of the start of `time`, or None if it has no year."""
+    if time.year is None:
+        return None
+
+    return date(time.year, time.month or 1, time.date or 1).toordinal()
+
+def last_day(time: Time) -> int | None:
+    """The day ordinal of the end of `time`, e.g. the last day of a month, or
+    None if it has no year."""
+    if time.year is None:
+        return None
+
+    if time.month is None:
+        return date(time.year, 12, 31).toordinal()
+    elif time.date is None:
+        return date(time.year + time.month // 12, time.month % 12 + 1, 1).toordinal() - 1
+
+    return date(time.year, time.month, time.date).toordinal()
+
+class Rule:
+    """A weekday entry, e.g. `@Monday 9:00-17:00 [work]`, and the days it recurs on."""
+    def __init__(self, segment: Segment) -> None:
+        time = segment.time
+
+        self.segment = segment
+        self.weekday: int = time.weekday
+
+        # A weekday nested in a year or month only recurs within it; a month
+        # without a year bounds every year's occurrences to that month.
+        self.first = first_day(time) or 1
+        self.last = last_day(time) or date.max.toordinal()
+        self.month = time.month if time.year is None else None
+
+        # The time units of an occurrence's key, to add to the key of its date.
+        self.start_unit = 0 if time.time is None else time.time + 1
+        self.end_unit: int | None = None
+
+        # Days from the start of an occurrence to its end, for periods ending
+        # on another weekday, e.g. `@Friday 18:00-Monday 8:00`.
+        self.span = 0
+        if time.period and time.end is not None:
+            end = time.period_end()
+            self.end_unit = 0 if end.time is None else end.time + 1
+            if end.weekday is not None:
+                self.span = (end.weekday - time.weekday) % 7
+
+    def days(self, first: int, last: int) -> range:
+        """The ordinals of the days occurrences starting between the days
+        `first` and `last` (both included) fall on, a week apart."""
+        first = max(first, self.first)
+        first += (self.weekday - weekday_of(first)) % 7
+
+        return range(first, min(last, self.last) + 1, 7)
+
+class Recurrences:
+    """Occurrences on concrete dates of the weekday entries of a file.
+
+    The days an entry recurs on in a range are computed from the range's
+    first day ordinal and stepped through a week at a time, never looking at
+    the days in between. Each occurrence is made once, from the packed key
+    of its date, which is also only computed once for all entries, and kept
+    with its start and end keys, so queries over the same weeks only compare
+    them.
+
+    Ongoing weekday entries don't recur, since they have no end.
+    """
+    def __init__(self, segments: list[Segment]) -> None:
+        self.rules = [Rule(segment) for segment in segments if not segment.ongoing]
+
+        # Day ordinal: the packed key and the units of its date.
+        self.calendar: dict[int, tuple[int, tuple[int, int, int]]] = {}
+        # (rule number, day ordinal): the occurrence, or None if there is none.
+        self.occurrences: dict[tuple[int, int], tuple[Key, Key, Segment] | None] = {}
+
+    def day(self, ordinal: int) -> tuple[int, tuple[int, int, int]]:
+        found = self.calendar.get(ordinal)
+        if found is None:
+            day = date.fromordinal(ordinal)
+            units = (day.year, day.month, day.day)
+            found = self.calendar[ordinal] = (Time.from_units(*units).key, units)
+        return found
+
+    def occurrence(self, rule: Rule, ordinal: int) -> tuple[Key, Key, Segment] | None:
+        """The occurrence of `rule` on the day `ordinal` with its start and
+        end keys, or None if it doesn't recur in that day's month."""
+        day_key, units = self.day(ordinal)
+        if rule.month is not None and units[1] != rule.month:
+            return None
+
+        # The keys of the index (see `start_key` and `end_key`), from the
+        # units in the time keys.
+        time = Time.from_key(day_key | rule.start_unit)
+        start = end = (*units, rule.start_unit - 1 if rule.start_unit else 0)
+        if rule.end_unit is None:
+            if not rule.start_unit:
+                end = (*units, MAX_UNIT)
+        else:
+            end_day_key, end_units = self.day(ordinal + rule.span)
+            time.period = True
+            time.end = Time.from_key(end_day_key | rule.end_unit)
+            end = (*end_units, rule.end_unit - 1 if rule.end_unit else MAX_UNIT)
+
+        return start, end, Segment(time, rule.segment.description, [], rule.segment.commands)
+
+    def between(self, start: Time, end: Time) -> list[tuple[Key, Segment]]:
+        """The occurrences overlapping the range from the start of `start` to
+        the end of `end`, with their start keys, or none if the range has no
+        year. Raises ValueError if it isn't a range of valid dates."""
+        if len(self.rules) == 0:
+            return []
+
+        first, last = first_day(start), last_day(end)
+        if first is None or last is None:
+            return []
+
+        lo, hi = start_key(start), end_key(end)
+
+        found: list[tuple[Key, Segment]] = []
+        for number, rule in enumerate(self.rules):
+            # Occurrences that start before the range may still end in it.
+            for ordinal in rule.days(first - rule.span, last):
+                occurrence = self.occurrences.get((number, ordinal), False)
+                if occurrence is False:
+                    occurrence = self.occurrences[(number, ordinal)] = self.occurrence(rule, ordinal)
+
+                if occurrence is not None and occurrence[0] <= hi and occurrence[1] >= lo:
+                    found.append((occurrence[0], occurrence[2]))
+
+        return found
@@ -0,0 +1,190 @@
+from array import array
+from bisect import bisect_right
+from datetime import date, timedelta
+from itertools import chain, pairwise
+from typing import Iterable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from dtl.ast import EPOCH_ORDINAL, MINUTES_PER_DAY, File, Segment, Time
+
+PERIODS = ['day', 'week', 'month', 'total']
+
+def day_minute(day: date) -> int:
+    return (day.toordinal() - EPOCH_ORDINAL) * MINUTES_PER_DAY
+
+def minute_day(minute: int) -> date:
+    return date.fromordinal(minute // MINUTES_PER_DAY + EPOCH_ORDINAL)
+
+def segment_span(segment: Segment, now: int | None) -> tuple[int, int] | None:
+    """The start and end minute of a closed period, or of an ongoing entry up
+    to `now`, or None for other entries."""
+    try:
+        if segment.ongoing:
+            start, end = segment.time.start_minute(), now
+        elif segment.time.period and segment.time.end is not None:
+            start, end = segment.time.start_minute(), segment.time.period_end().end_minute()
+        else:
+            return None
+    except ValueError:
+        # Not a valid date, e.g. February 31st.
+        return None
+
+    if start is None or end is None:
+        return None
+
+    return start, end
+
+class Spans:
+    """The time spent on the entries of a file, as parallel arrays of start
+    minute, end minute and description code (an index into `descriptions`).
+
+    Closed periods are always counted. Ongoing entries are only counted if
+    `now` is given, and then as ending at `now`. The arrays are NumPy arrays
+    if NumPy is installed, which aggregates them in bulk.
+    """
+    def __init__(self, tree: File, now: int | None = None) -> None:
+        self.descriptions: list[str] = []
+        codes: dict[str, int] = {}
+
+        starts, ends, descriptions = array('q'), array('q'), array('q')
+
+        def visit(node: File | Segment) -> None:
+            for segment in chain.from_iterable(node.segments.values()):
+                if segment.description is not None and (span := segment_span(segment, now)) is not None:
+                    if segment.description not in codes:
+                        codes[segment.description] = len(self.descriptions)
+                        self.descriptions.append(segment.description)
+
+                    starts.append(span[0])
+                    ends.append(span[1])
+                    descriptions.append(codes[segment.description])
+
+                visit(segment)
+
+        visit(tree)
+
+        if numpy is not None:
+            self.starts = numpy.frombuffer(starts, dtype=numpy.int64)
+            self.ends = numpy.frombuffer(ends, dtype=numpy.int64)
+            self.codes = numpy.frombuffer(descriptions, dtype=numpy.int64)
+        else:
+            self.starts, self.ends, self.codes = starts, ends, descriptions
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def bounds(self) -> tuple[int, int]:
+        """The start of the first span and the end of the last one."""
+        return int(min(self.starts)), int(max(self.ends))
+
+    def aggregate(self, bounds: list[int]) -> list[list[int]]:
+        """Minutes spent on each description (by code) between each two
+        consecutive minutes of `bounds`."""
+        if numpy is None:
+            sums = [[0] * len(self.descriptions) for _ in range(len(bounds) - 1)]
+            add_spans(sums, bounds, zip(self.starts, self.ends, self.codes))
+            return sums
+
+        count = len(self.descriptions)
+        edges = numpy.asarray(bounds, dtype=numpy.int64)
+
+        starts = numpy.maximum(self.starts, bounds[0])
+        ends = numpy.minimum(self.ends, bounds[-1])
+        inside = ends > starts
+        starts, ends, codes = starts[inside], ends[inside], self.codes[inside]
+
+        # Most spans fall within a single period; those are summed in bulk,
+        # the rest one by one.
+        first = numpy.searchsorted(edges, starts, side='right') - 1
+        last = numpy.searchsorted(edges, ends, side='left') - 1
+        single = first == last
+
+        sums = numpy.bincount(
+            first[single] * count + codes[single],
+            weights=(ends - starts)[single],
+            minlength=(len(bounds) - 1) * count,
+        ).astype(numpy.int64).reshape(len(bounds) - 1, count).tolist()
+
+        multiple = ~single
+        add_spans(sums, bounds, zip(starts[multiple].tolist(), ends[multiple].tolist(), codes[multiple].tolist()))
+
+        return sums
+
+def add_spans(sums: list[list[int]], bounds: list[int], spans: Iterable[tuple[int, int, int]]) -> None:
+    """Add the minutes of each (start, end, code) span to `sums`, split
+    between the periods delimited by `bounds`."""
+    for start, end, code in spans:
+        i = max(bisect_right(bounds, start) - 1, 0)
+        while i < len(bounds) - 1 and bounds[i] < end:
+            overlap = min(end, bounds[i+1]) - max(start, bounds[i])
+            if overlap > 0:
+                sums[i][code] += overlap
+            i += 1
+
+def period_bounds(lo: int, hi: int, period: str) -> list[int]:
+    """The minutes at which each day, week (from Monday), month or, for
+    'total', the single period covering `lo` to `hi` starts, clipped to the
+    range, followed by `hi`."""
+    bounds = [lo]
+
+    if period != 'total':
+        day = minute_day(lo)
+        match period:
+            case 'week':
+                day -= timedelta(days=day.weekday())
+            case 'month':
+                day = day.replace(day=1)
+
+        while True:
+            match period:
+                case 'day':
+                    day += timedelta(days=1)
+                case 'week':
+                    day += timedelta(days=7)
+                case 'month':
+                    day = (day + timedelta(days=32)).replace(day=1)
+
+            if day_minute(day) >= hi:
+                break
+            bounds.append(day_minute(day))
+
+    bounds.append(hi)
+    return bounds
+
+def period_label(lo: int, hi: int, period: str) -> str:
+    start, end = minute_day(lo), minute_day(hi - 1)
+
+    match period:
+        case 'month':
+            return Time.from_units(start.year, start.month).format(Time({}))
+        case 'day':
+            return Time.from_units(start.year, start.month, start.day).format(Time({}))
+        case _:
+            start_time = Time.from_units(start.year, start.month, start.day)
+            start_time.period = True
+            start_time.end = Time.from_units(end.year, end.month, end.day)
+            return start_time.format(Time({}))
+
+def format_duration(minutes: int) -> str:
+    return f'{minutes // 60}h {minutes % 60:02}m'
+
+def report(spans: Spans, lo: int, hi: int, period: str) -> str:
+    """Time spent per description in each `period` between `lo` and `hi`,
+    formatted like a DTL file, most time spent first."""
+    out: list[str] = []
+
+    bounds = period_bounds(lo, hi, period)
+    for (start, end), sums in zip(pairwise(bounds), spans.aggregate(bounds)):
+        totals = sorted(((minutes, code) for code, minutes in enumerate(sums) if minutes > 0), key=lambda t: -t[0])
+        if len(totals) == 0:
+            continue
+
+        out.append(f'@{period_label(start, end, period)}\n')
+        for minutes, code in totals:
+            out.append(f'\t[{spans.descriptions[code]}] {format_duration(minutes)}\n')
+
+    return ''.join(out)
@@ -1,71 +1,190 @@
 import re
 
-from dtl.parse import ParseError
-
 from collections import deque
+from collections.abc import Buffer
+from functools import partial
+from typing import Iterable, Iterator, TextIO
+
+from dtl import metrics
+
+class ParseError(Exception):
+    pass
+
+TOKEN_PATTERNS: dict[str, str] = {
+    'AT'       : r'@',
+    'YEAR'     : r'\d{4}',
+    'MONTH'    : r'January|February|March|April|May|June|July|August|September|October|November|December',
+    'DATE'     : r'([2-3]?1st|2?2nd|2?3rd|[1-2]?[3-9]th|[1-3]0th|11th|12th|13th)',
+    'DAY'      : r'Mon(day)|Tue(sday)|Wed(nesday)|Thu(rsday)|Fri(day)|Sat(urday)|Sun(day)',
+    'TIME'     : r'\d?\d:\d\d',
+    'DURATION' : r'([0-9]+\s(seconds|minutes|hours))|(second|minute|hour)',
+    'CMD'      : r'![A-Za-z]+',
+    'OPTION'   : r'#[A-Za-z]+',
+    'DESC'     : r'\[(?P<val>[^\]]*)\]',
+    'FOR'      : r'for',
+    'COLON'    : r':',
+    'ONGOING'  : r'\.\.\.',
+    'PERIOD'   : r'-',
+    'NL'       : r'\n+',
+    'TAB'      : r'\t',
+    'WS'       : r'\s',
+    'ERROR'    : r'.',
+}
+
+# All token patterns joined into a single alternation, compiled once per process.
+# Alternatives are tried in the order above, so the first pattern that matches
+# wins, exactly like trying the patterns one after another. `\d` and `\s` only
+# match ASCII digits and whitespace, as they do over bytes; other whitespace
+# is skipped by `Lexer.layout`.
+TOKEN_REGEX: re.Pattern[str] = re.compile('|'.join(f'(?P<{tok_type}>{pattern})' for tok_type, pattern in TOKEN_PATTERNS.items()), re.ASCII)
+
+# The same patterns over UTF-8 bytes, for lexing a memory-mapped file in place.
+# ERROR matches a whole multi-byte character, like `.` does in the text.
+TOKEN_REGEX_BYTES: re.Pattern[bytes] = re.compile('|'.join(
+    f'(?P<{tok_type}>{pattern})'
+    for tok_type, pattern in (TOKEN_PATTERNS | {'ERROR': r'[\xc0-\xff][\x80-\xbf]*|.'}).items()
+).encode())
+
+# Tokens whose value the parser never reads, so that it isn't decoded.
+NO_VALUE = {'NL', 'TAB', 'WS'}
+
+# Number of characters read from a file at a time by `Lexer.tokenize_stream`.
+CHUNK_SIZE = 64 * 1024
+
+# Characters that must follow the start of a token in the buffer before it is
+# matched, unless the input is exhausted.
+LOOKAHEAD = 64
 
 class Token:
-    def __init__(self, tok_type: str, value: str | None = None) -> None:
+    def __init__(self, tok_type: str, value: str | None = None, pos: int | None = None) -> None:
         self.type = tok_type
         self.value = value
+        # Offset of the token in the source, None at the end of the input.
+        self.pos = pos
 
 class Lexer:
     def __init__(self, debug: bool = False) -> None:
         self.tokens: deque[Token] = deque()
+        self.stream: Iterator[Token] = iter(())
         self.debug = debug
 
     def tokenize(self, src: str) -> None:
-        token_patterns: dict[str, str] = {
-            'AT'       : r'@',
-            'YEAR'     : r'\d{4}',
-            'MONTH'    : r'January|February|March|April|May|June|July|August|September|October|November|December',
-            'DATE'     : r'([2-3]?1st|2?2nd|2?3rd|[1-2]?[3-9]th|[1-3]0th|11th|12th|13th)',
-            'DAY'      : r'Mon(day)|Tue(sday)|Wed(esday)|Thu(rsday)|Fri(day)|Sat(urday)|Sun(day)',
-            'TIME'     : r'\d?\d:\d\d',
-            'DURATION' : r'([0-9]+\s(seconds|minutes|hours))|(second|minute|hour)',
-            'CMD'      : r'![A-Za-z]+',
-            'OPTION'   : r'#[A-Za-z]+',
-            'DESC'     : r'\[(?P<val>[^\]]*)\]',
-            'FOR'      : r'for',
-            'COLON'    : r':',
-            'ONGOING'  : r'\.\.\.',
-            'PERIOD'   : r'-',
-            'NL'       : r'\n+',
-            'TAB'      : r'\t',
-            'WS'       : r'\s',
-            'ERROR'    : r'.',
-        }
-
-        types: dict[str, re.Pattern[str]] = { tok_type: re.compile(pattern) for tok_type, pattern in token_patterns.items() }
+        # Matching bytes is faster than matching text, even counting the encoding.
+        with metrics.stage('tokenize'):
+            self.tokens = deque(self.layout(self.scan_buffer(src.encode())))
+        self.stream = iter(())
+
+        if metrics.enabled:
+            metrics.count('tokens', len(self.tokens))
+
+        if self.debug:
+            print(' '.join([t.type for t in self.tokens]))
 
+    def tokenize_stream(self, file: TextIO, chunk_size: int = CHUNK_SIZE) -> None:
+        """Lex lazily from `file`, reading it `chunk_size` characters at a time.
+
+        Tokens are produced as `peak`/`pop` ask for them, so only the current
+        chunk and the next token are held in memory.
+        """
         self.tokens = deque()
+        self.stream = metrics.timed('tokenize', self.lex(iter(partial(file.read, chunk_size), '')), 'tokens')
 
-        at_line_start = True
-        line_indent = 0
-        prev_line_indent = 0
+    def tokenize_buffer(self, buffer: Buffer) -> None:
+        """Lex lazily from `buffer`, UTF-8 encoded text such as a memory-mapped file.
 
+        Tokens are matched in place, and only token values are decoded, as
+        `peak`/`pop` ask for them. `buffer` must stay open until the last
+        token has been read.
+        """
+        self.tokens = deque()
+        self.stream = metrics.timed('tokenize', self.layout(self.scan_buffer(buffer)), 'tokens')
+
+    def lex(self, chunks: Iterable[str]) -> Iterator[Token]:
+        return self.layout(self.scan(chunks))
+
+    def scan(self, chunks: Iterable[str]) -> Iterator[tuple[str, str, int]]:
+        """The (type, value, offset) of every token in `chunks`, without indentation tokens."""
+        chunks = iter(chunks)
+
+        match_token = TOKEN_REGEX.match
+
+        buf = ''
         pos = 0
-        while pos < len(src):
-            token_type = "ERROR"
-            token_val = ""
-            for tok_type, pattern in types.items():
-                match = pattern.match(src[pos:])
-                if match:
-                    token_type = tok_type
-                    if 'val' in match.groupdict():
-                        token_val = match.group('val')
-                    else:
-                        token_val = match.group(0)
-                    pos += len(match.group(0))
+        # Offset of `buf` in the input.
+        base = 0
+        # Tokens are only matched before `limit`, the end of the last complete
+        # line in `buf`, until the input is exhausted.
+        limit = 0
+        eof = False
+
+        while True:
+            if pos >= limit:
+                if eof:
                     break
 
+                chunk = next(chunks, '')
+                base += pos
+                buf = buf[pos:] + chunk
+                pos = 0
+                eof = chunk == ''
+                limit = len(buf) if eof else buf.rfind('\n') + 1
+                continue
+
+            match = match_token(buf, pos)
+            token_type = match.lastgroup
+
+            # Wait for more input if the token might continue in the next chunk:
+            # a run of newlines reaching the end of the buffer, a "[" whose "]"
+            # hasn't been read yet, or a short token (durations can span a
+            # line break) too close to the end of the buffer to be sure of.
+            if not eof and (match.end() == len(buf) or len(buf) - pos < LOOKAHEAD or (token_type == 'ERROR' and buf[pos] == '[')):
+                limit = pos
+                continue
+
+            if token_type == 'DESC':
+                yield token_type, match.group('val'), base + pos
+            else:
+                yield token_type, match.group(), base + pos
+            pos = match.end()
+
+    def scan_buffer(self, buffer: Buffer) -> Iterator[tuple[str, str | None, int]]:
+        """Like `scan`, over the UTF-8 encoded `buffer`, with byte offsets.
+
+        The whole input is available, so unlike `scan` there is no need to
+        look ahead, and only the values the parser reads are decoded.
+        """
+        match_token = TOKEN_REGEX_BYTES.match
+        end = len(buffer)
+        pos = 0
+
+        while pos < end:
+            match = match_token(buffer, pos)
+            token_type = match.lastgroup
+
+            if token_type in NO_VALUE:
+                yield token_type, None, pos
+            elif token_type == 'DESC':
+                yield token_type, match.group('val').decode(), pos
+            else:
+                yield token_type, match.group().decode(errors='replace'), pos
+
+            pos = match.end()
+
+    def layout(self, scanned: Iterable[tuple[str, str | None, int]]) -> Iterator[Token]:
+        """Turn scanned tokens into the token stream, replacing leading tabs
+        with OPEN and END tokens and dropping whitespace."""
+        at_line_start = True
+        line_indent = 0
+        prev_line_indent = 0
+
+        for token_type, token_val, token_pos in scanned:
             if at_line_start and token_type != 'TAB':
                 if line_indent > prev_line_indent:
                     for _ in range(line_indent-prev_line_indent):
-                        self.tokens.append(Token('OPEN'))
+                        yield Token('OPEN', pos=token_pos)
                 elif line_indent < prev_line_indent:
                     for _ in range(prev_line_indent-line_indent):
-                        self.tokens.append(Token('END'))
+                        yield Token('END', pos=token_pos)
 
             match token_type:
                 case 'NL':
@@ -73,40 +192,45 @@ class Lexer:
                     prev_line_indent = line_indent
                     line_indent = 0
 
-                    self.tokens.append(Token('NL'))
+                    yield Token('NL', pos=token_pos)
                 case 'TAB':
                     if at_line_start:
                         line_indent += 1
                 case 'WS':
                     continue
+                case 'ERROR' if token_val.isspace():
+                    # Whitespace outside of ASCII, e.g. a non-breaking space.
+                    continue
                 case 'ERROR':
                     print(f'Error: unexpected charachter "{token_val}"')
                     at_line_start = False
-                    self.tokens.append(Token(token_type, token_val))
+                    yield Token(token_type, token_val, token_pos)
                 case _:
                     at_line_start = False
-                    self.tokens.append(Token(token_type, token_val))
+                    yield Token(token_type, token_val, token_pos)
 
         for _ in range(prev_line_indent):
-            self.tokens.append(Token('END'))
-
-        if self.debug:
-            print(' '.join([t.type for t in self.tokens]))
+            yield Token('END')
 
     def peak(self) -> Token:
-        if len(self.tokens) > 0:
-            return self.tokens[0]
-        else:
-            return Token('EOF')
+        if len(self.tokens) == 0:
+            token = next(self.stream, None)
+            if token is None:
+                return Token('EOF')
+            self.tokens.append(token)
+
+        return self.tokens[0]
 
     def pop(self) -> Token:
+        token = self.peak()
+
         if self.debug:
-            print(self.peak().type)
+            print(token.type)
 
         if len(self.tokens) > 0:
-            return self.tokens.popleft()
-        else:
-            return Token('EOF')
+            self.tokens.popleft()
+
+        return token
 
     def assert_token(self, tok_t: str | list[str]) -> Token:
         if not isinstance(tok_t, list):
@@ -0,0 +1,242 @@
+import ctypes
+import json
+import os
+import struct
+import sys
+import time
+
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from contextlib import redirect_stdout
+from typing import TextIO
+
+from dtl.ast import File, Segment
+from dtl.document import Document, nested
+from dtl.export import segment_fields
+from dtl.tokenize import ParseError
+
+# Seconds between checks of the file's stat where inotify isn't available.
+POLL_INTERVAL = 0.1
+
+# Bytes before the previous end of the file that must be unchanged for the
+# file to count as appended to, so that only what follows them is read.
+TAIL_CHECK = 4096
+
+# struct inotify_event, followed by the `len` bytes of the name of the file.
+INOTIFY_EVENT = struct.Struct('iIII')
+IN_MODIFY = 0x002
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_CLOEXEC = 0o2000000
+
+type Change = tuple[str, Segment]
+
+def stat_key(path: str) -> tuple[int, int, int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def inotify_changes(path: str) -> Iterator[None] | None:
+    """Yield whenever `path` may have changed, as reported by inotify, or
+    return None if inotify isn't available (e.g. not on Linux).
+
+    The directory is watched rather than the file, since DTL replaces a file
+    by renaming a new one over it (see `dtl.files.write_file`).
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify_init1, inotify_add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    fd = inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        return None
+
+    directory, name = os.path.split(os.path.abspath(path))
+    if inotify_add_watch(fd, os.fsencode(directory), IN_MODIFY | IN_MOVED_TO | IN_CREATE) < 0:
+        os.close(fd)
+        return None
+
+    return inotify_events(fd, os.fsencode(name))
+
+def inotify_events(fd: int, name: bytes) -> Iterator[None]:
+    try:
+        while True:
+            events = os.read(fd, 64 * 1024)
+
+            changed = False
+            offset = 0
+            while offset < len(events):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(events, offset)
+                offset += INOTIFY_EVENT.size
+                changed = changed or events[offset:offset+length].rstrip(b'\0') == name
+                offset += length
+
+            if changed:
+                yield
+    finally:
+        os.close(fd)
+
+def polled_changes(path: str) -> Iterator[None]:
+    """Yield whenever the stat of `path` changes, checking it every POLL_INTERVAL seconds."""
+    return polled_events(path, stat_key(path))
+
+def polled_events(path: str, last: tuple[int, int, int] | None) -> Iterator[None]:
+    while True:
+        time.sleep(POLL_INTERVAL)
+
+        key = stat_key(path)
+        if key != last:
+            last = key
+            yield
+
+def difference(old: bytes | bytearray, new: bytes) -> tuple[int, int, bytes]:
+    """A single edit that turns `old` into `new`, as its offset, the number
+    of bytes it removes and the bytes it inserts, keeping their common
+    prefix and suffix."""
+    with memoryview(old) as view:
+        lo, hi = 0, min(len(old), len(new))
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if new.startswith(view[:mid]):
+                lo = mid
+            else:
+                hi = mid - 1
+        prefix = lo
+
+        lo, hi = 0, min(len(old), len(new)) - prefix
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if new.endswith(view[len(old)-mid:]):
+                lo = mid
+            else:
+                hi = mid - 1
+        suffix = lo
+
+    return prefix, len(old) - prefix - suffix, new[prefix:len(new)-suffix]
+
+class Tail:
+    """The parsed tree of a file, kept up to date as the file changes.
+
+    When the file was only appended to, only the appended lines are read and
+    only the blocks they go into are reparsed (see `Document.edit`). Lines
+    that aren't complete yet are left until they are. Any other change is
+    read in full, but still only reparsed around the part that changed.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        with open(path, 'rb') as file:
+            self.inode = os.fstat(file.fileno()).st_ino
+            self.document = Document(file.read())
+
+    def update(self) -> tuple[list[File | Segment], list[File | Segment]] | None:
+        """Read the changes to the file, if any, and return the nodes of the
+        tree they replaced and the nodes that replaced them.
+
+        Raises ParseError if the file doesn't parse, and FileNotFoundError
+        if it doesn't exist.
+        """
+        src = self.document.src
+
+        with open(self.path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+
+            appended = False
+            check = min(TAIL_CHECK, len(src))
+            if stat.st_ino == self.inode and stat.st_size > len(src):
+                file.seek(len(src) - check)
+                tail = file.read()
+                appended = tail[:check] == src[len(src)-check:]
+
+            if appended:
+                edit = (len(src), 0, tail[check:tail.rfind(b'\n')+1])
+            else:
+                file.seek(0)
+                edit = difference(src, file.read())
+
+        self.inode = stat.st_ino
+        if edit[1] == 0 and len(edit[2]) == 0:
+            return None
+
+        self.document.edit(*edit)
+        return self.document.changed
+
+def entries(nodes: Iterable[File | Segment]) -> Iterator[Segment]:
+    for node in nodes:
+        if isinstance(node, Segment) and node.description is not None:
+            yield node
+        yield from (segment for segment in nested(node) if segment.description is not None)
+
+def entry_changes(old: list[File | Segment], new: list[File | Segment]) -> list[Change]:
+    """('add', entry) for every entry under `new` that isn't under `old`, and
+    ('end', entry) for every entry that was ongoing under `old` and isn't
+    anymore, in file order. Entries are told apart by their start time and
+    description."""
+    before: defaultdict[tuple[int, str], list[Segment]] = defaultdict(list)
+    for entry in entries(old):
+        before[(entry.time.key, entry.description)].append(entry)
+
+    changes: list[Change] = []
+    for entry in entries(new):
+        same = before[(entry.time.key, entry.description)]
+        if len(same) == 0:
+            changes.append(('add', entry))
+            continue
+
+        previous = next((s for s in same if s.ongoing == entry.ongoing), same[0])
+        same.remove(previous)
+        if previous.ongoing and not entry.ongoing:
+            changes.append(('end', entry))
+
+    return changes
+
+def matches(description: str, pattern: str | None, mode: str) -> bool:
+    if pattern is None:
+        return True
+
+    match mode:
+        case 'exact':
+            return description == pattern
+        case 'prefix':
+            return description.startswith(pattern)
+        case 'substring':
+            return pattern in description
+        case _:
+            raise ValueError(f'unknown search mode "{mode}"')
+
+def watch(path: str, description: str | None, mode: str, out: TextIO) -> None:
+    """Write an event to `out` for every entry added to or ended in the file
+    `path` from now on, as JSON lines, until interrupted. Only entries whose
+    description matches `description` (see `DescriptionIndex.find`) are
+    reported, or every entry if it is None.
+
+    Raises ParseError if the file doesn't parse to begin with.
+    """
+    # Watched before the file is read, so that no change is missed.
+    changes = inotify_changes(path) or polled_changes(path)
+    tail = Tail(path)
+
+    for _ in changes:
+        try:
+            # The parser reports errors on stdout, which holds the events.
+            with redirect_stdout(sys.stderr):
+                changed = tail.update()
+        except FileNotFoundError:
+            # Until the file is back.
+            continue
+        except ParseError:
+            print(f'Error: can\'t parse file "{path}"', file=sys.stderr)
+            continue
+
+        if changed is None:
+            continue
+
+        for kind, entry in entry_changes(*changed):
+            if matches(entry.description, description, mode):
+                out.write(json.dumps({'event': kind, **segment_fields(entry)}) + '\n')
+        out.flush()
@@ -20,6 +20,9 @@ setup(
     ],
     packages=find_packages(),
     python_requires='>=3.10',
+    extras_require={
+        'numpy': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'dtl=dtl.cli:main',